@@ -3,20 +3,55 @@ Sistema de Banco de Horas - IPAJM
 Aplicação Flask com banco de dados, backup e autosave
 """
 
-from flask import Flask, render_template, jsonify, request, send_file
+from flask import Flask, Response, render_template, jsonify, request, send_file, make_response, stream_with_context, g, has_request_context
 from flask_sqlalchemy import SQLAlchemy
 from flask_cors import CORS
-from datetime import datetime, timedelta
+from sqlalchemy import event, func, type_coerce
+from sqlalchemy.engine import Engine
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.dialects import sqlite as dialeto_sqlite
+from sqlalchemy.orm import Session
+from sqlalchemy.exc import IntegrityError
+from datetime import date, datetime, timedelta, time as dt_time
 from werkzeug.security import generate_password_hash, check_password_hash
+from itsdangerous import URLSafeTimedSerializer, BadSignature
 import os
 import shutil
+import gzip
+import sqlite3
 import json
+import codecs
+import base64
+import hashlib
+import hmac
+from functools import wraps
+from contextlib import contextmanager
 from pathlib import Path
 import threading
+import queue
 import time
 import secrets
 import smtplib
 from email.mime.text import MIMEText
+from concurrent.futures import ThreadPoolExecutor, Future
+import sys
+import atexit
+import tempfile
+import unicodedata
+
+import click
+from openpyxl import Workbook, load_workbook
+from openpyxl.cell import WriteOnlyCell
+from openpyxl.styles import Font
+
+try:
+    import orjson  # opcional: serialização JSON mais rápida nas listagens
+except ImportError:
+    orjson = None
+
+# Referências 'app:funcao' gravadas pelo agendador também resolvem com `python app.py`
+if __name__ == '__main__':
+    sys.modules.setdefault('app', sys.modules[__name__])
 
 # Configuração da aplicação
 BASE_DIR = Path(__file__).resolve().parent
@@ -33,11 +68,63 @@ app.config['SQLALCHEMY_DATABASE_URI'] = os.environ.get('DATABASE_URL', f"sqlite:
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
 app.config['JSON_AS_ASCII'] = False
 app.config['BACKUP_FOLDER'] = str(default_backup_dir)
+app.config['AGENDADOR_ATIVO'] = os.environ.get('AGENDADOR_ATIVO', 'True') == 'True'
+app.config['AGENDADOR_LOCK'] = os.environ.get('AGENDADOR_LOCK', str(INSTANCE_DIR / 'agendador.lock'))
+app.config['SQLITE_PERFIL'] = os.environ.get('SQLITE_PERFIL', 'True') == 'True'
+app.config['FILA_ESCRITA_ATIVA'] = os.environ.get('FILA_ESCRITA_ATIVA', 'False') == 'True'
+app.config['METRICAS_DIR'] = os.environ.get('METRICAS_DIR', str(INSTANCE_DIR / 'metricas'))
+app.config['DETECTOR_CONSULTAS'] = os.environ.get('DETECTOR_CONSULTAS', 'False') == 'True'
+app.config['CONSULTA_LENTA_MS'] = float(os.environ.get('CONSULTA_LENTA_MS', '100'))
+app.config['N_MAIS_1_REPETICOES'] = int(os.environ.get('N_MAIS_1_REPETICOES', '5'))
+app.config['ORCAMENTO_CONSULTAS'] = int(os.environ.get('ORCAMENTO_CONSULTAS', '0'))  # 0 = sem limite global
+app.config['DETECTOR_ESTRITO'] = os.environ.get('DETECTOR_ESTRITO', 'False') == 'True'
+app.config['JSON_RAPIDO'] = os.environ.get('JSON_RAPIDO', 'auto')  # auto | orjson | padrao
+
+# Perfil de concorrência do SQLite (WAL, busy timeout, mmap, cache)
+SQLITE_BUSY_TIMEOUT_MS = int(os.environ.get('SQLITE_BUSY_TIMEOUT_MS', '5000'))
+SQLITE_MMAP_BYTES = int(os.environ.get('SQLITE_MMAP_BYTES', str(256 * 1024 * 1024)))
+SQLITE_CACHE_KB = int(os.environ.get('SQLITE_CACHE_KB', str(64 * 1024)))
+
+banco_sqlite_arquivo = (
+    app.config['SQLALCHEMY_DATABASE_URI'].startswith('sqlite')
+    and ':memory:' not in app.config['SQLALCHEMY_DATABASE_URI']
+    and app.config['SQLALCHEMY_DATABASE_URI'].rstrip('/') != 'sqlite:'
+)
+if app.config['SQLITE_PERFIL'] and banco_sqlite_arquivo:
+    # Conexões SQLite são baratas, mas o pool evita refazer os PRAGMAs a cada requisição
+    app.config['SQLALCHEMY_ENGINE_OPTIONS'] = {
+        'pool_size': int(os.environ.get('SQLITE_POOL_SIZE', '10')),
+        'max_overflow': int(os.environ.get('SQLITE_POOL_OVERFLOW', '20')),
+        'pool_timeout': 30,
+        'connect_args': {'timeout': SQLITE_BUSY_TIMEOUT_MS / 1000, 'check_same_thread': False},
+    }
 
 # Inicializar extensões
 db = SQLAlchemy(app)
 CORS(app)
 
+
+@event.listens_for(Engine, 'connect')
+def aplicar_perfil_sqlite(conexao_dbapi, registro_conexao):
+    """Aplica os PRAGMAs de concorrência em toda nova conexão SQLite.
+
+    WAL deixa leitores e o escritor trabalharem ao mesmo tempo; com
+    synchronous=NORMAL o fsync só acontece nos checkpoints; busy_timeout faz
+    a conexão esperar pelo lock em vez de falhar com "database is locked".
+    """
+    if not app.config['SQLITE_PERFIL'] or not isinstance(conexao_dbapi, sqlite3.Connection):
+        return
+    cursor = conexao_dbapi.cursor()
+    try:
+        cursor.execute(f'PRAGMA busy_timeout={SQLITE_BUSY_TIMEOUT_MS}')
+        cursor.execute('PRAGMA journal_mode=WAL')
+        cursor.execute('PRAGMA synchronous=NORMAL')
+        cursor.execute(f'PRAGMA mmap_size={SQLITE_MMAP_BYTES}')
+        cursor.execute(f'PRAGMA cache_size=-{SQLITE_CACHE_KB}')
+        cursor.execute('PRAGMA temp_store=MEMORY')
+    finally:
+        cursor.close()
+
 # ==================== MODELOS DO BANCO DE DADOS ====================
 
 class Servidor(db.Model):
@@ -46,10 +133,10 @@ class Servidor(db.Model):
     
     id = db.Column(db.Integer, primary_key=True)
     nf = db.Column(db.String(20), unique=True, nullable=False, index=True)
-    nome = db.Column(db.String(200), nullable=False)
+    nome = db.Column(db.String(200), nullable=False, index=True)
     setor = db.Column(db.String(100), nullable=False)
     criado_em = db.Column(db.DateTime, default=datetime.utcnow)
-    atualizado_em = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    atualizado_em = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow, index=True)
     
     # Relacionamento com dias trabalhados
     dias_trabalhados = db.relationship('DiaTrabalhado', backref='servidor', lazy=True, cascade='all, delete-orphan')
@@ -70,13 +157,13 @@ class DiaTrabalhado(db.Model):
     __tablename__ = 'dias_trabalhados'
     
     id = db.Column(db.Integer, primary_key=True)
-    nf = db.Column(db.String(20), db.ForeignKey('servidores.nf'), nullable=False, index=True)
+    nf = db.Column(db.String(20), db.ForeignKey('servidores.nf'), nullable=False)
     nome = db.Column(db.String(200), nullable=False)
     setor = db.Column(db.String(100), nullable=False)
     vinculo = db.Column(db.String(50))
     
     # Datas e horários
-    dia_trabalhado = db.Column(db.Date)
+    dia_trabalhado = db.Column(db.Date, index=True)
     entrada = db.Column(db.String(5))  # HH:MM
     saida = db.Column(db.String(5))    # HH:MM
     h_trab = db.Column(db.String(5))   # HH:MM calculado
@@ -93,12 +180,26 @@ class DiaTrabalhado(db.Model):
     h_descontadas = db.Column(db.String(10))
     saldo = db.Column(db.String(10))
     
+    # Mesmas quantidades em minutos inteiros (para SUM/AVG direto no SQL)
+    h_trab_min = db.Column(db.Integer)
+    h_direito_min = db.Column(db.Integer)
+    h_totais_min = db.Column(db.Integer)
+    h_descontadas_min = db.Column(db.Integer)
+    saldo_min = db.Column(db.Integer)
+    
     # Observações (para número do processo E-Docs, etc.)
     observacao = db.Column(db.Text)
     
     # Metadados
     criado_em = db.Column(db.DateTime, default=datetime.utcnow)
-    atualizado_em = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    atualizado_em = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow, index=True)
+    
+    # Índices casados com os filtros + ORDER BY das listagens (o rowid completa a chave do keyset)
+    __table_args__ = (
+        db.Index('ix_dias_trabalhados_nf_dia', 'nf', 'dia_trabalhado'),
+        db.Index('ix_dias_trabalhados_setor_dia', 'setor', 'dia_trabalhado'),
+        db.Index('ix_dias_trabalhados_prazo_nome', 'prazo_max', 'nome'),
+    )
     
     def to_dict(self):
         return {
@@ -125,6 +226,167 @@ class DiaTrabalhado(db.Model):
         }
 
 
+# Campos HH:MM espelhados em minutos inteiros (campo texto -> coluna *_min)
+CAMPOS_MINUTOS_REGISTRO = {
+    'h_trab': 'h_trab_min',
+    'h_direito': 'h_direito_min',
+    'h_totais': 'h_totais_min',
+    'h_descontadas': 'h_descontadas_min',
+    'saldo': 'saldo_min',
+}
+
+
+@event.listens_for(DiaTrabalhado, 'before_insert')
+@event.listens_for(DiaTrabalhado, 'before_update')
+def sincronizar_minutos_registro(mapper, connection, registro):
+    """Mantém as colunas *_min coerentes com os campos HH:MM em qualquer escrita via ORM"""
+    for campo, campo_min in CAMPOS_MINUTOS_REGISTRO.items():
+        setattr(registro, campo_min, hora_para_minutos(getattr(registro, campo)))
+
+
+class SaldoServidor(db.Model):
+    """Saldo consolidado por servidor, mantido na mesma transação das escritas em dias_trabalhados"""
+    __tablename__ = 'saldos_servidores'
+
+    nf = db.Column(db.String(20), primary_key=True)
+    h_trab_min = db.Column(db.Integer, nullable=False, default=0)
+    h_direito_min = db.Column(db.Integer, nullable=False, default=0)
+    h_descontadas_min = db.Column(db.Integer, nullable=False, default=0)
+    total_registros = db.Column(db.Integer, nullable=False, default=0)
+    atualizado_em = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+    @property
+    def saldo_min(self):
+        return self.h_direito_min - self.h_descontadas_min
+
+
+def recalcular_saldos_servidores(conn, nfs=None):
+    """Recalcula saldos_servidores a partir de dias_trabalhados.
+
+    Com `nfs` recalcula apenas esses servidores; sem, reconstrói a tabela inteira.
+    Usa a conexão recebida para rodar dentro da transação de quem chamou.
+    """
+    saldos = SaldoServidor.__table__
+    consulta = db.select(
+        DiaTrabalhado.nf,
+        func.coalesce(func.sum(DiaTrabalhado.h_trab_min), 0),
+        func.coalesce(func.sum(DiaTrabalhado.h_direito_min), 0),
+        func.coalesce(func.sum(DiaTrabalhado.h_descontadas_min), 0),
+        func.count()
+    ).group_by(DiaTrabalhado.nf)
+
+    if nfs is None:
+        conn.execute(saldos.delete())
+    else:
+        nfs = list(nfs)
+        if not nfs:
+            return 0
+        conn.execute(saldos.delete().where(saldos.c.nf.in_(nfs)))
+        consulta = consulta.where(DiaTrabalhado.nf.in_(nfs))
+
+    agora = datetime.utcnow()
+    valores = [
+        {
+            'nf': nf,
+            'h_trab_min': trab,
+            'h_direito_min': direito,
+            'h_descontadas_min': descontadas,
+            'total_registros': total,
+            'atualizado_em': agora
+        }
+        for nf, trab, direito, descontadas, total in conn.execute(consulta)
+    ]
+    if valores:
+        conn.execute(saldos.insert(), valores)
+    return len(valores)
+
+
+@event.listens_for(Session, 'after_flush')
+def atualizar_saldos_apos_flush(session, flush_context):
+    """Recalcula o saldo dos servidores cujos registros mudaram neste flush"""
+    nfs = set()
+    for obj in list(session.new) + list(session.dirty) + list(session.deleted):
+        if not isinstance(obj, DiaTrabalhado):
+            continue
+        if obj.nf:
+            nfs.add(obj.nf)
+        # Se o NF do registro mudou, o servidor antigo também precisa ser recalculado
+        nfs.update(n for n in db.inspect(obj).attrs.nf.history.deleted if n)
+    if nfs:
+        recalcular_saldos_servidores(session.connection(), nfs)
+
+
+class VersaoTabela(db.Model):
+    """Versão dos dados de cada tabela, incrementada a cada escrita"""
+    __tablename__ = 'versoes_tabelas'
+
+    tabela = db.Column(db.String(50), primary_key=True)
+    versao = db.Column(db.Integer, nullable=False, default=0)
+
+
+class CacheResultado(db.Model):
+    """Resultados calculados compartilhados entre workers, válidos para uma assinatura de versões"""
+    __tablename__ = 'cache_resultados'
+
+    chave = db.Column(db.String(120), primary_key=True)
+    versao = db.Column(db.String(200), nullable=False)
+    valor = db.Column(db.Text, nullable=False)
+    atualizado_em = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+
+# Tabelas cujas escritas invalidam caches e versões
+TABELAS_VERSIONADAS = {Servidor: 'servidores', DiaTrabalhado: 'dias_trabalhados'}
+
+
+def incrementar_versoes(conn, tabelas):
+    """Incrementa a versão das tabelas informadas na transação da conexão"""
+    versoes = VersaoTabela.__table__
+    for tabela in tabelas:
+        resultado = conn.execute(
+            versoes.update().where(versoes.c.tabela == tabela).values(versao=versoes.c.versao + 1)
+        )
+        if resultado.rowcount == 0:
+            conn.execute(versoes.insert().values(tabela=tabela, versao=1))
+
+
+@event.listens_for(Session, 'after_flush')
+def incrementar_versoes_apos_flush(session, flush_context):
+    """Marca como alteradas as tabelas versionadas tocadas neste flush"""
+    tabelas = set()
+    for obj in list(session.new) + list(session.dirty) + list(session.deleted):
+        tabela = TABELAS_VERSIONADAS.get(type(obj))
+        if tabela:
+            tabelas.add(tabela)
+    if tabelas:
+        incrementar_versoes(session.connection(), sorted(tabelas))
+
+
+class Alteracao(db.Model):
+    """Diário de alterações (sequência monotônica) para sincronização incremental dos clientes"""
+    __tablename__ = 'alteracoes'
+    __table_args__ = {'sqlite_autoincrement': True}
+
+    id = db.Column(db.Integer, primary_key=True)
+    tabela = db.Column(db.String(50), nullable=False)
+    registro_id = db.Column(db.Integer, nullable=True)
+    operacao = db.Column(db.String(10), nullable=False)  # upsert | delete | reset
+    criado_em = db.Column(db.DateTime, default=datetime.utcnow, index=True)
+
+
+@event.listens_for(Session, 'after_flush')
+def registrar_alteracoes_apos_flush(session, flush_context):
+    """Grava no diário cada servidor/registro criado, alterado ou removido neste flush"""
+    agora = datetime.utcnow()
+    entradas = []
+    for objetos, operacao in ((session.new, 'upsert'), (session.dirty, 'upsert'), (session.deleted, 'delete')):
+        for obj in objetos:
+            tabela = TABELAS_VERSIONADAS.get(type(obj))
+            if tabela and obj.id is not None:
+                entradas.append({'tabela': tabela, 'registro_id': obj.id, 'operacao': operacao, 'criado_em': agora})
+    if entradas:
+        session.connection().execute(Alteracao.__table__.insert(), entradas)
+
+
 class UsuarioSistema(db.Model):
     """Usuários de autenticação do sistema"""
     __tablename__ = 'usuarios_sistema'
@@ -134,6 +396,7 @@ class UsuarioSistema(db.Model):
     password_hash = db.Column(db.String(255), nullable=False)
     role = db.Column(db.String(20), nullable=False, default='user')  # admin | user
     email = db.Column(db.String(255), nullable=True)
+    email_resumo = db.Column(db.Boolean, nullable=False, default=False)  # um e-mail diário com todos os alertas
     ativo = db.Column(db.Boolean, default=True)
     criado_em = db.Column(db.DateTime, default=datetime.utcnow)
     atualizado_em = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
@@ -150,6 +413,7 @@ class UsuarioSistema(db.Model):
             'username': self.username,
             'role': self.role,
             'email': self.email,
+            'email_resumo': self.email_resumo,
             'ativo': self.ativo
         }
 
@@ -177,6 +441,40 @@ class LogEmailAlerta(db.Model):
     enviado_em = db.Column(db.DateTime, default=datetime.utcnow)
 
 
+class EmailPendente(db.Model):
+    """Fila persistente (outbox) de e-mails, com status de entrega por destinatário"""
+    __tablename__ = 'fila_emails'
+
+    id = db.Column(db.Integer, primary_key=True)
+    destinatario = db.Column(db.String(255), nullable=False)
+    assunto = db.Column(db.String(255), nullable=False)
+    corpo = db.Column(db.Text, nullable=False)
+    registro_id = db.Column(db.Integer, nullable=True, index=True)
+    status = db.Column(db.String(20), nullable=False, default='pendente')  # pendente | enviando | enviado | falhou
+    tentativas = db.Column(db.Integer, nullable=False, default=0)
+    proxima_tentativa = db.Column(db.DateTime, default=datetime.utcnow)
+    ultimo_erro = db.Column(db.Text)
+    criado_em = db.Column(db.DateTime, default=datetime.utcnow)
+    atualizado_em = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    enviado_em = db.Column(db.DateTime)
+
+    __table_args__ = (db.Index('ix_fila_emails_status_proxima', 'status', 'proxima_tentativa'),)
+
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'destinatario': self.destinatario,
+            'assunto': self.assunto,
+            'registro_id': self.registro_id,
+            'status': self.status,
+            'tentativas': self.tentativas,
+            'proxima_tentativa': self.proxima_tentativa.isoformat() if self.proxima_tentativa else None,
+            'ultimo_erro': self.ultimo_erro,
+            'criado_em': self.criado_em.isoformat() if self.criado_em else None,
+            'enviado_em': self.enviado_em.isoformat() if self.enviado_em else None
+        }
+
+
 # ==================== FUNÇÕES DE BACKUP ====================
 
 def calcular_diferenca_horas(entrada, saida):
@@ -309,22 +607,125 @@ def obter_caminho_banco_sqlite():
     return db_path
 
 
+BACKUP_PAGINAS_POR_PASSO = 256   # páginas copiadas por passo da API de backup
+BACKUP_PAUSA_ENTRE_PASSOS = 0.005  # segundos livres para outras conexões entre passos
+backup_lock = threading.Lock()
+
+
+def caminho_manifesto_backups():
+    return Path(app.config['BACKUP_FOLDER']) / 'manifest.json'
+
+
+def carregar_manifesto_backups():
+    """Lê o manifesto de backups; se não existir, monta a partir dos arquivos da pasta"""
+    caminho = caminho_manifesto_backups()
+    if caminho.exists():
+        try:
+            return json.loads(caminho.read_text(encoding='utf-8'))
+        except Exception as e:
+            print(f"Manifesto de backups inválido, reconstruindo: {e}")
+
+    backups = []
+    pasta = Path(app.config['BACKUP_FOLDER'])
+    for arquivo in sorted(list(pasta.glob('backup_*.db')) + list(pasta.glob('backup_*.db.gz'))):
+        stat = arquivo.stat()
+        backups.append({
+            'arquivo': arquivo.name,
+            'tamanho': stat.st_size,
+            'criado_em': datetime.fromtimestamp(stat.st_mtime).isoformat(),
+            'sha256': None
+        })
+    return {'backups': backups, 'assinatura_arquivo': None}
+
+
+def salvar_manifesto_backups(manifesto):
+    """Grava o manifesto de forma atômica (arquivo temporário + replace)"""
+    caminho = caminho_manifesto_backups()
+    temporario = caminho.with_suffix('.json.tmp')
+    temporario.write_text(json.dumps(manifesto, ensure_ascii=False, indent=2), encoding='utf-8')
+    os.replace(temporario, caminho)
+
+
+def assinatura_arquivo_banco(db_path):
+    """Tamanho e mtime do banco (e do -wal): se não mudaram, o banco não mudou"""
+    partes = []
+    for caminho in (db_path, Path(f'{db_path}-wal')):
+        if caminho.exists():
+            stat = caminho.stat()
+            partes.append(f'{caminho.name}:{stat.st_size}:{stat.st_mtime_ns}')
+    return '|'.join(partes)
+
+
+def gerar_backup():
+    """Gera backup consistente e comprimido do banco.
+
+    Usa a API de backup online do SQLite em passos de poucas páginas, para
+    não bloquear a aplicação, e comprime o snapshot em gzip. Se o conteúdo
+    for idêntico ao último backup, nenhum arquivo novo é guardado.
+    Retorna (caminho do backup, True se foi criado um novo arquivo).
+    """
+    db_path = obter_caminho_banco_sqlite()
+    if not db_path or not db_path.exists():
+        return None, False
+
+    pasta = Path(app.config['BACKUP_FOLDER'])
+    with backup_lock:
+        manifesto = carregar_manifesto_backups()
+        ultimo = manifesto['backups'][-1] if manifesto['backups'] else None
+        assinatura = assinatura_arquivo_banco(db_path)
+
+        # Arquivo do banco intocado desde o último backup: nada a fazer
+        if ultimo and assinatura == manifesto.get('assinatura_arquivo'):
+            return str(pasta / ultimo['arquivo']), False
+
+        timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
+        snapshot = pasta / f'backup_{timestamp}.db.tmp'
+        destino_gz = pasta / f'backup_{timestamp}.db.gz'
+        try:
+            origem = sqlite3.connect(str(db_path))
+            destino = sqlite3.connect(str(snapshot))
+            try:
+                origem.backup(destino, pages=BACKUP_PAGINAS_POR_PASSO, sleep=BACKUP_PAUSA_ENTRE_PASSOS)
+            finally:
+                destino.close()
+                origem.close()
+
+            sha256 = hashlib.sha256()
+            with open(snapshot, 'rb') as f:
+                for bloco in iter(lambda: f.read(1024 * 1024), b''):
+                    sha256.update(bloco)
+            sha256 = sha256.hexdigest()
+
+            manifesto['assinatura_arquivo'] = assinatura
+            if ultimo and ultimo.get('sha256') == sha256:
+                salvar_manifesto_backups(manifesto)
+                return str(pasta / ultimo['arquivo']), False
+
+            with open(snapshot, 'rb') as f_in, gzip.open(destino_gz, 'wb', compresslevel=6) as f_out:
+                shutil.copyfileobj(f_in, f_out, 1024 * 1024)
+
+            manifesto['backups'].append({
+                'arquivo': destino_gz.name,
+                'tamanho': destino_gz.stat().st_size,
+                'tamanho_original': snapshot.stat().st_size,
+                'criado_em': datetime.now().isoformat(),
+                'sha256': sha256
+            })
+            salvar_manifesto_backups(manifesto)
+        finally:
+            if snapshot.exists():
+                snapshot.unlink()
+
+        # Manter apenas os últimos 30 backups
+        limpar_backups_antigos()
+        return str(destino_gz), True
+
+
 def criar_backup():
     """Cria backup do banco de dados"""
     try:
-        timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
-        backup_filename = f'backup_{timestamp}.db'
-        backup_path = os.path.join(app.config['BACKUP_FOLDER'], backup_filename)
-        
-        # Copiar banco de dados
-        db_path = obter_caminho_banco_sqlite()
-        if db_path and db_path.exists():
-            shutil.copy2(db_path, backup_path)
-            
-            # Manter apenas os últimos 30 backups
-            limpar_backups_antigos()
-            
-            return backup_path
+        backup_path, _ = gerar_backup()
+        return backup_path
     except Exception as e:
         print(f"Erro ao criar backup: {e}")
         return None
@@ -333,26 +734,26 @@ def criar_backup():
 def limpar_backups_antigos(manter=30):
     """Remove backups antigos, mantendo apenas os N mais recentes"""
     try:
-        backups = sorted(Path(app.config['BACKUP_FOLDER']).glob('backup_*.db'))
-        if len(backups) > manter:
-            for backup in backups[:-manter]:
-                backup.unlink()
+        manifesto = carregar_manifesto_backups()
+        if len(manifesto['backups']) > manter:
+            for item in manifesto['backups'][:-manter]:
+                arquivo = Path(app.config['BACKUP_FOLDER']) / item['arquivo']
+                if arquivo.exists():
+                    arquivo.unlink()
+            manifesto['backups'] = manifesto['backups'][-manter:]
+            salvar_manifesto_backups(manifesto)
     except Exception as e:
         print(f"Erro ao limpar backups antigos: {e}")
 
 
-def backup_automatico():
-    """Thread para criar backups automáticos a cada 6 horas"""
-    while True:
-        time.sleep(6 * 60 * 60)  # 6 horas
-        criar_backup()
-        print(f"Backup automático criado em {datetime.now()}")
-
-
 
 
 def semear_usuarios_iniciais():
-    """Cria usuários iniciais do sistema, se não existirem."""
+    """Cria usuários iniciais do sistema, se não existirem.
+
+    Executado uma vez no bootstrap: uma única consulta verifica quem já existe
+    e o hash de senha só é calculado para os usuários que faltam.
+    """
     usuarios = [
         ('admin', '260220', 'admin', None),
         ('Maria', '1234', 'user', 'maria.nery@ipajm.es.gov.br'),
@@ -361,17 +762,77 @@ def semear_usuarios_iniciais():
         ('Máira', '1234', 'user', 'maira.braga@ipajm.es.gov.br')
     ]
 
-    for username, senha, role, email in usuarios:
-        existente = UsuarioSistema.query.filter_by(username=username).first()
-        if not existente:
-            u = UsuarioSistema(username=username, role=role, email=email, ativo=True)
-            u.set_password(senha)
-            db.session.add(u)
-    db.session.commit()
+    existentes = {
+        username for (username,) in db.session.query(UsuarioSistema.username).filter(
+            UsuarioSistema.username.in_([u[0] for u in usuarios])
+        )
+    }
+    faltantes = [u for u in usuarios if u[0] not in existentes]
+    if not faltantes:
+        return
+
+    for username, senha, role, email in faltantes:
+        u = UsuarioSistema(username=username, role=role, email=email, ativo=True)
+        u.set_password(senha)
+        db.session.add(u)
+    try:
+        db.session.commit()
+    except IntegrityError:
+        # Outro worker semeou ao mesmo tempo
+        db.session.rollback()
+
+
+# ==================== SESSÃO (TOKENS ASSINADOS) ====================
+
+SESSAO_VALIDADE = int(os.environ.get('SESSAO_VALIDADE', str(8 * 60 * 60)))  # segundos
+
+
+def serializador_sessao():
+    return URLSafeTimedSerializer(app.config['SECRET_KEY'], salt='sessao-usuario')
+
+
+def impressao_senha(usuario):
+    """Trecho do hash da senha embutido no token: trocar a senha invalida as sessões"""
+    return hashlib.sha256(usuario.password_hash.encode('utf-8')).hexdigest()[:16]
+
+
+def gerar_token_sessao(usuario):
+    """Token de sessão assinado (HMAC), emitido no login"""
+    return serializador_sessao().dumps({'id': usuario.id, 'senha': impressao_senha(usuario)})
+
+
+def usuario_do_token(token):
+    """Valida o token de sessão (checagem HMAC barata) e retorna o usuário ativo"""
+    if not token:
+        return None
+    try:
+        dados = serializador_sessao().loads(token, max_age=SESSAO_VALIDADE)
+    except BadSignature:
+        return None
+
+    usuario = db.session.get(UsuarioSistema, dados.get('id'))
+    if not usuario or not usuario.ativo:
+        return None
+    if not hmac.compare_digest(dados.get('senha', ''), impressao_senha(usuario)):
+        return None
+    return usuario
+
+
+def token_da_requisicao(data):
+    """Token enviado no cabeçalho Authorization (Bearer) ou no campo admin_token"""
+    cabecalho = request.headers.get('Authorization', '')
+    if cabecalho.startswith('Bearer '):
+        return cabecalho[len('Bearer '):].strip()
+    return (data or {}).get('admin_token')
 
 
 def verificar_admin_payload(data):
-    """Valida credenciais de admin no payload."""
+    """Valida o admin pelo token de sessão; credenciais no payload ficam como alternativa."""
+    token = token_da_requisicao(data)
+    if token:
+        admin = usuario_do_token(token)
+        return admin if admin and admin.role == 'admin' else None
+
     username = (data or {}).get('admin_user')
     password = (data or {}).get('admin_password')
     if not username or not password:
@@ -383,18 +844,62 @@ def verificar_admin_payload(data):
     return None
 
 
-def enviar_email_alerta(destinatario, servidor_nome, nf, prazo_max):
-    """Envia e-mail real de alerta de prazo via SMTP."""
+DIAS_ALERTA_EMAIL = 30
+
+
+def data_hoje():
+    """Data de referência de "hoje" (fuso local do servidor) para alertas, calendário e relatórios.
+
+    Rotas e o job de e-mail usam a mesma função para não discordarem sobre
+    quais registros estão a 30 dias do prazo entre a meia-noite local e a UTC.
+    """
+    return date.today()
+
+
+def configuracao_smtp():
+    """Lê a configuração SMTP do ambiente; None se SMTP_HOST não estiver definido.
+
+    SMTP_USER/SMTP_PASS e STARTTLS são opcionais, para permitir um servidor
+    SMTP local de testes (ex.: python -m aiosmtpd -n -l localhost:1025).
+    """
     smtp_host = os.environ.get('SMTP_HOST')
-    smtp_port = int(os.environ.get('SMTP_PORT', '587'))
+    if not smtp_host:
+        return None
     smtp_user = os.environ.get('SMTP_USER')
-    smtp_pass = os.environ.get('SMTP_PASS')
-    smtp_from = os.environ.get('SMTP_FROM', smtp_user or 'noreply@ipajm.es.gov.br')
+    return {
+        'host': smtp_host,
+        'port': int(os.environ.get('SMTP_PORT', '587')),
+        'user': smtp_user,
+        'password': os.environ.get('SMTP_PASS'),
+        'from': os.environ.get('SMTP_FROM', smtp_user or 'noreply@ipajm.es.gov.br'),
+        'starttls': os.environ.get('SMTP_STARTTLS', 'True') == 'True'
+    }
+
+
+def abrir_conexao_smtp(config):
+    """Abre uma sessão SMTP (connect, STARTTLS, login) para ser reaproveitada em vários envios"""
+    server = smtplib.SMTP(config['host'], config['port'], timeout=20)
+    try:
+        if config['starttls']:
+            server.starttls()
+        if config['user'] and config['password']:
+            server.login(config['user'], config['password'])
+    except Exception:
+        server.close()
+        raise
+    return server
 
-    if not smtp_host or not smtp_user or not smtp_pass:
-        print('[EMAIL] SMTP não configurado. Defina SMTP_HOST, SMTP_PORT, SMTP_USER e SMTP_PASS.')
-        return False
 
+def montar_email(config, destinatario, assunto, corpo):
+    msg = MIMEText(corpo, _charset='utf-8')
+    msg['Subject'] = assunto
+    msg['From'] = config['from']
+    msg['To'] = destinatario
+    return msg
+
+
+def texto_email_alerta(servidor_nome, nf, prazo_max):
+    """Assunto e corpo do alerta de prazo de um registro"""
     assunto = f"[Banco de Horas] Alerta de prazo - {servidor_nome}"
     corpo = (
         f"Olá,\n\n"
@@ -403,180 +908,1184 @@ def enviar_email_alerta(destinatario, servidor_nome, nf, prazo_max):
         f"Atenção: acesse o sistema de Banco de Horas para verificar os detalhes e providências.\n\n"
         f"Mensagem automática do sistema."
     )
+    return assunto, corpo
 
-    msg = MIMEText(corpo, _charset='utf-8')
-    msg['Subject'] = assunto
-    msg['From'] = smtp_from
-    msg['To'] = destinatario
 
-    try:
-        with smtplib.SMTP(smtp_host, smtp_port, timeout=20) as server:
-            server.starttls()
-            server.login(smtp_user, smtp_pass)
-            server.sendmail(smtp_from, [destinatario], msg.as_string())
-        return True
-    except Exception as e:
-        print(f'[EMAIL] Falha ao enviar e-mail para {destinatario}: {e}')
-        return False
+def texto_email_resumo(registros):
+    """Assunto e corpo do resumo diário com todos os registros em alerta"""
+    assunto = f"[Banco de Horas] Alertas de prazo - {len(registros)} registro(s)"
+    linhas = [
+        f"- {r.nome or 'Servidor'} (NF {r.nf}) - prazo máx.: {r.prazo_max.strftime('%d/%m/%Y')}"
+        for r in registros
+    ]
+    corpo = (
+        f"Olá,\n\n"
+        f"Os registros abaixo atingiram o marco de 30 dias para o prazo máximo "
+        f"de uso do banco de horas:\n\n"
+        + '\n'.join(linhas)
+        + "\n\nAtenção: acesse o sistema de Banco de Horas para verificar os detalhes e providências.\n\n"
+        f"Mensagem automática do sistema."
+    )
+    return assunto, corpo
 
 
 def processar_alertas_email_30_dias():
-    """Verifica alertas de 30 dias e envia e-mail apenas uma vez por dia/registro."""
-    hoje = datetime.utcnow().date()
-    registros = DiaTrabalhado.query.filter(DiaTrabalhado.prazo_max.isnot(None)).all()
+    """Verifica alertas de 30 dias e enfileira e-mail apenas uma vez por dia/registro.
+
+    Usa o índice de prazo_max para buscar só os registros do dia e uma consulta
+    para os alertas já tratados. Os e-mails vão para a fila (fila_emails) e são
+    enviados por processar_fila_emails. Destinatários com email_resumo
+    recebem um único e-mail com todos os registros do dia.
+    """
+    hoje = data_hoje()
+    registros = (
+        DiaTrabalhado.query
+        .filter(DiaTrabalhado.prazo_max == hoje + timedelta(days=DIAS_ALERTA_EMAIL))
+        .order_by(DiaTrabalhado.nome)
+        .all()
+    )
+    if not registros:
+        return
+
+    ja_enviados = {
+        registro_id for (registro_id,) in db.session.query(LogEmailAlerta.registro_id).filter(
+            LogEmailAlerta.data_alerta == hoje,
+            LogEmailAlerta.registro_id.in_([r.id for r in registros])
+        )
+    }
+    registros = [r for r in registros if r.id not in ja_enviados]
+    if not registros:
+        return
 
-    usuarios_email = UsuarioSistema.query.filter(
+    usuarios_email = db.session.query(UsuarioSistema.email, UsuarioSistema.email_resumo).filter(
         UsuarioSistema.role == 'user',
         UsuarioSistema.ativo == True,
         UsuarioSistema.email.isnot(None)
     ).all()
-    emails_destino = [u.email for u in usuarios_email if u.email]
+    emails_resumo = [email for email, resumo in usuarios_email if email and resumo]
+    emails_individuais = [email for email, resumo in usuarios_email if email and not resumo]
 
-    if not emails_destino:
+    if not emails_resumo and not emails_individuais:
         return
 
-    for r in registros:
-        if not r.prazo_max:
-            continue
-        dias = (r.prazo_max - hoje).days
-        if dias != 30:
-            continue
-
-        ja_enviado = LogEmailAlerta.query.filter_by(registro_id=r.id, data_alerta=hoje).first()
-        if ja_enviado:
-            continue
+    if not configuracao_smtp():
+        print('[EMAIL] SMTP não configurado. Defina SMTP_HOST, SMTP_PORT, SMTP_USER e SMTP_PASS.')
+        return
 
-        servidor_nome = r.nome or 'Servidor'
-        prazo_str = r.prazo_max.strftime('%d/%m/%Y') if r.prazo_max else '-'
+    # O envio fica com a fila; o log marca o alerta como tratado na mesma transação
+    if emails_resumo:
+        assunto, corpo = texto_email_resumo(registros)
+        for email in emails_resumo:
+            enfileirar_email(email, assunto, corpo)
+    if emails_individuais:
+        for r in registros:
+            assunto, corpo = texto_email_alerta(r.nome or 'Servidor', r.nf, r.prazo_max.strftime('%d/%m/%Y'))
+            for email in emails_individuais:
+                enfileirar_email(email, assunto, corpo, registro_id=r.id)
+
+    db.session.add_all([LogEmailAlerta(registro_id=r.id, data_alerta=hoje) for r in registros])
+    db.session.commit()
 
-        sucesso_geral = True
-        for email in emails_destino:
-            ok = enviar_email_alerta(email, servidor_nome, r.nf, prazo_str)
-            sucesso_geral = sucesso_geral and ok
 
-        if sucesso_geral:
-            db.session.add(LogEmailAlerta(registro_id=r.id, data_alerta=hoje))
-            db.session.commit()
+# ==================== FILA DE E-MAILS ====================
 
+EMAIL_MAX_TENTATIVAS = 5
+EMAIL_ESPERA_BASE = 60           # segundos; dobra a cada nova tentativa
+EMAIL_ESPERA_MAXIMA = 6 * 60 * 60
+EMAIL_TEMPO_ENVIANDO = 10 * 60   # "enviando" há mais tempo que isso volta para a fila
+EMAIL_LOTE_FILA = 200
 
-def alerta_email_automatico():
-    """Thread para checagem periódica de alertas por e-mail."""
-    while True:
-        try:
-            with app.app_context():
-                processar_alertas_email_30_dias()
-        except Exception as e:
-            print(f'Erro no alerta automático por e-mail: {e}')
-        time.sleep(60 * 60)
+executor_emails = None
 
 
-# ==================== ROTAS DA API ====================
+def enfileirar_email(destinatario, assunto, corpo, registro_id=None):
+    """Adiciona um e-mail à fila (o commit fica com quem chamou)"""
+    email = EmailPendente(destinatario=destinatario, assunto=assunto, corpo=corpo, registro_id=registro_id)
+    db.session.add(email)
+    return email
 
-@app.route('/')
-def index():
-    """Página principal"""
-    return render_template('index.html')
 
+def enviar_lote_emails(config, mensagens):
+    """Envia mensagens [(id, destinatario, assunto, corpo)] em uma única sessão SMTP.
 
+    Roda nas threads do pool, sem tocar no banco. Retorna [(id, erro ou None)].
+    """
+    try:
+        conexao = abrir_conexao_smtp(config)
+    except Exception as e:
+        return [(email_id, f'Falha ao conectar: {e}') for email_id, *_ in mensagens]
 
+    resultados = []
+    with conexao:
+        for email_id, destinatario, assunto, corpo in mensagens:
+            try:
+                msg = montar_email(config, destinatario, assunto, corpo)
+                conexao.sendmail(config['from'], [destinatario], msg.as_string())
+                resultados.append((email_id, None))
+            except Exception as e:
+                resultados.append((email_id, str(e)))
+    return resultados
+
+
+def processar_fila_emails(limite=EMAIL_LOTE_FILA):
+    """Envia os e-mails vencidos da fila, por padrão em uma única conexão SMTP.
+
+    Com EMAIL_WORKERS > 1 o lote é dividido entre threads, cada uma com sua
+    conexão; falhas voltam para a fila com espera exponencial até
+    EMAIL_MAX_TENTATIVAS.
+    """
+    global executor_emails
+    config = configuracao_smtp()
+    if not config:
+        return 0
 
-@app.route('/api/auth/login', methods=['POST'])
-def auth_login():
-    data = request.json or {}
-    username = (data.get('username') or '').strip()
-    password = data.get('password') or ''
+    agora = datetime.utcnow()
+
+    # Mensagens presas em "enviando" (processo interrompido) voltam para a fila
+    EmailPendente.query.filter(
+        EmailPendente.status == 'enviando',
+        EmailPendente.atualizado_em < agora - timedelta(seconds=EMAIL_TEMPO_ENVIANDO)
+    ).update({'status': 'pendente'}, synchronize_session=False)
+
+    # Tuplas simples: o commit abaixo expira objetos ORM, o que custaria um SELECT por e-mail
+    emails = (
+        db.session.query(EmailPendente.id, EmailPendente.destinatario, EmailPendente.assunto,
+                         EmailPendente.corpo, EmailPendente.tentativas)
+        .filter(EmailPendente.status == 'pendente', EmailPendente.proxima_tentativa <= agora)
+        .order_by(EmailPendente.proxima_tentativa, EmailPendente.id)
+        .limit(limite)
+        .all()
+    )
+    if not emails:
+        db.session.commit()
+        return 0
 
-    # Garantir usuários iniciais (útil em ambiente WSGI/deploy)
-    semear_usuarios_iniciais()
+    ids = [e.id for e in emails]
+    EmailPendente.query.filter(EmailPendente.id.in_(ids)).update(
+        {'status': 'enviando', 'atualizado_em': agora}, synchronize_session=False)
+    db.session.commit()
 
-    user = UsuarioSistema.query.filter_by(username=username, ativo=True).first()
-    if not user or not user.check_password(password):
-        return jsonify({'error': 'Usuário ou senha inválidos'}), 401
+    workers = max(1, int(os.environ.get('EMAIL_WORKERS', '1')))
+    if executor_emails is None:
+        executor_emails = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='email')
 
-    return jsonify({
-        'username': user.username,
-        'role': user.role,
-        'email': user.email
-    })
+    partes = [
+        [(e.id, e.destinatario, e.assunto, e.corpo) for e in emails[i::workers]]
+        for i in range(workers)
+    ]
+    resultados = {}
+    for parte in executor_emails.map(lambda p: enviar_lote_emails(config, p), [p for p in partes if p]):
+        resultados.update(parte)
+
+    agora = datetime.utcnow()
+    enviados = [e.id for e in emails if resultados.get(e.id) is None]
+    if enviados:
+        EmailPendente.query.filter(EmailPendente.id.in_(enviados)).update({
+            'status': 'enviado', 'enviado_em': agora, 'ultimo_erro': None,
+            'tentativas': EmailPendente.tentativas + 1, 'atualizado_em': agora,
+        }, synchronize_session=False)
+
+    # Falhas são exceção: cada uma tem erro e espera próprios
+    for email in emails:
+        erro = resultados.get(email.id)
+        if erro is None:
+            continue
+        tentativas = email.tentativas + 1
+        campos = {'tentativas': tentativas, 'ultimo_erro': erro, 'atualizado_em': agora}
+        if tentativas >= EMAIL_MAX_TENTATIVAS:
+            campos['status'] = 'falhou'
+        else:
+            espera = min(EMAIL_ESPERA_BASE * 2 ** (tentativas - 1), EMAIL_ESPERA_MAXIMA)
+            campos['status'] = 'pendente'
+            campos['proxima_tentativa'] = agora + timedelta(seconds=espera)
+        EmailPendente.query.filter_by(id=email.id).update(campos, synchronize_session=False)
+        print(f'[EMAIL] Falha ao enviar e-mail para {email.destinatario}: {erro}')
+    db.session.commit()
+    return len(enviados)
 
 
-@app.route('/api/auth/reset-password', methods=['POST'])
-def auth_reset_password():
-    data = request.json or {}
-    username = (data.get('username') or '').strip()
-    token = (data.get('token') or '').strip()
-    nova_senha = (data.get('new_password') or '').strip()
+# ==================== AGENDADOR DE TAREFAS ====================
 
-    # Garantir usuários iniciais (útil em ambiente WSGI/deploy)
-    semear_usuarios_iniciais()
+class ExecucaoTarefa(db.Model):
+    """Última execução de cada tarefa agendada (tempo, resultado e processo)"""
+    __tablename__ = 'execucoes_tarefas'
 
-    user = UsuarioSistema.query.filter_by(username=username, ativo=True).first()
-    if not user:
-        return jsonify({'error': 'Usuário não encontrado'}), 404
+    tarefa = db.Column(db.String(50), primary_key=True)
+    ultima_execucao = db.Column(db.DateTime)
+    duracao_ms = db.Column(db.Float)
+    sucesso = db.Column(db.Boolean)
+    erro = db.Column(db.Text)
+    total_execucoes = db.Column(db.Integer, nullable=False, default=0)
+    processo = db.Column(db.Integer)
 
-    token_obj = TokenRedefinicao.query.filter_by(user_id=user.id, token=token, usado=False).first()
-    if not token_obj or token_obj.expira_em < datetime.utcnow():
-        return jsonify({'error': 'Token inválido ou expirado'}), 400
+    def to_dict(self):
+        return {
+            'tarefa': self.tarefa,
+            'ultima_execucao': self.ultima_execucao.isoformat() if self.ultima_execucao else None,
+            'duracao_ms': self.duracao_ms,
+            'sucesso': self.sucesso,
+            'erro': self.erro,
+            'total_execucoes': self.total_execucoes,
+            'processo': self.processo
+        }
 
-    user.set_password(nova_senha)
-    token_obj.usado = True
-    db.session.commit()
 
-    return jsonify({'message': 'Senha redefinida com sucesso'})
+def executar_tarefa(nome, funcao):
+    """Executa uma tarefa agendada no contexto da app e registra tempo e resultado"""
+    inicio = time.perf_counter()
+    iniciado_em = datetime.utcnow()
+    erro = None
+    with app.app_context():
+        try:
+            funcao()
+        except Exception as e:
+            db.session.rollback()
+            erro = str(e)
+            print(f"Erro na tarefa agendada {nome}: {e}")
+
+        duracao_ms = round((time.perf_counter() - inicio) * 1000, 1)
+        metricas.observar('banco_horas_tarefa_duracao_segundos', {'tarefa': nome}, duracao_ms / 1000)
+        metricas.incrementar('banco_horas_tarefa_execucoes_total', {'tarefa': nome, 'sucesso': str(erro is None).lower()})
+        salvar_metricas_processo()
+        try:
+            execucao = db.session.get(ExecucaoTarefa, nome) or ExecucaoTarefa(tarefa=nome, total_execucoes=0)
+            execucao.ultima_execucao = iniciado_em
+            execucao.duracao_ms = duracao_ms
+            execucao.sucesso = erro is None
+            execucao.erro = erro
+            execucao.total_execucoes += 1
+            execucao.processo = os.getpid()
+            db.session.add(execucao)
+            db.session.commit()
+        except Exception as e:
+            db.session.rollback()
+            print(f"Erro ao registrar execução da tarefa {nome}: {e}")
 
 
-@app.route('/api/admin/users', methods=['POST'])
-def admin_list_users():
-    data = request.json or {}
-    admin = verificar_admin_payload(data)
-    if not admin:
-        return jsonify({'error': 'Acesso negado'}), 403
+def tarefa_backup():
+    """Tarefa agendada: backup automático"""
+    executar_tarefa('backup', criar_backup)
 
-    users = UsuarioSistema.query.order_by(UsuarioSistema.username).all()
-    return jsonify([u.to_dict() for u in users])
 
+def tarefa_alertas_email():
+    """Tarefa agendada: alertas de prazo por e-mail"""
+    executar_tarefa('alertas_email', processar_alertas_email_30_dias)
 
-@app.route('/api/admin/token', methods=['POST'])
-def admin_generate_token():
-    data = request.json or {}
-    admin = verificar_admin_payload(data)
-    if not admin:
-        return jsonify({'error': 'Acesso negado'}), 403
 
-    username = (data.get('username') or '').strip()
-    # Garantir usuários iniciais (útil em ambiente WSGI/deploy)
-    semear_usuarios_iniciais()
+def tarefa_fila_emails():
+    """Tarefa agendada: envio dos e-mails pendentes da fila"""
+    executar_tarefa('fila_emails', processar_fila_emails)
 
-    user = UsuarioSistema.query.filter_by(username=username, ativo=True).first()
-    if not user:
-        return jsonify({'error': 'Usuário não encontrado'}), 404
 
-    token = secrets.token_urlsafe(24)
-    expira_em = datetime.utcnow() + timedelta(hours=24)
+def tarefa_limpar_alteracoes():
+    """Tarefa agendada: poda do diário de alterações"""
+    executar_tarefa('limpar_alteracoes', limpar_alteracoes_antigas)
 
-    token_obj = TokenRedefinicao(
-        user_id=user.id,
-        token=token,
-        expira_em=expira_em,
-        criado_por=admin.username
-    )
-    db.session.add(token_obj)
-    db.session.commit()
 
-    return jsonify({
-        'username': user.username,
-        'token': token,
-        'expira_em': expira_em.isoformat()
-    })
+# id -> (função, intervalo); as referências 'app:...' ficam gravadas no job store
+TAREFAS_AGENDADAS = {
+    'backup': ('app:tarefa_backup', timedelta(hours=6)),
+    'alertas_email': ('app:tarefa_alertas_email', timedelta(hours=1)),
+    'fila_emails': ('app:tarefa_fila_emails', timedelta(minutes=1)),
+    'limpar_alteracoes': ('app:tarefa_limpar_alteracoes', timedelta(days=1)),
+}
+AGENDADOR_INTERVALO_ELEICAO = 30  # segundos entre tentativas de virar líder
 
+agendador = None
+arquivo_lock_agendador = None
 
-# ========== ROTAS DE SERVIDORES ==========
+
+def adquirir_lock_agendador():
+    """Tenta o lock exclusivo (não bloqueante) do agendador; True se este processo virou líder"""
+    global arquivo_lock_agendador
+    caminho = Path(app.config['AGENDADOR_LOCK'])
+    arquivo = open(caminho, 'a+')
+    try:
+        if os.name == 'nt':
+            import msvcrt
+            msvcrt.locking(arquivo.fileno(), msvcrt.LK_NBLCK, 1)
+        else:
+            import fcntl
+            fcntl.flock(arquivo.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except OSError:
+        arquivo.close()
+        return False
+
+    # O lock vale enquanto o arquivo estiver aberto, ou seja, enquanto o processo viver
+    arquivo.seek(0)
+    arquivo.truncate()
+    arquivo.write(str(os.getpid()))
+    arquivo.flush()
+    arquivo_lock_agendador = arquivo
+    return True
+
+
+def iniciar_agendador_lider():
+    """Sobe o APScheduler com job store persistente (tabela apscheduler_jobs)"""
+    global agendador
+    from apscheduler.schedulers.background import BackgroundScheduler
+    from apscheduler.jobstores.sqlalchemy import SQLAlchemyJobStore
+
+    agendador = BackgroundScheduler(
+        jobstores={'default': SQLAlchemyJobStore(url=app.config['SQLALCHEMY_DATABASE_URI'])},
+        # Execuções perdidas (processo parado) rodam uma única vez ao voltar
+        job_defaults={'coalesce': True, 'misfire_grace_time': None, 'max_instances': 1}
+    )
+    agendador.start(paused=True)
+
+    for tarefa_id, (funcao, intervalo) in TAREFAS_AGENDADAS.items():
+        # Job já persistido mantém o próximo horário (permite recuperar execuções perdidas)
+        if agendador.get_job(tarefa_id) is None:
+            agendador.add_job(funcao, 'interval', id=tarefa_id, seconds=intervalo.total_seconds())
+
+    agendador.resume()
+    print(f"Agendador iniciado no processo {os.getpid()}")
+
+
+def aguardar_lideranca_agendador():
+    """Thread de espera: tenta virar líder periodicamente até conseguir"""
+    while not adquirir_lock_agendador():
+        time.sleep(AGENDADOR_INTERVALO_ELEICAO)
+    try:
+        iniciar_agendador_lider()
+    except Exception as e:
+        print(f"Erro ao iniciar agendador: {e}")
+
+
+def iniciar_agendador():
+    """Inicia a eleição do agendador; só o processo com o lock executa as tarefas"""
+    thread = threading.Thread(target=aguardar_lideranca_agendador, name='agendador', daemon=True)
+    thread.start()
+    return thread
+
+
+# ==================== CACHE DE RESULTADOS ====================
+
+def assinatura_versoes(tabelas):
+    """Retorna string com a versão atual de cada tabela (ex.: 'servidores:3|dias_trabalhados:10')"""
+    versoes = dict(
+        db.session.query(VersaoTabela.tabela, VersaoTabela.versao)
+        .filter(VersaoTabela.tabela.in_(tabelas))
+        .all()
+    )
+    return '|'.join(f'{t}:{versoes.get(t, 0)}' for t in tabelas)
+
+
+def obter_cache(chave, tabelas, calcular):
+    """Devolve o resultado em cache para `chave` ou calcula e grava.
+
+    O cache fica no banco, então vale para todos os workers; é invalidado
+    automaticamente quando qualquer uma das `tabelas` recebe uma escrita.
+    """
+    assinatura = assinatura_versoes(tabelas)
+    item = db.session.get(CacheResultado, chave)
+    if item and item.versao == assinatura:
+        return json.loads(item.valor)
+
+    valor = calcular()
+    try:
+        # Upsert atômico: vários workers podem gravar a mesma chave ao mesmo tempo
+        campos = {'versao': assinatura, 'valor': json.dumps(valor), 'atualizado_em': datetime.utcnow()}
+        db.session.execute(
+            sqlite_insert(CacheResultado)
+            .values(chave=chave, **campos)
+            .on_conflict_do_update(index_elements=['chave'], set_=campos)
+        )
+        db.session.commit()
+    except Exception as e:
+        db.session.rollback()
+        print(f"Erro ao gravar cache {chave}: {e}")
+    return valor
+
+
+def com_etag(*tabelas, por_dia=False):
+    """Decorator de GET condicional baseado na versão das `tabelas`.
+
+    A ETag combina URL e versões; se o cliente já tem a mesma (If-None-Match)
+    responde 304 sem executar a rota, ou seja, sem ORM nem serialização.
+    Com `por_dia` a data de hoje também entra, para respostas que mudam na virada do dia.
+    """
+    def decorador(view):
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            assinatura = assinatura_versoes(list(tabelas))
+            if por_dia:
+                assinatura = f'{assinatura}|{data_hoje().isoformat()}'
+            etag = hashlib.sha1(f'{request.full_path}|{assinatura}'.encode('utf-8')).hexdigest()
+
+            if request.if_none_match.contains(etag):
+                resposta = make_response('', 304)
+            else:
+                resposta = make_response(view(*args, **kwargs))
+                if resposta.status_code != 200:
+                    return resposta
+
+            resposta.set_etag(etag)
+            # Navegador sempre revalida, reaproveitando o corpo em cache quando receber 304
+            resposta.headers['Cache-Control'] = 'no-cache'
+            return resposta
+        return wrapper
+    return decorador
+
+
+# ==================== SERIALIZAÇÃO RÁPIDA ====================
+
+# Conversores do SQLAlchemy, usados só quando o texto gravado foge do formato padrão
+converter_data = db.Date().dialect_impl(dialeto_sqlite.dialect()).result_processor(dialeto_sqlite.dialect(), None)
+converter_data_hora = db.DateTime().dialect_impl(dialeto_sqlite.dialect()).result_processor(dialeto_sqlite.dialect(), None)
+
+
+def data_iso(valor):
+    """Texto de data do SQLite -> mesmo resultado de date.isoformat()"""
+    if not valor:
+        return None
+    if len(valor) == 10:
+        return valor
+    return converter_data(valor).isoformat()
+
+
+def data_hora_iso(valor):
+    """Texto de data/hora do SQLite -> mesmo resultado de datetime.isoformat()"""
+    if not valor:
+        return None
+    if len(valor) == 26 and valor[10] == ' ':
+        # Formato gravado pelo SQLAlchemy: 'AAAA-MM-DD HH:MM:SS.ffffff'
+        return f"{valor[:10]}T{valor[11:19] if valor.endswith('.000000') else valor[11:]}"
+    return converter_data_hora(valor).isoformat()
+
+
+def hora_dia_padrao(valor):
+    return valor or '08:00'
+
+
+class Serializador:
+    """Serializa linhas de um SELECT de colunas direto em dicts iguais ao to_dict().
+
+    Evita montar objetos do ORM: as colunas são lidas como tuplas (datas como
+    texto cru do SQLite) e cada linha vira dict a partir de uma lista fixa de
+    (chave, índice, conversor), com as chaves já em ordem alfabética como o
+    jsonify as grava.
+    """
+
+    CONVERSORES = {'data': data_iso, 'data_hora': data_hora_iso, 'hora_dia': hora_dia_padrao}
+    TEXTO_CRU = {'data', 'data_hora'}
+
+    def __init__(self, modelo, campos):
+        self.modelo = modelo
+        self.colunas = []
+        for chave, atributo, conversor in campos:
+            coluna = getattr(modelo, atributo)
+            if conversor in self.TEXTO_CRU:
+                coluna = type_coerce(coluna, db.String)
+            self.colunas.append(coluna.label(atributo))
+
+        self.entradas = [
+            (chave, indice, self.CONVERSORES.get(conversor))
+            for indice, (chave, atributo, conversor) in sorted(enumerate(campos), key=lambda c: c[1][0])
+        ]
+
+    def serializar(self, linha):
+        return {chave: conversor(linha[indice]) if conversor else linha[indice]
+                for chave, indice, conversor in self.entradas}
+
+    def select(self):
+        return db.select(*self.colunas)
+
+    def da_query(self, query):
+        """Troca as entidades de uma Query do ORM (mantendo filtros) pelas colunas"""
+        return query.with_entities(*self.colunas)
+
+    def lista(self, linhas):
+        serializar = self.serializar
+        return [serializar(linha) for linha in linhas]
+
+
+SERIALIZADOR_SERVIDOR = Serializador(Servidor, [
+    ('id', 'id', None),
+    ('nf', 'nf', None),
+    ('nome', 'nome', None),
+    ('setor', 'setor', None),
+    ('criado_em', 'criado_em', 'data_hora'),
+    ('atualizado_em', 'atualizado_em', 'data_hora'),
+])
+
+SERIALIZADOR_REGISTRO = Serializador(DiaTrabalhado, [
+    ('id', 'id', None),
+    ('nf', 'nf', None),
+    ('nome', 'nome', None),
+    ('setor', 'setor', None),
+    ('vinculo', 'vinculo', None),
+    ('dia_trabalhado', 'dia_trabalhado', 'data'),
+    ('entrada', 'entrada', None),
+    ('saida', 'saida', None),
+    ('h_trabalhada', 'h_trab', None),
+    ('h_direito', 'h_direito', None),
+    ('prazo_max', 'prazo_max', 'data'),
+    ('h_totais', 'h_totais', None),
+    ('hora_dia', 'hora_dia', 'hora_dia'),
+    ('dias_gozar', 'dias_gozar', None),
+    ('dias_gozados', 'dias_gozados', None),
+    ('horas_descontadas', 'h_descontadas', None),
+    ('saldo', 'saldo', None),
+    ('observacao', 'observacao', None),
+    ('criado_em', 'criado_em', 'data_hora'),
+    ('atualizado_em', 'atualizado_em', 'data_hora'),
+])
+
+
+def usar_orjson():
+    return orjson is not None and app.config['JSON_RAPIDO'] in ('auto', 'orjson')
+
+
+def codificar_json(dados):
+    """Texto JSON de dados já serializados (dicts com chaves ordenadas)"""
+    if usar_orjson():
+        return orjson.dumps(dados).decode('utf-8')
+    return app.json.dumps(dados)
+
+
+def resposta_json(dados):
+    """Equivalente ao jsonify para listagens; com orjson a codificação é bem mais rápida.
+
+    Com orjson os caracteres não ASCII saem em UTF-8 em vez de escapados
+    (\\uXXXX); o JSON decodificado é o mesmo. JSON_RAPIDO=padrao desliga.
+    """
+    if usar_orjson():
+        return Response(orjson.dumps(dados) + b'\n', mimetype='application/json')
+    return jsonify(dados)
+
+
+# ==================== PAGINAÇÃO E FILTROS ====================
+
+# Colunas aceitas em `ordenar` (mesmas usadas pelas tabelas da interface)
+COLUNAS_ORDENACAO_REGISTROS = {
+    'dia_trabalhado': DiaTrabalhado.dia_trabalhado,
+    'prazo_max': DiaTrabalhado.prazo_max,
+    'nome': DiaTrabalhado.nome,
+    'nf': DiaTrabalhado.nf,
+    'setor': DiaTrabalhado.setor,
+    'id': DiaTrabalhado.id,
+}
+COLUNAS_DATA_REGISTROS = {'dia_trabalhado', 'prazo_max'}
+LIMITE_PADRAO_PAGINA = 100
+LIMITE_MAXIMO_PAGINA = 1000
+
+
+def parse_data_parametro(valor, nome):
+    """Converte parâmetro de query YYYY-MM-DD em date (ValueError se inválido)."""
+    if not valor:
+        return None
+    try:
+        return datetime.fromisoformat(valor).date()
+    except ValueError:
+        raise ValueError(f'Parâmetro {nome} inválido: use o formato AAAA-MM-DD')
+
+
+def aplicar_filtros_registros(query, args):
+    """Aplica os filtros de listagem de registros vindos da query string."""
+    if args.get('nf'):
+        query = query.filter(DiaTrabalhado.nf == args['nf'])
+    if args.get('setor'):
+        query = query.filter(DiaTrabalhado.setor == args['setor'])
+    if args.get('busca'):
+        termo = f"%{args['busca']}%"
+        query = query.filter(db.or_(DiaTrabalhado.nf.ilike(termo), DiaTrabalhado.nome.ilike(termo)))
+
+    intervalos = [
+        ('data_inicio', DiaTrabalhado.dia_trabalhado, '>='),
+        ('data_fim', DiaTrabalhado.dia_trabalhado, '<='),
+        ('prazo_de', DiaTrabalhado.prazo_max, '>='),
+        ('prazo_ate', DiaTrabalhado.prazo_max, '<='),
+    ]
+    for parametro, coluna, operador in intervalos:
+        data = parse_data_parametro(args.get(parametro), parametro)
+        if data is None:
+            continue
+        query = query.filter(coluna >= data if operador == '>=' else coluna <= data)
+    return query
+
+
+def codificar_cursor(ordenar, ordem, valor, registro_id):
+    """Gera cursor opaco com a chave de ordenação do último item da página."""
+    bruto = json.dumps([ordenar, ordem, valor, registro_id], separators=(',', ':'))
+    return base64.urlsafe_b64encode(bruto.encode('utf-8')).decode('ascii').rstrip('=')
+
+
+def decodificar_cursor(cursor):
+    """Decodifica cursor gerado por codificar_cursor (ValueError se inválido)."""
+    try:
+        preenchido = cursor + '=' * (-len(cursor) % 4)
+        ordenar, ordem, valor, registro_id = json.loads(base64.urlsafe_b64decode(preenchido))
+        return ordenar, ordem, valor, int(registro_id)
+    except Exception:
+        raise ValueError('Cursor inválido')
+
+
+def paginar_registros(query, args):
+    """Pagina a query de registros por keyset (valor da coluna + id).
+
+    A ordenação é sempre (coluna, id) com NULLs por último, de modo que a
+    próxima página começa exatamente após o último item entregue, sem OFFSET.
+    """
+    try:
+        limite = int(args.get('limite', LIMITE_PADRAO_PAGINA))
+    except ValueError:
+        raise ValueError('Parâmetro limite inválido')
+    limite = max(1, min(limite, LIMITE_MAXIMO_PAGINA))
+
+    ordenar = args.get('ordenar', 'dia_trabalhado')
+    ordem = args.get('ordem', 'desc')
+    if ordenar not in COLUNAS_ORDENACAO_REGISTROS:
+        raise ValueError(f'Parâmetro ordenar inválido: use {", ".join(COLUNAS_ORDENACAO_REGISTROS)}')
+    if ordem not in ('asc', 'desc'):
+        raise ValueError('Parâmetro ordem inválido: use asc ou desc')
+
+    coluna = COLUNAS_ORDENACAO_REGISTROS[ordenar]
+    desc = ordem == 'desc'
+
+    if args.get('cursor'):
+        c_ordenar, c_ordem, valor, ultimo_id = decodificar_cursor(args['cursor'])
+        if (c_ordenar, c_ordem) != (ordenar, ordem):
+            raise ValueError('Cursor não corresponde à ordenação solicitada')
+        if valor is not None and ordenar in COLUNAS_DATA_REGISTROS:
+            valor = parse_data_parametro(valor, 'cursor')
+
+        depois_id = DiaTrabalhado.id < ultimo_id if desc else DiaTrabalhado.id > ultimo_id
+        if valor is None:
+            query = query.filter(coluna.is_(None), depois_id)
+        else:
+            depois_valor = coluna < valor if desc else coluna > valor
+            query = query.filter(db.or_(
+                depois_valor,
+                db.and_(coluna == valor, depois_id),
+                coluna.is_(None)
+            ))
+
+    if desc:
+        query = query.order_by(coluna.desc().nulls_last(), DiaTrabalhado.id.desc())
+    else:
+        query = query.order_by(coluna.asc().nulls_last(), DiaTrabalhado.id.asc())
+
+    registros = SERIALIZADOR_REGISTRO.da_query(query).limit(limite + 1).all()
+    tem_mais = len(registros) > limite
+    registros = registros[:limite]
+
+    proximo_cursor = None
+    if tem_mais:
+        ultimo = registros[-1]
+        valor = getattr(ultimo, coluna.key)
+        if ordenar in COLUNAS_DATA_REGISTROS:
+            valor = data_iso(valor)
+        proximo_cursor = codificar_cursor(ordenar, ordem, valor, ultimo.id)
+
+    return {
+        'registros': SERIALIZADOR_REGISTRO.lista(registros),
+        'limite': limite,
+        'ordenar': ordenar,
+        'ordem': ordem,
+        'proximoCursor': proximo_cursor
+    }
+
+
+# ==================== FILA DE ESCRITA ====================
+
+FILA_ESCRITA_LOTE = int(os.environ.get('FILA_ESCRITA_LOTE', '50'))
+FILA_ESCRITA_JANELA = float(os.environ.get('FILA_ESCRITA_JANELA_MS', '5')) / 1000
+FILA_ESCRITA_ESPERA = 60  # segundos que a requisição aguarda pela gravação
+
+fila_escrita = None
+fila_escrita_lock = threading.Lock()
+
+
+class FilaEscrita:
+    """Escritor único do processo: agrupa escritas pequenas em um só commit.
+
+    Cada item é uma função sem argumentos que altera db.session e devolve a
+    resposta da rota. A thread escritora executa um lote de funções na mesma
+    transação e faz um único commit. Se alguma falhar, o lote é desfeito e as
+    funções são reexecutadas uma a uma, cada uma com seu commit, para que só
+    a que falhou receba o erro.
+    """
+
+    def __init__(self, lote=FILA_ESCRITA_LOTE, janela=FILA_ESCRITA_JANELA):
+        self.lote = lote
+        self.janela = janela
+        self.itens = queue.Queue()
+        self.thread = threading.Thread(target=self._executar, name='fila-escrita', daemon=True)
+        self.thread.start()
+
+    def submeter(self, funcao):
+        futuro = Future()
+        self.itens.put((funcao, futuro))
+        return futuro.result(timeout=FILA_ESCRITA_ESPERA)
+
+    def _proximo_lote(self):
+        itens = [self.itens.get()]
+        limite = time.monotonic() + self.janela
+        while len(itens) < self.lote:
+            restante = limite - time.monotonic()
+            try:
+                itens.append(self.itens.get(timeout=restante) if restante > 0 else self.itens.get_nowait())
+            except queue.Empty:
+                break
+        return itens
+
+    def _executar(self):
+        with app.app_context():
+            while True:
+                itens = self._proximo_lote()
+                try:
+                    resultados = [funcao() for funcao, _ in itens]
+                    db.session.commit()
+                except Exception:
+                    db.session.rollback()
+                    self._executar_individualmente(itens)
+                else:
+                    for (_, futuro), resultado in zip(itens, resultados):
+                        futuro.set_result(resultado)
+                finally:
+                    db.session.remove()
+
+    def _executar_individualmente(self, itens):
+        for funcao, futuro in itens:
+            try:
+                resultado = funcao()
+                db.session.commit()
+            except Exception as e:
+                db.session.rollback()
+                futuro.set_exception(e)
+            else:
+                futuro.set_result(resultado)
+
+
+def executar_escrita(funcao):
+    """Executa uma escrita e confirma: pela fila de escrita, se ativa, ou direto na sessão"""
+    global fila_escrita
+    if not app.config['FILA_ESCRITA_ATIVA']:
+        resultado = funcao()
+        db.session.commit()
+        return resultado
+
+    if fila_escrita is None:
+        with fila_escrita_lock:
+            if fila_escrita is None:
+                fila_escrita = FilaEscrita()
+    return fila_escrita.submeter(funcao)
+
+
+# ==================== MÉTRICAS ====================
+
+BUCKETS_LATENCIA = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+BUCKETS_BYTES = (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304, 16777216, 67108864)
+BUCKETS_CONSULTAS = (0, 1, 2, 3, 5, 10, 20, 50, 100, 500)
+
+# nome -> (tipo, ajuda, buckets)
+DEFINICOES_METRICAS = {
+    'banco_horas_requisicoes_total': ('counter', 'Requisições HTTP atendidas', None),
+    'banco_horas_requisicao_duracao_segundos': ('histogram', 'Latência das requisições por rota', BUCKETS_LATENCIA),
+    'banco_horas_resposta_bytes': ('histogram', 'Tamanho das respostas por rota', BUCKETS_BYTES),
+    'banco_horas_sql_consultas': ('histogram', 'Comandos SQL executados por requisição', BUCKETS_CONSULTAS),
+    'banco_horas_sql_duracao_segundos_total': ('counter', 'Tempo gasto em SQL por rota', None),
+    'banco_horas_tarefa_duracao_segundos': ('histogram', 'Duração das tarefas agendadas', BUCKETS_LATENCIA),
+    'banco_horas_tarefa_execucoes_total': ('counter', 'Execuções das tarefas agendadas', None),
+}
+
+METRICAS_INTERVALO_GRAVACAO = 1.0  # segundos entre gravações do arquivo do processo
+
+
+class Metricas:
+    """Registro de métricas do processo (contadores e histogramas com rótulos).
+
+    Cada processo grava seu estado em METRICAS_DIR; /api/metrics soma os
+    arquivos dos workers vivos e apaga os de processos já encerrados.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.valores = {}  # (nome, rótulos) -> número ou [contagens por bucket..., soma, total]
+
+    @staticmethod
+    def chave(nome, rotulos):
+        return nome, tuple(sorted(rotulos.items()))
+
+    def incrementar(self, nome, rotulos, valor=1):
+        chave = self.chave(nome, rotulos)
+        with self.lock:
+            self.valores[chave] = self.valores.get(chave, 0) + valor
+
+    def observar(self, nome, rotulos, valor):
+        buckets = DEFINICOES_METRICAS[nome][2]
+        chave = self.chave(nome, rotulos)
+        with self.lock:
+            serie = self.valores.get(chave)
+            if serie is None:
+                serie = self.valores[chave] = [0] * (len(buckets) + 3)
+            indice = next((i for i, limite in enumerate(buckets) if valor <= limite), len(buckets))
+            serie[indice] += 1
+            serie[-2] += valor
+            serie[-1] += 1
+
+    def exportar(self):
+        with self.lock:
+            return [[nome, list(rotulos), valor if not isinstance(valor, list) else list(valor)]
+                    for (nome, rotulos), valor in self.valores.items()]
+
+
+metricas = Metricas()
+metricas_ultima_gravacao = 0.0
+METRICAS_ARQUIVO = f'metricas_{os.getpid()}_{int(time.time() * 1000)}.json'
+
+
+def salvar_metricas_processo():
+    """Grava o estado deste processo no diretório compartilhado (escrita atômica)"""
+    global metricas_ultima_gravacao
+    metricas_ultima_gravacao = time.monotonic()
+    if not metricas.valores:
+        return  # processo que não atendeu requisições (CLI, scripts) não deixa arquivo
+    try:
+        pasta = Path(app.config['METRICAS_DIR'])
+        pasta.mkdir(parents=True, exist_ok=True)
+        temporario = pasta / f'.{METRICAS_ARQUIVO}.tmp'
+        temporario.write_text(json.dumps(metricas.exportar()), encoding='utf-8')
+        os.replace(temporario, pasta / METRICAS_ARQUIVO)
+    except OSError as e:
+        print(f"Erro ao gravar métricas: {e}")
+
+
+def processo_vivo(pid):
+    """True se ainda existe um processo com este pid"""
+    if os.name == 'nt':
+        import ctypes
+        kernel32 = ctypes.windll.kernel32
+        handle = kernel32.OpenProcess(0x1000, False, pid)  # PROCESS_QUERY_LIMITED_INFORMATION
+        if not handle:
+            return False
+        codigo = ctypes.c_ulong()
+        kernel32.GetExitCodeProcess(handle, ctypes.byref(codigo))
+        kernel32.CloseHandle(handle)
+        return codigo.value == 259  # STILL_ACTIVE
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def combinar_metricas():
+    """Soma as métricas dos processos vivos, removendo arquivos de processos encerrados"""
+    salvar_metricas_processo()
+    total = {}
+    for arquivo in Path(app.config['METRICAS_DIR']).glob('metricas_*.json'):
+        if arquivo.name != METRICAS_ARQUIVO:
+            pid = arquivo.name.split('_')[1]
+            if pid.isdigit() and not processo_vivo(int(pid)):
+                arquivo.unlink(missing_ok=True)
+                continue
+        try:
+            itens = json.loads(arquivo.read_text(encoding='utf-8'))
+        except (OSError, ValueError):
+            continue
+        for nome, rotulos, valor in itens:
+            chave = (nome, tuple(tuple(r) for r in rotulos))
+            if isinstance(valor, list):
+                atual = total.setdefault(chave, [0] * len(valor))
+                total[chave] = [a + b for a, b in zip(atual, valor)]
+            else:
+                total[chave] = total.get(chave, 0) + valor
+    return total
+
+
+def escapar_rotulo(valor):
+    return str(valor).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def formatar_rotulos(rotulos, extra=()):
+    pares = list(rotulos) + list(extra)
+    if not pares:
+        return ''
+    return '{' + ','.join(f'{k}="{escapar_rotulo(v)}"' for k, v in pares) + '}'
+
+
+def formatar_prometheus(total):
+    """Formato texto de exposição do Prometheus (versão 0.0.4)"""
+    linhas = []
+    for nome, (tipo, ajuda, buckets) in DEFINICOES_METRICAS.items():
+        series = sorted((rotulos, valor) for (n, rotulos), valor in total.items() if n == nome)
+        linhas.append(f'# HELP {nome} {ajuda}')
+        linhas.append(f'# TYPE {nome} {tipo}')
+        for rotulos, valor in series:
+            if tipo != 'histogram':
+                linhas.append(f'{nome}{formatar_rotulos(rotulos)} {valor}')
+                continue
+            acumulado = 0
+            for limite, contagem in zip(list(buckets) + ['+Inf'], valor[:-2]):
+                acumulado += contagem
+                linhas.append(f'{nome}_bucket{formatar_rotulos(rotulos, [("le", limite)])} {acumulado}')
+            linhas.append(f'{nome}_sum{formatar_rotulos(rotulos)} {valor[-2]}')
+            linhas.append(f'{nome}_count{formatar_rotulos(rotulos)} {valor[-1]}')
+    return '\n'.join(linhas) + '\n'
+
+
+@event.listens_for(Engine, 'before_cursor_execute')
+def iniciar_medicao_sql(conn, cursor, statement, parameters, context, executemany):
+    if has_request_context() and 'metricas' in g:
+        conn.info.setdefault('metricas_inicio_sql', []).append(time.perf_counter())
+
+
+@event.listens_for(Engine, 'after_cursor_execute')
+def finalizar_medicao_sql(conn, cursor, statement, parameters, context, executemany):
+    inicios = conn.info.get('metricas_inicio_sql')
+    if inicios and has_request_context() and 'metricas' in g:
+        g.metricas['sql_consultas'] += 1
+        g.metricas['sql_tempo'] += time.perf_counter() - inicios.pop()
+
+
+@app.before_request
+def iniciar_metricas_requisicao():
+    g.metricas = {'inicio': time.perf_counter(), 'sql_consultas': 0, 'sql_tempo': 0.0, 'bytes': 0}
+
+
+def contar_bytes_resposta(iteravel, estado, registrar):
+    """Conta os bytes de respostas em streaming e registra as métricas ao final"""
+    try:
+        for parte in iteravel:
+            estado['bytes'] += len(parte)
+            yield parte
+    finally:
+        if hasattr(iteravel, 'close'):
+            iteravel.close()
+        registrar()
+
+
+@app.after_request
+def registrar_metricas_requisicao(response):
+    estado = g.get('metricas')
+    if estado is None:
+        return response
+    rota = request.endpoint or 'nao_encontrada'
+    metodo = request.method
+    status = response.status_code
+
+    def registrar():
+        metricas.incrementar('banco_horas_requisicoes_total', {'rota': rota, 'metodo': metodo, 'status': status})
+        metricas.observar('banco_horas_requisicao_duracao_segundos', {'rota': rota, 'metodo': metodo},
+                          time.perf_counter() - estado['inicio'])
+        metricas.observar('banco_horas_resposta_bytes', {'rota': rota}, estado['bytes'])
+        metricas.observar('banco_horas_sql_consultas', {'rota': rota}, estado['sql_consultas'])
+        metricas.incrementar('banco_horas_sql_duracao_segundos_total', {'rota': rota}, estado['sql_tempo'])
+        if time.monotonic() - metricas_ultima_gravacao >= METRICAS_INTERVALO_GRAVACAO:
+            salvar_metricas_processo()
+
+    if response.is_streamed:
+        # Em streaming, tempo, bytes e SQL só estão completos quando o corpo termina
+        response.response = contar_bytes_resposta(response.response, estado, registrar)
+    else:
+        estado['bytes'] = response.calculate_content_length() or 0
+        registrar()
+    return response
+
+
+atexit.register(salvar_metricas_processo)
+
+
+# ==================== DETECTOR DE CONSULTAS ====================
+
+class OrcamentoConsultasExcedido(Exception):
+    """Rota executou mais comandos SQL que o orçamento permitido"""
+
+
+def orcamento_consultas(maximo):
+    """Define o número máximo de comandos SQL por requisição de uma rota"""
+    def decorator(f):
+        f.orcamento_consultas = maximo
+        return f
+    return decorator
+
+
+def formato_consulta(statement):
+    """Normaliza espaços: comandos com o mesmo formato só diferem nos parâmetros"""
+    return ' '.join(statement.split())
+
+
+def plano_consulta(cursor, statement, parameters):
+    """EXPLAIN QUERY PLAN pela conexão DB-API (não dispara os eventos do SQLAlchemy)"""
+    try:
+        linhas = cursor.connection.execute(f'EXPLAIN QUERY PLAN {statement}', parameters or ()).fetchall()
+        return ' | '.join(str(linha[-1]) for linha in linhas)
+    except Exception as e:
+        return f'(plano indisponível: {e})'
+
+
+@event.listens_for(Engine, 'before_cursor_execute')
+def iniciar_detector_consultas(conn, cursor, statement, parameters, context, executemany):
+    if app.config['DETECTOR_CONSULTAS']:
+        conn.info.setdefault('detector_inicio_sql', []).append(time.perf_counter())
+
+
+@event.listens_for(Engine, 'after_cursor_execute')
+def registrar_detector_consultas(conn, cursor, statement, parameters, context, executemany):
+    inicios = conn.info.get('detector_inicio_sql')
+    if not app.config['DETECTOR_CONSULTAS'] or not inicios:
+        return
+    duracao_ms = (time.perf_counter() - inicios.pop()) * 1000
+
+    if duracao_ms >= app.config['CONSULTA_LENTA_MS']:
+        rota = request.endpoint if has_request_context() else None
+        plano = plano_consulta(cursor, statement, parameters) if not executemany else '(executemany)'
+        print(f"[CONSULTAS] Consulta lenta ({duracao_ms:.1f} ms, rota {rota}): {formato_consulta(statement)[:500]}"
+              f"\n[CONSULTAS]   plano: {plano}")
+
+    if has_request_context() and 'metricas' in g:
+        formatos = g.metricas.setdefault('formatos', {})
+        formato = formato_consulta(statement)
+        formatos[formato] = formatos.get(formato, 0) + 1
+
+
+@app.after_request
+def verificar_consultas_requisicao(response):
+    """Aponta candidatos a N+1 e aplica o orçamento de consultas da rota"""
+    estado = g.get('metricas')
+    if estado is None or not app.config['DETECTOR_CONSULTAS']:
+        return response
+
+    rota = request.endpoint or 'nao_encontrada'
+    for formato, vezes in estado.get('formatos', {}).items():
+        if vezes >= app.config['N_MAIS_1_REPETICOES']:
+            print(f"[CONSULTAS] Possível N+1 em {rota}: {vezes}x {formato[:300]}")
+
+    view = app.view_functions.get(request.endpoint)
+    orcamento = getattr(view, 'orcamento_consultas', None) or app.config['ORCAMENTO_CONSULTAS']
+    if orcamento and estado['sql_consultas'] > orcamento:
+        mensagem = f"{rota} executou {estado['sql_consultas']} comandos SQL (orçamento: {orcamento})"
+        print(f"[CONSULTAS] Orçamento excedido: {mensagem}")
+        if app.testing or app.config['DETECTOR_ESTRITO']:
+            raise OrcamentoConsultasExcedido(mensagem)
+    return response
+
+
+# ==================== ROTAS DA API ====================
+
+@app.route('/')
+def index():
+    """Página principal"""
+    return render_template('index.html')
+
+
+
+
+@app.route('/api/auth/login', methods=['POST'])
+def auth_login():
+    data = request.json or {}
+    username = (data.get('username') or '').strip()
+    password = data.get('password') or ''
+
+    user = UsuarioSistema.query.filter_by(username=username, ativo=True).first()
+    if not user or not user.check_password(password):
+        return jsonify({'error': 'Usuário ou senha inválidos'}), 401
+
+    return jsonify({
+        'username': user.username,
+        'role': user.role,
+        'email': user.email,
+        'token': gerar_token_sessao(user),
+        'expira_em': (datetime.utcnow() + timedelta(seconds=SESSAO_VALIDADE)).isoformat()
+    })
+
+
+@app.route('/api/auth/reset-password', methods=['POST'])
+def auth_reset_password():
+    data = request.json or {}
+    username = (data.get('username') or '').strip()
+    token = (data.get('token') or '').strip()
+    nova_senha = (data.get('new_password') or '').strip()
+
+    user = UsuarioSistema.query.filter_by(username=username, ativo=True).first()
+    if not user:
+        return jsonify({'error': 'Usuário não encontrado'}), 404
+
+    token_obj = TokenRedefinicao.query.filter_by(user_id=user.id, token=token, usado=False).first()
+    if not token_obj or token_obj.expira_em < datetime.utcnow():
+        return jsonify({'error': 'Token inválido ou expirado'}), 400
+
+    user.set_password(nova_senha)
+    token_obj.usado = True
+    db.session.commit()
+
+    return jsonify({'message': 'Senha redefinida com sucesso'})
+
+
+@app.route('/api/admin/users', methods=['POST'])
+def admin_list_users():
+    data = request.json or {}
+    admin = verificar_admin_payload(data)
+    if not admin:
+        return jsonify({'error': 'Acesso negado'}), 403
+
+    users = UsuarioSistema.query.order_by(UsuarioSistema.username).all()
+    return jsonify([u.to_dict() for u in users])
+
+
+@app.route('/api/admin/email-resumo', methods=['POST'])
+def admin_email_resumo():
+    """Liga/desliga o resumo diário de alertas de um usuário (`email_resumo`)"""
+    data = request.json or {}
+    admin = verificar_admin_payload(data)
+    if not admin:
+        return jsonify({'error': 'Acesso negado'}), 403
+
+    username = (data.get('username') or '').strip()
+    user = UsuarioSistema.query.filter_by(username=username).first()
+    if not user:
+        return jsonify({'error': 'Usuário não encontrado'}), 404
+
+    user.email_resumo = bool(data.get('email_resumo'))
+    db.session.commit()
+    return jsonify(user.to_dict())
+
+
+@app.route('/api/admin/token', methods=['POST'])
+def admin_generate_token():
+    data = request.json or {}
+    admin = verificar_admin_payload(data)
+    if not admin:
+        return jsonify({'error': 'Acesso negado'}), 403
+
+    username = (data.get('username') or '').strip()
+
+    user = UsuarioSistema.query.filter_by(username=username, ativo=True).first()
+    if not user:
+        return jsonify({'error': 'Usuário não encontrado'}), 404
+
+    token = secrets.token_urlsafe(24)
+    expira_em = datetime.utcnow() + timedelta(hours=24)
+
+    token_obj = TokenRedefinicao(
+        user_id=user.id,
+        token=token,
+        expira_em=expira_em,
+        criado_por=admin.username
+    )
+    db.session.add(token_obj)
+    db.session.commit()
+
+    return jsonify({
+        'username': user.username,
+        'token': token,
+        'expira_em': expira_em.isoformat()
+    })
+
+
+# ========== ROTAS DE SERVIDORES ==========
 
 @app.route('/api/servidores', methods=['GET'])
+@orcamento_consultas(3)
+@com_etag('servidores')
 def get_servidores():
     """Listar todos os servidores"""
-    servidores = Servidor.query.order_by(Servidor.nome).all()
-    return jsonify([s.to_dict() for s in servidores])
+    linhas = db.session.execute(SERIALIZADOR_SERVIDOR.select().order_by(Servidor.nome))
+    return resposta_json(SERIALIZADOR_SERVIDOR.lista(linhas))
 
 
 @app.route('/api/servidores/<nf>', methods=['GET'])
@@ -592,55 +2101,77 @@ def get_servidor(nf):
 def criar_servidor():
     """Criar novo servidor"""
     data = request.json
-    
-    # Verificar se NF já existe
-    if Servidor.query.filter_by(nf=data['nf']).first():
-        return jsonify({'error': 'NF já cadastrado'}), 400
-    
-    servidor = Servidor(
-        nf=data['nf'],
-        nome=data['nome'],
-        setor=data['setor']
-    )
-    
-    db.session.add(servidor)
-    db.session.commit()
-    
-    return jsonify(servidor.to_dict()), 201
+
+    def gravar():
+        # Verificar se NF já existe
+        if Servidor.query.filter_by(nf=data['nf']).first():
+            return jsonify({'error': 'NF já cadastrado'}), 400
+
+        servidor = Servidor(
+            nf=data['nf'],
+            nome=data['nome'],
+            setor=data['setor']
+        )
+
+        db.session.add(servidor)
+        db.session.flush()
+        return jsonify(servidor.to_dict()), 201
+
+    return executar_escrita(gravar)
 
 
 @app.route('/api/servidores/<int:id>', methods=['PUT'])
 def atualizar_servidor(id):
     """Atualizar servidor"""
-    servidor = Servidor.query.get_or_404(id)
     data = request.json
-    
-    servidor.nome = data.get('nome', servidor.nome)
-    servidor.setor = data.get('setor', servidor.setor)
-    servidor.atualizado_em = datetime.utcnow()
-    
-    db.session.commit()
-    
-    return jsonify(servidor.to_dict())
+
+    def gravar():
+        servidor = Servidor.query.get_or_404(id)
+        servidor.nome = data.get('nome', servidor.nome)
+        servidor.setor = data.get('setor', servidor.setor)
+        servidor.atualizado_em = datetime.utcnow()
+        db.session.flush()
+        return jsonify(servidor.to_dict())
+
+    return executar_escrita(gravar)
 
 
 @app.route('/api/servidores/<int:id>', methods=['DELETE'])
 def deletar_servidor(id):
     """Deletar servidor"""
-    servidor = Servidor.query.get_or_404(id)
-    db.session.delete(servidor)
-    db.session.commit()
-    
-    return jsonify({'message': 'Servidor deletado com sucesso'}), 200
+    def gravar():
+        servidor = Servidor.query.get_or_404(id)
+        db.session.delete(servidor)
+        db.session.flush()
+        return jsonify({'message': 'Servidor deletado com sucesso'}), 200
+
+    return executar_escrita(gravar)
 
 
 # ========== ROTAS DE DIAS TRABALHADOS ==========
 
 @app.route('/api/dias-trabalhados', methods=['GET'])
+@orcamento_consultas(3)
+@com_etag('dias_trabalhados')
 def get_dias_trabalhados():
-    """Listar todos os dias trabalhados"""
-    registros = DiaTrabalhado.query.order_by(DiaTrabalhado.dia_trabalhado.desc()).all()
-    return jsonify([r.to_dict() for r in registros])
+    """Listar dias trabalhados, sempre uma página por keyset.
+
+    `limite` (padrão LIMITE_PADRAO_PAGINA) e `cursor` definem a página; aceita
+    os filtros `nf`, `setor`, `busca`, `data_inicio`, `data_fim`, `prazo_de`,
+    `prazo_ate` e a ordenação `ordenar`/`ordem`. A tabela inteira sai só pelas
+    rotas de exportação.
+    """
+    args = request.args
+    try:
+        query = aplicar_filtros_registros(DiaTrabalhado.query, args)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
+    try:
+        pagina = paginar_registros(query, args)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    return resposta_json(pagina)
 
 
 @app.route('/api/dias-trabalhados/<int:id>', methods=['GET'])
@@ -651,10 +2182,16 @@ def get_dia_trabalhado(id):
 
 
 @app.route('/api/dias-trabalhados/servidor/<nf>', methods=['GET'])
+@orcamento_consultas(3)
+@com_etag('dias_trabalhados')
 def get_dias_trabalhados_por_servidor(nf):
     """Listar dias trabalhados de um servidor"""
-    registros = DiaTrabalhado.query.filter_by(nf=nf).order_by(DiaTrabalhado.dia_trabalhado.desc()).all()
-    return jsonify([r.to_dict() for r in registros])
+    linhas = db.session.execute(
+        SERIALIZADOR_REGISTRO.select()
+        .where(DiaTrabalhado.nf == nf)
+        .order_by(DiaTrabalhado.dia_trabalhado.desc())
+    )
+    return resposta_json(SERIALIZADOR_REGISTRO.lista(linhas))
 
 
 @app.route('/api/dias-trabalhados', methods=['POST'])
@@ -687,38 +2224,50 @@ def criar_dia_trabalhado():
     elif prazo_max:
         prazo_max = datetime.fromisoformat(prazo_max).date()
     
-    registro = DiaTrabalhado(
-        nf=data['nf'],
-        nome=data.get('nome', ''),
-        setor=data.get('setor', ''),
-        vinculo=data.get('vinculo'),
-        dia_trabalhado=dia_trab,
-        entrada=entrada,
-        saida=saida,
-        h_trab=h_trab,
-        h_direito=h_direito,
-        prazo_max=prazo_max,
-        h_totais=data.get('h_totais'),
-        hora_dia=data.get('hora_dia', '08:00'),
-        dias_gozar=data.get('dias_gozar'),
-        dias_gozados=data.get('dias_gozados'),
-        h_descontadas=data.get('horas_descontadas'),
-        saldo=data.get('saldo'),
-        observacao=data.get('observacao')
-    )
-    
-    db.session.add(registro)
-    db.session.commit()
-    
-    return jsonify(registro.to_dict()), 201
+    def gravar():
+        registro = DiaTrabalhado(
+            nf=data['nf'],
+            nome=data.get('nome', ''),
+            setor=data.get('setor', ''),
+            vinculo=data.get('vinculo'),
+            dia_trabalhado=dia_trab,
+            entrada=entrada,
+            saida=saida,
+            h_trab=h_trab,
+            h_direito=h_direito,
+            prazo_max=prazo_max,
+            h_totais=data.get('h_totais'),
+            hora_dia=data.get('hora_dia', '08:00'),
+            dias_gozar=data.get('dias_gozar'),
+            dias_gozados=data.get('dias_gozados'),
+            h_descontadas=data.get('horas_descontadas'),
+            saldo=data.get('saldo'),
+            observacao=data.get('observacao')
+        )
+
+        db.session.add(registro)
+        db.session.flush()
+        return jsonify(registro.to_dict()), 201
+
+    return executar_escrita(gravar)
 
 
 @app.route('/api/dias-trabalhados/<int:id>', methods=['PUT'])
 def atualizar_dia_trabalhado(id):
     """Atualizar registro de dia trabalhado"""
-    registro = DiaTrabalhado.query.get_or_404(id)
     data = request.json
-    
+
+    def gravar():
+        registro = DiaTrabalhado.query.get_or_404(id)
+        aplicar_alteracoes_registro(registro, data)
+        db.session.flush()
+        return jsonify(registro.to_dict())
+
+    return executar_escrita(gravar)
+
+
+def aplicar_alteracoes_registro(registro, data):
+    """Aplica os campos do payload ao registro e recalcula os derivados"""
     # Atualizar campos
     registro.nome = data.get('nome', registro.nome)
     registro.setor = data.get('setor', registro.setor)
@@ -774,71 +2323,152 @@ def atualizar_dia_trabalhado(id):
     registro.saldo = subtrair_horas(h_direito, h_descontadas)
     
     registro.atualizado_em = datetime.utcnow()
-    
-    db.session.commit()
-    
-    return jsonify(registro.to_dict())
 
 
 @app.route('/api/dias-trabalhados/<int:id>', methods=['DELETE'])
 def deletar_dia_trabalhado(id):
     """Deletar registro de dia trabalhado"""
-    registro = DiaTrabalhado.query.get_or_404(id)
-    db.session.delete(registro)
+    def gravar():
+        registro = DiaTrabalhado.query.get_or_404(id)
+        db.session.delete(registro)
+        db.session.flush()
+        return jsonify({'message': 'Registro deletado com sucesso'}), 200
+
+    return executar_escrita(gravar)
+
+
+# ========== ROTAS DE SINCRONIZAÇÃO ==========
+
+LIMITE_ALTERACOES = 1000
+
+
+@app.route('/api/changes', methods=['GET'])
+@orcamento_consultas(8)
+def listar_alteracoes():
+    """Alterações desde o cursor `since` (delta-sync).
+
+    Sem `since` (ou com `reset: true` na resposta) o cliente deve recarregar
+    tudo e continuar a partir de `cursor`. Para cada tabela devolve as linhas
+    atuais das criadas/alteradas e os ids removidos (tombstones).
+    """
+    ultimo = db.session.query(func.max(Alteracao.id)).scalar() or 0
+    since = request.args.get('since', type=int)
+    if since is None:
+        return jsonify({'cursor': ultimo, 'reset': True})
+
+    # Cursor anterior ao diário retido (entradas podadas): exige recarga completa
+    primeiro = db.session.query(func.min(Alteracao.id)).scalar()
+    if since > ultimo or (primeiro is not None and since < primeiro - 1):
+        return jsonify({'cursor': ultimo, 'reset': True})
+
+    entradas = (
+        Alteracao.query
+        .filter(Alteracao.id > since)
+        .order_by(Alteracao.id)
+        .limit(LIMITE_ALTERACOES + 1)
+        .all()
+    )
+    tem_mais = len(entradas) > LIMITE_ALTERACOES
+    entradas = entradas[:LIMITE_ALTERACOES]
+    cursor = entradas[-1].id if entradas else since
+
+    if any(e.operacao == 'reset' for e in entradas):
+        return jsonify({'cursor': ultimo, 'reset': True})
+
+    # Última operação de cada linha dentro da janela
+    operacoes = {}
+    for e in entradas:
+        operacoes[(e.tabela, e.registro_id)] = e.operacao
+
+    resposta = {'cursor': cursor, 'reset': False, 'temMais': tem_mais}
+    for modelo, chave in ((Servidor, 'servidores'), (DiaTrabalhado, 'diasTrabalhados')):
+        tabela = TABELAS_VERSIONADAS[modelo]
+        ids = [rid for (t, rid), op in operacoes.items() if t == tabela and op == 'upsert']
+        removidos = {rid for (t, rid), op in operacoes.items() if t == tabela and op == 'delete'}
+
+        alterados = modelo.query.filter(modelo.id.in_(ids)).all() if ids else []
+        # Linha alterada e removida depois (fora da janela) também vira tombstone
+        removidos.update(set(ids) - {obj.id for obj in alterados})
+
+        resposta[chave] = {
+            'alterados': [obj.to_dict() for obj in alterados],
+            'removidos': sorted(removidos)
+        }
+    return jsonify(resposta)
+
+
+def limpar_alteracoes_antigas(dias=30):
+    """Remove entradas antigas do diário, mantendo sempre a mais recente"""
+    limite = datetime.utcnow() - timedelta(days=dias)
+    ultimo = db.session.query(func.max(Alteracao.id)).scalar()
+    if ultimo is None:
+        return 0
+    removidas = Alteracao.query.filter(Alteracao.criado_em < limite, Alteracao.id < ultimo).delete(synchronize_session=False)
     db.session.commit()
-    
-    return jsonify({'message': 'Registro deletado com sucesso'}), 200
+    return removidas
 
 
 # ========== ROTAS DE ESTATÍSTICAS ==========
 
 @app.route('/api/estatisticas', methods=['GET'])
+@orcamento_consultas(5)
 def get_estatisticas():
-    """Obter estatísticas gerais do sistema"""
-    total_servidores = Servidor.query.count()
-    total_registros = DiaTrabalhado.query.count()
+    """Obter estatísticas gerais do sistema (cache invalidado por escritas)"""
+    return jsonify(obter_cache('estatisticas', ['servidores', 'dias_trabalhados'], calcular_estatisticas))
+
+
+def calcular_estatisticas():
+    """Calcula as estatísticas gerais em uma única consulta agregada"""
+    total_servidores = db.select(func.count(Servidor.id)).scalar_subquery()
     
-    # Calcular média de horas
-    registros = DiaTrabalhado.query.filter(DiaTrabalhado.h_trab.isnot(None)).all()
-    total_minutos = sum(time_to_minutes(r.h_trab) for r in registros if r.h_trab)
-    media_horas = minutes_to_time(total_minutos // len(registros)) if registros else '00:00'
+    # Mesma regra do float() original: só entram textos numéricos ('1.5', '-2');
+    # '1,5', 'abc' e '' ficam de fora em vez de virarem 0 no CAST do SQLite
+    dias_gozar = func.trim(DiaTrabalhado.dias_gozar)
+    sem_sinal = func.ltrim(dias_gozar, '+-')
+    dias_gozar_numerico = db.and_(
+        sem_sinal.op('GLOB')('*[0-9]*'),
+        db.not_(sem_sinal.op('GLOB')('*[^0-9.]*')),
+        db.not_(sem_sinal.op('GLOB')('*.*.*')),
+        db.not_(dias_gozar.op('GLOB')('[+-][+-]*')),
+    )
     
-    # Total dias de folga
-    total_dias_folga = 0
-    for registro in DiaTrabalhado.query.filter(DiaTrabalhado.dias_gozar.isnot(None)).all():
-        try:
-            total_dias_folga += float(registro.dias_gozar)
-        except:
-            pass
+    total_servidores, total_registros, soma_minutos, com_h_trab, total_dias_folga = db.session.query(
+        total_servidores,
+        func.count(DiaTrabalhado.id),
+        func.coalesce(func.sum(DiaTrabalhado.h_trab_min), 0),
+        # Média sobre todo registro com h_trab preenchido (vazio conta como 00:00)
+        func.count(DiaTrabalhado.h_trab),
+        func.sum(db.case((dias_gozar_numerico, db.cast(dias_gozar, db.Float))))
+    ).select_from(DiaTrabalhado).one()
     
-    return jsonify({
+    return {
         'totalServidores': total_servidores,
         'totalRegistros': total_registros,
-        'mediaHoras': media_horas,
-        'totalDiasFolga': round(total_dias_folga, 2)
-    })
+        'mediaHoras': minutes_to_time(soma_minutos // com_h_trab) if com_h_trab else '00:00',
+        'totalDiasFolga': round(total_dias_folga or 0, 2)
+    }
 
 
 
 
 @app.route('/api/consulta/<nf>', methods=['GET'])
+@orcamento_consultas(5)
+@com_etag('servidores', 'dias_trabalhados')
 def consultar_servidor(nf):
-    """Consulta rápida de servidor por NF (Gestão à Vista)"""
+    """Consulta rápida de servidor por NF (Gestão à Vista)
+
+    Os totais vêm de saldos_servidores (busca por chave primária); os registros
+    detalhados só são carregados com ?registros=1.
+    """
     servidor = Servidor.query.filter_by(nf=nf).first()
     if not servidor:
         return jsonify({'error': 'Servidor não encontrado'}), 404
     
-    registros = DiaTrabalhado.query.filter_by(nf=nf).order_by(DiaTrabalhado.dia_trabalhado.desc()).all()
-    
-    # Calcular totais - Horas de Direito (que são 2x as trabalhadas)
-    total_h_direito = 0
-    total_h_descontadas = 0
-    
-    for reg in registros:
-        if reg.h_direito:
-            total_h_direito += time_to_minutes(reg.h_direito)
-        if reg.h_descontadas:
-            total_h_descontadas += time_to_minutes(reg.h_descontadas)
+    # Totais pré-calculados (Horas de Direito são 2x as trabalhadas)
+    saldo = db.session.get(SaldoServidor, nf)
+    total_h_direito = saldo.h_direito_min if saldo else 0
+    total_h_descontadas = saldo.h_descontadas_min if saldo else 0
+    total_registros = saldo.total_registros if saldo else 0
     
     # Saldo = Horas de Direito - Horas Descontadas
     saldo_minutos = total_h_direito - total_h_descontadas
@@ -846,7 +2476,7 @@ def consultar_servidor(nf):
     # Dias para gozar = Saldo / 8h (480 min)
     dias_gozar = saldo_minutos / 480 if saldo_minutos > 0 else 0
     
-    return jsonify({
+    resposta = {
         'servidor': servidor.to_dict(),
         'horasDireito': minutes_to_time(total_h_direito),
         'horasDescontadas': minutes_to_time(total_h_descontadas),
@@ -854,36 +2484,300 @@ def consultar_servidor(nf):
         'saldoNegativo': saldo_minutos < 0,
         'diasGozar': round(dias_gozar, 2),
         'horaDia': '08:00',
-        'totalRegistros': len(registros),
-        'registros': [r.to_dict() for r in registros]
+        'totalRegistros': total_registros
+    }
+    
+    # Registros detalhados apenas quando solicitados (?registros=1)
+    if request.args.get('registros') in ('1', 'true'):
+        registros = DiaTrabalhado.query.filter_by(nf=nf).order_by(DiaTrabalhado.dia_trabalhado.desc()).all()
+        resposta['registros'] = [r.to_dict() for r in registros]
+    
+    return jsonify(resposta)
+
+
+# ========== ROTAS DE ALERTAS E CALENDÁRIO ==========
+
+JANELA_MAXIMA_ALERTAS = 366
+
+
+def consulta_lembretes(prazo_de, prazo_ate):
+    """Registros com prazo máximo no intervalo, com nome/setor do cadastro do servidor.
+
+    O filtro e a ordenação (prazo_max, nome) seguem o índice
+    ix_dias_trabalhados_prazo_nome: busca por intervalo, sem ordenação à parte.
+    Registros sem servidor cadastrado ficam de fora, como na interface.
+    """
+    return (
+        db.session.query(
+            DiaTrabalhado.id,
+            DiaTrabalhado.nf,
+            Servidor.nome,
+            Servidor.setor,
+            DiaTrabalhado.dia_trabalhado,
+            DiaTrabalhado.prazo_max
+        )
+        .join(Servidor, Servidor.nf == DiaTrabalhado.nf)
+        .filter(DiaTrabalhado.prazo_max >= prazo_de, DiaTrabalhado.prazo_max <= prazo_ate)
+        .order_by(DiaTrabalhado.prazo_max, DiaTrabalhado.nome)
+    )
+
+
+def lembrete_para_dict(linha, hoje=None):
+    """Sem `hoje` o dicionário não traz diasRestantes (resposta cacheável por ETag)"""
+    registro_id, nf, nome, setor, dia_trabalhado, prazo_max = linha
+    lembrete = {
+        'id': registro_id,
+        'nf': nf,
+        'nome': nome,
+        'setor': setor,
+        'dia_trabalhado': dia_trabalhado.isoformat() if dia_trabalhado else None,
+        'prazo_max': prazo_max.isoformat(),
+        'data_aviso': (prazo_max - timedelta(days=DIAS_ALERTA_EMAIL)).isoformat(),
+    }
+    if hoje is not None:
+        lembrete['diasRestantes'] = (prazo_max - hoje).days
+    return lembrete
+
+
+@app.route('/api/alertas', methods=['GET'])
+@orcamento_consultas(1)
+def listar_alertas():
+    """Registros cujo prazo máximo vence nos próximos `janela` dias (padrão 30)
+
+    Com `exato=1` devolve só os que vencem exatamente daqui a `janela` dias
+    (o lembrete de 30 dias). `hoje` (AAAA-MM-DD) permite usar a data do
+    navegador; sem ele vale a data do servidor.
+    """
+    try:
+        hoje = parse_data_parametro(request.args.get('hoje'), 'hoje') or data_hoje()
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    try:
+        janela = int(request.args.get('janela', DIAS_ALERTA_EMAIL))
+    except ValueError:
+        janela = -1
+    if not 0 <= janela <= JANELA_MAXIMA_ALERTAS:
+        return jsonify({'error': f'Parâmetro janela deve estar entre 0 e {JANELA_MAXIMA_ALERTAS}'}), 400
+
+    prazo_ate = hoje + timedelta(days=janela)
+    prazo_de = prazo_ate if request.args.get('exato') in ('1', 'true') else hoje
+    alertas = [lembrete_para_dict(linha, hoje) for linha in consulta_lembretes(prazo_de, prazo_ate)]
+    return jsonify({
+        'hoje': hoje.isoformat(),
+        'janela': janela,
+        'total': len(alertas),
+        'alertas': alertas
+    })
+
+
+@app.route('/api/calendario', methods=['GET'])
+@orcamento_consultas(3)
+@com_etag('servidores', 'dias_trabalhados')
+def calendario_prazos():
+    """Lembretes de prazo e contagem de dias trabalhados de um mês (`mes=AAAA-MM`)
+
+    O lembrete aparece DIAS_ALERTA_EMAIL dias antes do prazo máximo, então o
+    mês do calendário corresponde a um intervalo deslocado de prazo_max.
+    """
+    try:
+        inicio = datetime.strptime(request.args.get('mes', ''), '%Y-%m').date()
+    except ValueError:
+        return jsonify({'error': 'Parâmetro mes inválido: use o formato AAAA-MM'}), 400
+    fim = (inicio + timedelta(days=32)).replace(day=1) - timedelta(days=1)
+    antecedencia = timedelta(days=DIAS_ALERTA_EMAIL)
+
+    eventos = {}
+    for linha in consulta_lembretes(inicio + antecedencia, fim + antecedencia):
+        # Sem diasRestantes: o valor mudaria a cada dia sem mudar o ETag
+        evento = lembrete_para_dict(linha)
+        eventos.setdefault(evento['data_aviso'], []).append(evento)
+
+    trabalhados = {
+        dia.isoformat(): total
+        for dia, total in db.session.query(DiaTrabalhado.dia_trabalhado, func.count())
+        .filter(DiaTrabalhado.dia_trabalhado >= inicio, DiaTrabalhado.dia_trabalhado <= fim)
+        .group_by(DiaTrabalhado.dia_trabalhado)
+    }
+
+    return jsonify({
+        'mes': inicio.strftime('%Y-%m'),
+        'eventos': eventos,
+        'lembretesPorDia': {dia: len(lista) for dia, lista in eventos.items()},
+        'trabalhadosPorDia': trabalhados
     })
 
 
+# ========== ROTAS DE RELATÓRIOS ==========
+
+@app.route('/api/relatorios/setor', methods=['GET'])
+@orcamento_consultas(7)
+@com_etag('dias_trabalhados', por_dia=True)
+def relatorio_por_setor():
+    """Totais de horas e saldo por setor (cache invalidado por escritas)
+
+    `janela` (padrão 30) define o que conta como horas a vencer: saldo dos
+    registros cujo prazo máximo cai entre hoje e hoje + janela. Como esse
+    total depende do dia, a data entra na chave do cache e na ETag; ao gravar
+    um relatório novo, os de dias anteriores saem do cache.
+    """
+    try:
+        janela = int(request.args.get('janela', DIAS_ALERTA_EMAIL))
+    except ValueError:
+        janela = -1
+    if not 0 <= janela <= JANELA_MAXIMA_ALERTAS:
+        return jsonify({'error': f'Parâmetro janela deve estar entre 0 e {JANELA_MAXIMA_ALERTAS}'}), 400
+
+    hoje = data_hoje()
+    chave = f'relatorio_setor:{hoje.isoformat()}:{janela}'
+
+    def calcular():
+        # Chaves 'relatorio_setor:<data anterior>:...' ordenam antes de 'relatorio_setor:<hoje>'
+        CacheResultado.query.filter(
+            CacheResultado.chave >= 'relatorio_setor:',
+            CacheResultado.chave < f'relatorio_setor:{hoje.isoformat()}'
+        ).delete(synchronize_session=False)
+        return calcular_relatorio_setor(hoje, janela)
+
+    return jsonify(obter_cache(chave, ['dias_trabalhados'], calcular))
+
+
+def calcular_relatorio_setor(hoje, janela):
+    """Agrega todos os setores em um único GROUP BY sobre as colunas em minutos"""
+    direito = func.coalesce(func.sum(DiaTrabalhado.h_direito_min), 0)
+    descontadas = func.coalesce(func.sum(DiaTrabalhado.h_descontadas_min), 0)
+    a_vencer = func.coalesce(func.sum(db.case(
+        (DiaTrabalhado.prazo_max.between(hoje, hoje + timedelta(days=janela)),
+         func.coalesce(DiaTrabalhado.h_direito_min, 0) - func.coalesce(DiaTrabalhado.h_descontadas_min, 0)),
+        else_=0
+    )), 0)
+    linhas = db.session.query(
+        DiaTrabalhado.setor,
+        func.count(DiaTrabalhado.nf.distinct()),
+        func.count(DiaTrabalhado.id),
+        func.coalesce(func.sum(DiaTrabalhado.h_trab_min), 0),
+        direito,
+        descontadas,
+        a_vencer
+    ).group_by(DiaTrabalhado.setor).order_by(DiaTrabalhado.setor).all()
+
+    def resumo(servidores, registros, trabalhadas, h_direito, h_descontadas, h_a_vencer):
+        saldo = h_direito - h_descontadas
+        return {
+            'servidores': servidores,
+            'registros': registros,
+            'horasTrabalhadas': minutes_to_time(trabalhadas),
+            'horasDireito': minutes_to_time(h_direito),
+            'horasDescontadas': minutes_to_time(h_descontadas),
+            'saldo': minutes_to_time(abs(saldo)),
+            'saldoMinutos': saldo,
+            'saldoNegativo': saldo < 0,
+            'diasGozar': round(saldo / 480, 2) if saldo > 0 else 0,
+            'horasAVencer': minutes_to_time(max(h_a_vencer, 0))
+        }
+
+    # Um servidor só conta uma vez no total, mesmo com registros em mais de um setor
+    total_servidores = db.session.query(func.count(DiaTrabalhado.nf.distinct())).scalar()
+    totais = [sum(coluna) for coluna in zip(*(linha[2:] for linha in linhas))] or [0] * 5
+    return {
+        'dataReferencia': hoje.isoformat(),
+        'janela': janela,
+        'setores': [{'setor': setor, **resumo(*valores)} for setor, *valores in linhas],
+        'total': resumo(total_servidores, *totais)
+    }
+
+
+@app.route('/api/relatorios/agregados', methods=['GET'])
+@orcamento_consultas(7)
+@com_etag('dias_trabalhados')
+def relatorio_agregados():
+    """Totais em minutos por mês, setor e servidor dos registros filtrados
+
+    Aceita os mesmos filtros da listagem (`nf`, `setor`, `busca`, `data_inicio`,
+    `data_fim`, `prazo_de`, `prazo_ate`). Alimenta os cards, o dashboard e o
+    resumo aglutinado sem o navegador baixar os registros: o tamanho da
+    resposta depende do número de servidores e meses, não de registros. Sem
+    filtros (carga inicial da tela) o resultado vem do cache compartilhado.
+    """
+    try:
+        if not request.args:
+            return jsonify(obter_cache('relatorio_agregados', ['dias_trabalhados'],
+                                       lambda: calcular_agregados_registros(request.args)))
+        return jsonify(calcular_agregados_registros(request.args))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
+
+def calcular_agregados_registros(args):
+    """Três GROUP BY (mês, setor, servidor) sobre as colunas em minutos"""
+    trabalhadas = func.coalesce(func.sum(DiaTrabalhado.h_trab_min), 0)
+    direito = func.coalesce(func.sum(DiaTrabalhado.h_direito_min), 0)
+    descontadas = func.coalesce(func.sum(DiaTrabalhado.h_descontadas_min), 0)
+
+    def agrupar(*colunas):
+        query = db.session.query(*colunas, func.count(DiaTrabalhado.id), trabalhadas, direito, descontadas)
+        return aplicar_filtros_registros(query, args)
+
+    def minutos(registros, h_trab, h_direito, h_descontadas):
+        return {'registros': registros, 'trabalhadasMin': h_trab, 'direitoMin': h_direito,
+                'descontadasMin': h_descontadas}
+
+    mes = func.coalesce(func.substr(DiaTrabalhado.dia_trabalhado, 1, 7), 'Sem data')
+    setor = func.coalesce(func.nullif(DiaTrabalhado.setor, ''), 'Sem setor')
+    por_mes = [{'mes': m, **minutos(*valores)} for m, *valores in agrupar(mes).group_by(mes).order_by(mes)]
+    por_setor = [{'setor': s, **minutos(*valores)} for s, *valores in agrupar(setor).group_by(setor)]
+    por_servidor = [
+        {'nf': nf, 'nome': nome or '', 'setor': setor or '', **minutos(*valores)}
+        for nf, nome, setor, *valores in agrupar(
+            DiaTrabalhado.nf, func.max(DiaTrabalhado.nome), func.max(DiaTrabalhado.setor)
+        ).group_by(DiaTrabalhado.nf).order_by(func.max(DiaTrabalhado.nome))
+    ]
+
+    totais = [sum(item[campo] for item in por_servidor)
+              for campo in ('registros', 'trabalhadasMin', 'direitoMin', 'descontadasMin')]
+    return {
+        'total': {'servidores': len(por_servidor), **minutos(*totais)},
+        'porMes': por_mes,
+        'porSetor': por_setor,
+        'porServidor': por_servidor
+    }
+
+
 # ========== ROTAS DE BACKUP ==========
 
 @app.route('/api/backup/criar', methods=['POST'])
 def criar_backup_manual():
     """Criar backup manual"""
-    backup_path = criar_backup()
-    if backup_path:
+    try:
+        backup_path, novo = gerar_backup()
+    except Exception as e:
+        print(f"Erro ao criar backup: {e}")
+        backup_path, novo = None, False
+
+    if backup_path and novo:
         return jsonify({
             'message': 'Backup criado com sucesso',
             'arquivo': os.path.basename(backup_path)
         }), 201
+    if backup_path:
+        return jsonify({
+            'message': 'Banco sem alterações desde o último backup',
+            'arquivo': os.path.basename(backup_path)
+        }), 200
     return jsonify({'error': 'Erro ao criar backup'}), 500
 
 
 @app.route('/api/backup/listar', methods=['GET'])
 def listar_backups():
-    """Listar backups disponíveis"""
-    backups = []
-    for backup_file in sorted(Path(app.config['BACKUP_FOLDER']).glob('backup_*.db'), reverse=True):
-        stat = backup_file.stat()
-        backups.append({
-            'arquivo': backup_file.name,
-            'tamanho': stat.st_size,
-            'criado_em': datetime.fromtimestamp(stat.st_mtime).isoformat()
-        })
+    """Listar backups disponíveis (a partir do manifesto, sem stat em cada arquivo)"""
+    manifesto = carregar_manifesto_backups()
+    backups = [
+        {
+            'arquivo': item['arquivo'],
+            'tamanho': item['tamanho'],
+            'criado_em': item['criado_em']
+        }
+        for item in reversed(manifesto['backups'])
+    ]
     return jsonify(backups)
 
 
@@ -896,72 +2790,602 @@ def download_backup(filename):
     return jsonify({'error': 'Backup não encontrado'}), 404
 
 
+@app.route('/api/emails/fila', methods=['GET'])
+def status_fila_emails():
+    """Situação da fila de e-mails: contagem por status e últimas mensagens"""
+    contagem = dict(db.session.query(EmailPendente.status, func.count()).group_by(EmailPendente.status).all())
+    recentes = EmailPendente.query.order_by(EmailPendente.id.desc()).limit(50).all()
+    return jsonify({'status': contagem, 'recentes': [e.to_dict() for e in recentes]})
+
+
+@app.route('/api/metrics', methods=['GET'])
+def exportar_metricas():
+    """Métricas de todos os workers no formato texto do Prometheus"""
+    return Response(formatar_prometheus(combinar_metricas()), mimetype='text/plain; version=0.0.4; charset=utf-8')
+
+
+@app.route('/api/agendador/status', methods=['GET'])
+def status_agendador():
+    """Última execução de cada tarefa agendada e próximos horários (se este processo for o líder)"""
+    execucoes = {e.tarefa: e.to_dict() for e in ExecucaoTarefa.query.all()}
+    resposta = []
+    for tarefa_id in TAREFAS_AGENDADAS:
+        item = execucoes.get(tarefa_id, {'tarefa': tarefa_id, 'ultima_execucao': None})
+        job = agendador.get_job(tarefa_id) if agendador else None
+        item['proxima_execucao'] = job.next_run_time.isoformat() if job and job.next_run_time else None
+        resposta.append(item)
+    return jsonify({'lider': agendador is not None, 'processo': os.getpid(), 'tarefas': resposta})
+
+
 # ========== ROTAS DE IMPORTAÇÃO/EXPORTAÇÃO ==========
 
+LOTE_EXPORTACAO = 500
+
+
+def iterar_em_lotes(serializador):
+    """Percorre a tabela em lotes já serializados, sem carregar tudo na memória"""
+    resultado = db.session.execute(
+        serializador.select()
+        .order_by(serializador.modelo.id)
+        .execution_options(yield_per=LOTE_EXPORTACAO)
+    )
+    for linhas in resultado.partitions():
+        yield serializador.lista(linhas)
+
+
+def gerar_exportacao_json():
+    """Gera o JSON de exportação em pedaços, na mesma estrutura do jsonify anterior"""
+    exportado_em = app.json.dumps(datetime.now().isoformat())
+
+    yield '{"diasTrabalhados": ['
+    separador = ''
+    for lote in iterar_em_lotes(SERIALIZADOR_REGISTRO):
+        yield separador + ','.join(map(codificar_json, lote))
+        separador = ','
+    yield f'], "exportado_em": {exportado_em}, "servidores": ['
+    separador = ''
+    for lote in iterar_em_lotes(SERIALIZADOR_SERVIDOR):
+        yield separador + ','.join(map(codificar_json, lote))
+        separador = ','
+    yield ']}'
+
+
+def gerar_exportacao_ndjson():
+    """Gera a exportação como NDJSON: uma linha de cabeçalho e uma linha por item"""
+    yield app.json.dumps({'tipo': 'exportacao', 'exportado_em': datetime.now().isoformat()}) + '\n'
+    for lote in iterar_em_lotes(SERIALIZADOR_SERVIDOR):
+        yield ''.join(codificar_json({'dados': item, 'tipo': 'servidor'}) + '\n' for item in lote)
+    for lote in iterar_em_lotes(SERIALIZADOR_REGISTRO):
+        yield ''.join(codificar_json({'dados': item, 'tipo': 'diaTrabalhado'}) + '\n' for item in lote)
+
+
 @app.route('/api/exportar/json', methods=['GET'])
 def exportar_json():
-    """Exportar todos os dados para JSON"""
-    servidores = Servidor.query.all()
-    dias_trabalhados = DiaTrabalhado.query.all()
-    
-    data = {
-        'servidores': [s.to_dict() for s in servidores],
-        'diasTrabalhados': [d.to_dict() for d in dias_trabalhados],
-        'exportado_em': datetime.now().isoformat()
+    """Exportar todos os dados para JSON (resposta em streaming)"""
+    return Response(stream_with_context(gerar_exportacao_json()), mimetype='application/json')
+
+
+@app.route('/api/exportar/ndjson', methods=['GET'])
+def exportar_ndjson():
+    """Exportar todos os dados em NDJSON (um objeto JSON por linha, em streaming)"""
+    return Response(stream_with_context(gerar_exportacao_ndjson()), mimetype='application/x-ndjson')
+
+
+
+# Mesmos cabeçalhos da planilha de controle: o arquivo exportado pode ser reimportado
+COLUNAS_EXPORTACAO_XLSX = [
+    ('NF', DiaTrabalhado.nf),
+    ('Vinc', DiaTrabalhado.vinculo),
+    ('Nome', DiaTrabalhado.nome),
+    ('Setor', DiaTrabalhado.setor),
+    ('Dia Trabalhado', DiaTrabalhado.dia_trabalhado),
+    ('Entrada', DiaTrabalhado.entrada),
+    ('Saída', DiaTrabalhado.saida),
+    ('H. Trab.', DiaTrabalhado.h_trab),
+    ('Horas de Direito', DiaTrabalhado.h_direito),
+    ('Prazo Max', DiaTrabalhado.prazo_max),
+    ('Horas Totais', DiaTrabalhado.h_totais),
+    ('Hora/dia', DiaTrabalhado.hora_dia),
+    ('Dias para gozar', DiaTrabalhado.dias_gozar),
+    ('Dias', DiaTrabalhado.dias_gozados),
+    ('Horas Descontadas', DiaTrabalhado.h_descontadas),
+    ('Saldo', DiaTrabalhado.saldo),
+    ('Observação', DiaTrabalhado.observacao),
+]
+COLUNAS_RESUMO_XLSX = ['Servidores', 'Registros', 'Horas Trabalhadas', 'Horas de Direito', 'Horas Descontadas', 'Saldo']
+
+
+def consulta_resumo_exportacao(args, *agrupamento):
+    """Totais por `agrupamento` calculados no SQL, com os mesmos filtros da exportação"""
+    direito = func.coalesce(func.sum(DiaTrabalhado.h_direito_min), 0)
+    descontadas = func.coalesce(func.sum(DiaTrabalhado.h_descontadas_min), 0)
+    query = db.session.query(
+        *agrupamento,
+        func.count(DiaTrabalhado.nf.distinct()),
+        func.count(DiaTrabalhado.id),
+        func.coalesce(func.sum(DiaTrabalhado.h_trab_min), 0),
+        direito,
+        descontadas,
+        direito - descontadas
+    )
+    return aplicar_filtros_registros(query, args).group_by(*agrupamento).order_by(*agrupamento)
+
+
+def linha_resumo_xlsx(chaves, totais):
+    servidores, registros, *minutos = totais
+    return [*chaves, servidores, registros, *(minutes_to_time(m) for m in minutos)]
+
+
+def gerar_planilha_exportacao(args, destino):
+    """Grava a planilha em `destino` no modo write_only do openpyxl.
+
+    Os registros são lidos em lotes de LOTE_EXPORTACAO (tuplas de colunas,
+    sem objetos do ORM) e cada linha vai direto para o arquivo temporário da
+    aba, então a memória não cresce com o número de registros.
+    """
+    # Consultas montadas antes do arquivo: filtro inválido falha sem planilha pela metade
+    resumo_setores = consulta_resumo_exportacao(args, DiaTrabalhado.setor)
+    resumo_servidores = consulta_resumo_exportacao(args, DiaTrabalhado.nf).add_columns(
+        func.max(DiaTrabalhado.nome), func.max(DiaTrabalhado.setor)
+    )
+    # (setor, dia_trabalhado, id) segue o índice ix_dias_trabalhados_setor_dia: sem ordenação em memória
+    consulta_registros = aplicar_filtros_registros(
+        db.session.query(*(coluna for _, coluna in COLUNAS_EXPORTACAO_XLSX)), args
+    ).order_by(DiaTrabalhado.setor, DiaTrabalhado.dia_trabalhado, DiaTrabalhado.id)
+
+    planilha = Workbook(write_only=True)
+    negrito = Font(bold=True)
+
+    def aba(titulo, cabecalho):
+        folha = planilha.create_sheet(titulo)
+        celulas = []
+        for texto in cabecalho:
+            celula = WriteOnlyCell(folha, value=texto)
+            celula.font = negrito
+            celulas.append(celula)
+        folha.append(celulas)
+        return folha
+
+    setores = aba('Resumo por Setor', ['Setor'] + COLUNAS_RESUMO_XLSX)
+    for setor, *totais in resumo_setores:
+        setores.append(linha_resumo_xlsx([setor], totais))
+
+    servidores = aba('Resumo por Servidor', ['NF', 'Nome', 'Setor'] + COLUNAS_RESUMO_XLSX[1:])
+    for nf, _, registros_servidor, *minutos, nome, setor in resumo_servidores.yield_per(LOTE_EXPORTACAO):
+        servidores.append([nf, nome, setor, registros_servidor, *map(minutes_to_time, minutos)])
+
+    registros = aba('Registros', [titulo for titulo, _ in COLUNAS_EXPORTACAO_XLSX])
+    total = 0
+    for linha in consulta_registros.yield_per(LOTE_EXPORTACAO):
+        registros.append(list(linha))
+        total += 1
+
+    planilha.save(destino)
+    return total
+
+
+@app.route('/api/exportar/xlsx', methods=['GET'])
+def exportar_xlsx():
+    """Exportar registros para planilha (.xlsx) com resumos por setor e por servidor
+
+    Aceita os filtros `setor`, `nf`, `data_inicio` e `data_fim` (e os demais
+    filtros da listagem de dias trabalhados).
+    """
+    # Arquivo temporário anônimo: o send_file fecha (e o sistema apaga) ao fim da resposta
+    arquivo = tempfile.TemporaryFile(suffix='.xlsx')
+    try:
+        gerar_planilha_exportacao(request.args, arquivo)
+    except ValueError as e:
+        arquivo.close()
+        return jsonify({'error': str(e)}), 400
+    except Exception:
+        arquivo.close()
+        raise
+    arquivo.seek(0)
+
+    partes = ['banco_horas', request.args.get('setor'), request.args.get('nf'), datetime.now().strftime('%Y%m%d_%H%M%S')]
+    return send_file(
+        arquivo,
+        mimetype='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
+        as_attachment=True,
+        download_name='_'.join(p for p in partes if p) + '.xlsx'
+    )
+
+
+LOTE_IMPORTACAO = 500
+
+
+def mapear_servidor_importacao(servidor_data):
+    """Converte um servidor do JSON de importação em valores de insert"""
+    return {
+        'nf': servidor_data['nf'],
+        'nome': servidor_data['nome'],
+        'setor': servidor_data['setor']
+    }
+
+
+def mapear_registro_importacao(dia_data):
+    """Converte um dia trabalhado do JSON de importação em valores de insert"""
+    valores = {
+        'nf': dia_data['nf'],
+        'nome': dia_data['nome'],
+        'setor': dia_data['setor'],
+        'vinculo': dia_data.get('vinculo'),
+        'dia_trabalhado': datetime.fromisoformat(dia_data['diaTrabalho']).date() if dia_data.get('diaTrabalho') else None,
+        'entrada': dia_data.get('entrada'),
+        'saida': dia_data.get('saida'),
+        'h_trab': dia_data.get('hTrab'),
+        'h_direito': dia_data.get('hDireito'),
+        'prazo_max': datetime.fromisoformat(dia_data['prazoMax']).date() if dia_data.get('prazoMax') else None,
+        'h_totais': dia_data.get('hTotais'),
+        'hora_dia': dia_data.get('horaDia'),
+        'dias_gozar': dia_data.get('diasGozar'),
+        'dias_gozados': dia_data.get('diasGozados'),
+        'h_descontadas': dia_data.get('hDescontadas'),
+        'saldo': dia_data.get('saldo')
+    }
+    # Insert em lote não dispara os eventos do ORM: preencher *_min aqui
+    for campo, campo_min in CAMPOS_MINUTOS_REGISTRO.items():
+        valores[campo_min] = hora_para_minutos(valores[campo])
+    return valores
+
+
+def gravar_lote_importacao(modelo, valores):
+    """Insere um lote via bulk insert e confirma em transação própria.
+
+    Faz o que os hooks de flush fariam para objetos do ORM: diário de
+    alterações, versões das tabelas e, para registros, saldos por servidor.
+    """
+    inicio = time.perf_counter()
+    tabela = TABELAS_VERSIONADAS[modelo]
+
+    ids = db.session.scalars(db.insert(modelo).returning(modelo.id), valores).all()
+    conn = db.session.connection()
+    agora = datetime.utcnow()
+    conn.execute(Alteracao.__table__.insert(), [
+        {'tabela': tabela, 'registro_id': registro_id, 'operacao': 'upsert', 'criado_em': agora}
+        for registro_id in ids
+    ])
+    if modelo is DiaTrabalhado:
+        recalcular_saldos_servidores(conn, {v['nf'] for v in valores})
+    incrementar_versoes(conn, [tabela])
+    db.session.commit()
+
+    return {
+        'tabela': tabela,
+        'registros': len(ids),
+        'tempo_ms': round((time.perf_counter() - inicio) * 1000, 1)
     }
-    
-    return jsonify(data)
 
 
 @app.route('/api/importar/json', methods=['POST'])
 def importar_json():
-    """Importar dados de JSON"""
-    data = request.json
-    
+    """Importar dados de JSON
+
+    O corpo é lido em streaming e gravado em lotes de LOTE_IMPORTACAO, cada
+    um em sua própria transação, para não segurar o lock de escrita do
+    SQLite durante toda a importação. A resposta traz o tempo de cada lote.
+    """
+    inicio = time.perf_counter()
+    lotes = []
+    pendentes = {Servidor: [], DiaTrabalhado: []}
+
+    def gravar(modelo):
+        if pendentes[modelo]:
+            lotes.append(gravar_lote_importacao(modelo, pendentes[modelo]))
+            pendentes[modelo] = []
+
     try:
-        # Importar servidores
-        for servidor_data in data.get('servidores', []):
-            if not Servidor.query.filter_by(nf=servidor_data['nf']).first():
-                servidor = Servidor(
-                    nf=servidor_data['nf'],
-                    nome=servidor_data['nome'],
-                    setor=servidor_data['setor']
-                )
-                db.session.add(servidor)
-        
-        # Importar dias trabalhados
-        for dia_data in data.get('diasTrabalhados', []):
-            registro = DiaTrabalhado(
-                nf=dia_data['nf'],
-                nome=dia_data['nome'],
-                setor=dia_data['setor'],
-                vinculo=dia_data.get('vinculo'),
-                dia_trabalhado=datetime.fromisoformat(dia_data['diaTrabalho']).date() if dia_data.get('diaTrabalho') else None,
-                entrada=dia_data.get('entrada'),
-                saida=dia_data.get('saida'),
-                h_trab=dia_data.get('hTrab'),
-                h_direito=dia_data.get('hDireito'),
-                prazo_max=datetime.fromisoformat(dia_data['prazoMax']).date() if dia_data.get('prazoMax') else None,
-                h_totais=dia_data.get('hTotais'),
-                hora_dia=dia_data.get('horaDia'),
-                dias_gozar=dia_data.get('diasGozar'),
-                dias_gozados=dia_data.get('diasGozados'),
-                h_descontadas=dia_data.get('hDescontadas'),
-                saldo=dia_data.get('saldo')
+        # Uma única consulta para os NFs já cadastrados
+        nfs_existentes = {nf for (nf,) in db.session.query(Servidor.nf)}
+
+        for chave, item in iterar_json_stream(request.stream):
+            if chave == 'servidores':
+                if item['nf'] in nfs_existentes:
+                    continue
+                nfs_existentes.add(item['nf'])
+                modelo, valores = Servidor, mapear_servidor_importacao(item)
+            elif chave == 'diasTrabalhados':
+                modelo, valores = DiaTrabalhado, mapear_registro_importacao(item)
+            else:
+                continue
+
+            pendentes[modelo].append(valores)
+            if len(pendentes[modelo]) >= LOTE_IMPORTACAO:
+                gravar(modelo)
+
+        gravar(Servidor)
+        gravar(DiaTrabalhado)
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({
+            'error': str(e),
+            'lotesGravados': lotes
+        }), 400
+
+    # Criar backup após importação (fora do caminho da resposta)
+    if lotes:
+        threading.Thread(target=criar_backup, daemon=True).start()
+
+    return jsonify({
+        'message': 'Dados importados com sucesso',
+        'servidores': sum(l['registros'] for l in lotes if l['tabela'] == 'servidores'),
+        'diasTrabalhados': sum(l['registros'] for l in lotes if l['tabela'] == 'dias_trabalhados'),
+        'lotes': lotes,
+        'tempo_ms': round((time.perf_counter() - inicio) * 1000, 1)
+    }), 200
+
+
+
+# ========== IMPORTAÇÃO DA PLANILHA (XLSX) ==========
+
+# Cabeçalho normalizado da planilha "Controle do Banco de Horas" -> campo do modelo
+COLUNAS_PLANILHA = {
+    'NF': 'nf',
+    'VINC': 'vinculo',
+    'NOME': 'nome',
+    'SETOR': 'setor',
+    'DIA TRABALHADO': 'dia_trabalhado',
+    'ENTRADA': 'entrada',
+    'SAIDA': 'saida',
+    'H. TRAB.': 'h_trab',
+    'HORAS DE DIREITO': 'h_direito',
+    'PRAZO MAX': 'prazo_max',
+    'HORAS TOTAIS': 'h_totais',
+    'HORA/DIA': 'hora_dia',
+    'DIAS PARA GOZAR': 'dias_gozar',
+    'DIAS': 'dias_gozados',
+    'HORAS DESCONTADAS': 'h_descontadas',
+    'SALDO': 'saldo'
+}
+ABA_REGISTROS = 'Registros'
+ABA_SERVIDORES = 'Servidores'
+EPOCA_EXCEL = datetime(1899, 12, 30)
+
+
+def normalizar_texto_planilha(valor):
+    """Maiúsculas, sem acentos e com espaços simples (cabeçalhos e nomes)"""
+    texto = unicodedata.normalize('NFKD', str(valor)).encode('ascii', 'ignore').decode()
+    return ' '.join(texto.upper().split())
+
+
+def celula_nf(valor):
+    if valor is None or valor == '':
+        return None
+    if isinstance(valor, float):
+        valor = int(valor)
+    return str(valor).strip() or None
+
+
+def celula_texto(valor):
+    if valor is None:
+        return None
+    if isinstance(valor, float):
+        valor = round(valor, 2)
+    texto = str(valor).strip()
+    # Fórmula sem valor calculado salvo no arquivo
+    return texto if texto and not texto.startswith('=') else None
+
+
+def celula_data(valor):
+    """Data da célula (datetime/date ou texto DD/MM/AAAA); None se vazia ou inválida"""
+    if isinstance(valor, datetime):
+        return valor.date()
+    if isinstance(valor, date):
+        return valor
+    if isinstance(valor, str):
+        try:
+            return datetime.strptime(valor.strip(), '%d/%m/%Y').date()
+        except ValueError:
+            return None
+    return None
+
+
+def celula_hora(valor):
+    """Hora da célula em HH:MM, inclusive durações acima de 24h e frações de dia"""
+    if valor is None:
+        return None
+    if isinstance(valor, dt_time):
+        return f"{valor.hour:02d}:{valor.minute:02d}"
+    if isinstance(valor, datetime):
+        # Durações acima de 24h chegam como data a partir da época do Excel
+        valor = valor - EPOCA_EXCEL
+    if isinstance(valor, timedelta):
+        return minutes_to_time(round(valor.total_seconds() / 60))
+    if isinstance(valor, (int, float)):
+        return minutes_to_time(round(valor * 24 * 60))
+    texto = celula_texto(valor)
+    return texto if hora_para_minutos(texto) is not None else None
+
+
+def ler_servidores_planilha(planilha):
+    """Aba de servidores (pequena): {nf: valores} e {nome normalizado: nf}"""
+    servidores = {}
+    por_nome = {}
+    if ABA_SERVIDORES not in planilha.sheetnames:
+        return servidores, por_nome
+    for nf, nome, setor, *_ in planilha[ABA_SERVIDORES].iter_rows(min_row=2, values_only=True):
+        nf = celula_nf(nf)
+        nome = celula_texto(nome)
+        if not nf or not nome:
+            continue
+        servidores[nf] = {'nf': nf, 'nome': nome, 'setor': celula_texto(setor) or ''}
+        por_nome[normalizar_texto_planilha(nome)] = nf
+    return servidores, por_nome
+
+
+def iterar_registros_planilha(planilha, por_nome, erros):
+    """Percorre a aba de registros linha a linha, gerando valores prontos para o insert.
+
+    Linhas sem NF herdam o NF do servidor de mesmo nome; as que não puderem
+    ser aproveitadas vão para `erros` como (linha, motivo).
+    """
+    aba = planilha[ABA_REGISTROS] if ABA_REGISTROS in planilha.sheetnames else planilha.worksheets[0]
+    colunas = None
+
+    for numero, linha in enumerate(aba.iter_rows(values_only=True), start=1):
+        if colunas is None:
+            cabecalho = [normalizar_texto_planilha(c) if c is not None else None for c in linha]
+            if 'NF' in cabecalho and 'DIA TRABALHADO' in cabecalho:
+                colunas = [(i, COLUNAS_PLANILHA[c]) for i, c in enumerate(cabecalho) if c in COLUNAS_PLANILHA]
+            continue
+
+        celulas = {campo: linha[i] for i, campo in colunas if i < len(linha)}
+        if all(v is None for v in celulas.values()):
+            continue
+
+        nome = celula_texto(celulas.get('nome'))
+        nf = celula_nf(celulas.get('nf')) or por_nome.get(normalizar_texto_planilha(nome or ''))
+        dia = celula_data(celulas.get('dia_trabalhado'))
+        if not nome and not dia:
+            continue  # linhas de título ("HORAS TRABALHADAS", ...)
+        if not nf:
+            erros.append((numero, f'NF não informado e servidor "{nome}" não encontrado'))
+            continue
+        if not dia:
+            erros.append((numero, 'dia trabalhado ausente ou inválido'))
+            continue
+
+        valores = {
+            'nf': nf,
+            'nome': nome or '',
+            'setor': celula_texto(celulas.get('setor')) or '',
+            'vinculo': celula_texto(celulas.get('vinculo')),
+            'dia_trabalhado': dia,
+            'entrada': celula_hora(celulas.get('entrada')),
+            'saida': celula_hora(celulas.get('saida')),
+            'h_trab': celula_hora(celulas.get('h_trab')),
+            'h_direito': celula_hora(celulas.get('h_direito')),
+            'prazo_max': celula_data(celulas.get('prazo_max')) or calcular_prazo_maximo(dia),
+            'h_totais': celula_hora(celulas.get('h_totais')),
+            'hora_dia': celula_hora(celulas.get('hora_dia')) or '08:00',
+            'dias_gozar': celula_texto(celulas.get('dias_gozar')),
+            'dias_gozados': celula_texto(celulas.get('dias_gozados')),
+            'h_descontadas': celula_hora(celulas.get('h_descontadas')),
+            'saldo': celula_hora(celulas.get('saldo'))
+        }
+        # Mesma regra das telas: trabalhadas = saída - entrada, direito = 2x
+        if valores['entrada'] and valores['saida']:
+            valores['h_trab'] = calcular_diferenca_horas(valores['entrada'], valores['saida'])
+            valores['h_direito'] = multiplicar_horas(valores['h_trab'], 2)
+        for campo, campo_min in CAMPOS_MINUTOS_REGISTRO.items():
+            valores[campo_min] = hora_para_minutos(valores[campo])
+        yield valores
+
+
+def importar_planilha_xlsx(arquivo):
+    """Importa a planilha de controle em modo read_only, gravando em lotes.
+
+    Servidores novos (da aba de servidores ou só citados nos registros) e
+    registros ainda não cadastrados (mesmo NF, dia e entrada) são inseridos
+    em lotes de LOTE_IMPORTACAO, como na importação JSON. A checagem de
+    duplicados consulta só as chaves de cada lote (índice nf + dia); lotes
+    anteriores desta importação já estão gravados quando o próximo é checado,
+    então a memória não cresce com o tamanho da tabela nem da planilha.
+    """
+    inicio = time.perf_counter()
+    lotes = []
+    erros = []
+    ignorados = 0
+
+    def gravar(modelo, valores):
+        if valores:
+            lotes.append(gravar_lote_importacao(modelo, valores))
+
+    def servidores_cadastrados(nfs):
+        return {nf for (nf,) in db.session.query(Servidor.nf).filter(Servidor.nf.in_(nfs))}
+
+    def gravar_registros(lote):
+        nonlocal ignorados
+        cadastrados = servidores_cadastrados({v['nf'] for v in lote})
+        # nf IN (...) AND dia IN (...) vira buscas em ix_dias_trabalhados_nf_dia (o row value
+        # (nf, dia) IN (VALUES ...) faria varredura); o excesso é descartado pela chave exata abaixo
+        existentes = set(
+            db.session.query(DiaTrabalhado.nf, DiaTrabalhado.dia_trabalhado, DiaTrabalhado.entrada)
+            .filter(
+                DiaTrabalhado.nf.in_({v['nf'] for v in lote}),
+                DiaTrabalhado.dia_trabalhado.in_({v['dia_trabalhado'] for v in lote})
             )
-            db.session.add(registro)
-        
-        db.session.commit()
-        
-        # Criar backup após importação
-        criar_backup()
-        
-        return jsonify({'message': 'Dados importados com sucesso'}), 200
-    
+        )
+        novos_servidores, novos_registros = [], []
+        for valores in lote:
+            chave = (valores['nf'], valores['dia_trabalhado'], valores['entrada'])
+            if chave in existentes:
+                ignorados += 1
+                continue
+            existentes.add(chave)
+            if valores['nf'] not in cadastrados:
+                cadastrados.add(valores['nf'])
+                novos_servidores.append({'nf': valores['nf'], 'nome': valores['nome'], 'setor': valores['setor']})
+            novos_registros.append(valores)
+        gravar(Servidor, novos_servidores)
+        gravar(DiaTrabalhado, novos_registros)
+
+    planilha = load_workbook(arquivo, read_only=True, data_only=True)
+    try:
+        servidores, por_nome = ler_servidores_planilha(planilha)
+        nfs = list(servidores)
+        for i in range(0, len(nfs), LOTE_IMPORTACAO):
+            lote = nfs[i:i + LOTE_IMPORTACAO]
+            cadastrados = servidores_cadastrados(lote)
+            gravar(Servidor, [servidores[nf] for nf in lote if nf not in cadastrados])
+
+        lote = []
+        for valores in iterar_registros_planilha(planilha, por_nome, erros):
+            lote.append(valores)
+            if len(lote) >= LOTE_IMPORTACAO:
+                gravar_registros(lote)
+                lote = []
+        if lote:
+            gravar_registros(lote)
+    finally:
+        planilha.close()
+
+    return {
+        'servidores': sum(l['registros'] for l in lotes if l['tabela'] == 'servidores'),
+        'diasTrabalhados': sum(l['registros'] for l in lotes if l['tabela'] == 'dias_trabalhados'),
+        'ignorados': ignorados,
+        'erros': [{'linha': linha, 'motivo': motivo} for linha, motivo in erros],
+        'lotes': lotes,
+        'tempo_ms': round((time.perf_counter() - inicio) * 1000, 1)
+    }
+
+
+@app.route('/api/importar/xlsx', methods=['POST'])
+def importar_xlsx():
+    """Importar a planilha de controle (.xlsx) enviada no campo 'arquivo'
+
+    O upload fica no arquivo temporário do Werkzeug e é lido linha a linha,
+    então planilhas grandes não são carregadas inteiras na memória.
+    """
+    arquivo = request.files.get('arquivo')
+    if not arquivo or not arquivo.filename:
+        return jsonify({'error': 'Envie a planilha no campo "arquivo"'}), 400
+    if not arquivo.filename.lower().endswith('.xlsx'):
+        return jsonify({'error': 'Formato inválido: envie um arquivo .xlsx'}), 400
+
+    try:
+        resumo = importar_planilha_xlsx(arquivo.stream)
     except Exception as e:
         db.session.rollback()
         return jsonify({'error': str(e)}), 400
 
+    if resumo['lotes']:
+        threading.Thread(target=criar_backup, daemon=True).start()
+
+    return jsonify({'message': 'Planilha importada com sucesso', **resumo}), 200
+
+
+@app.cli.command('importar-xlsx')
+@click.argument('caminho', type=click.Path(exists=True, dir_okay=False), default='Controle do Banco de Horas 2025-2026.xlsx')
+def importar_xlsx_comando(caminho):
+    """Importa a planilha de controle (.xlsx) direto para o banco"""
+    resumo = importar_planilha_xlsx(caminho)
+    print(f"Servidores inseridos: {resumo['servidores']} | Registros inseridos: {resumo['diasTrabalhados']} "
+          f"| Já cadastrados: {resumo['ignorados']} | {resumo['tempo_ms']} ms")
+    for erro in resumo['erros']:
+        print(f"  linha {erro['linha']}: {erro['motivo']}")
+
 
 # ==================== FUNÇÕES AUXILIARES ====================
 
@@ -987,6 +3411,85 @@ def calcular_horas_trabalhadas(entrada, saida):
         return None
 
 
+def iterar_json_stream(stream, tamanho_bloco=64 * 1024):
+    """Lê um objeto JSON de nível superior de um stream, sem carregá-lo inteiro.
+
+    Gera (chave, item) para cada elemento das listas de nível superior e
+    (chave, valor) para os demais valores. Só um elemento por vez fica em memória.
+    """
+    decoder = json.JSONDecoder()
+    utf8 = codecs.getincrementaldecoder('utf-8')()
+    buffer = ''
+    pos = 0
+    fim = False
+
+    def ler():
+        nonlocal buffer, pos, fim
+        bloco = stream.read(tamanho_bloco)
+        if not bloco:
+            fim = True
+        buffer = buffer[pos:] + utf8.decode(bloco or b'', final=not bloco)
+        pos = 0
+
+    def proximo_caractere():
+        nonlocal pos
+        while True:
+            while pos < len(buffer) and buffer[pos] in ' \t\r\n':
+                pos += 1
+            if pos < len(buffer) or fim:
+                return buffer[pos] if pos < len(buffer) else ''
+            ler()
+
+    def consumir(esperado):
+        nonlocal pos
+        caractere = proximo_caractere()
+        if caractere != esperado:
+            raise ValueError(f"JSON inválido: esperado '{esperado}', encontrado '{caractere}'")
+        pos += 1
+
+    def decodificar():
+        nonlocal pos
+        proximo_caractere()
+        while True:
+            try:
+                valor, fim_valor = decoder.raw_decode(buffer, pos)
+                # Número no fim do buffer pode estar truncado: exigir um delimitador depois
+                if fim or (fim_valor < len(buffer) and buffer[fim_valor] in ' \t\r\n,:]}'):
+                    pos = fim_valor
+                    return valor
+            except json.JSONDecodeError:
+                if fim:
+                    raise
+            ler()
+
+    consumir('{')
+    if proximo_caractere() == '}':
+        return
+    while True:
+        chave = decodificar()
+        consumir(':')
+        if proximo_caractere() == '[':
+            pos += 1
+            if proximo_caractere() == ']':
+                pos += 1
+            else:
+                while True:
+                    yield chave, decodificar()
+                    if proximo_caractere() == ',':
+                        pos += 1
+                        continue
+                    consumir(']')
+                    break
+        else:
+            yield chave, decodificar()
+
+        if proximo_caractere() == ',':
+            pos += 1
+            continue
+        consumir('}')
+        return
+
+
 def time_to_minutes(time_str):
     """Converte string de tempo HH:MM para minutos"""
     if not time_str:
@@ -1000,6 +3503,23 @@ def time_to_minutes(time_str):
         return 0
 
 
+def hora_para_minutos(valor):
+    """Converte HH:MM (com sinal opcional) em minutos; None se vazio ou inválido"""
+    if valor is None:
+        return None
+    texto = str(valor).strip()
+    if not texto or texto == '-':
+        return None
+    sinal = -1 if texto.startswith('-') else 1
+    try:
+        partes = texto.lstrip('+-').split(':')
+        horas = int(partes[0])
+        minutos = int(partes[1]) if len(partes) > 1 else 0
+    except ValueError:
+        return None
+    return sinal * (horas * 60 + minutos)
+
+
 def minutes_to_time(minutes):
     """Converte minutos para string HH:MM"""
     hours = abs(minutes) // 60
@@ -1008,12 +3528,205 @@ def minutes_to_time(minutes):
     return f"{sign}{hours:02d}:{mins:02d}"
 
 
+# ==================== MIGRAÇÕES ====================
+
+class MigracaoEsquema(db.Model):
+    """Migrações já aplicadas; a maior versão é a versão do esquema do banco"""
+    __tablename__ = 'migracoes_esquema'
+
+    versao = db.Column(db.Integer, primary_key=True)
+    nome = db.Column(db.String(100), nullable=False)
+    aplicada_em = db.Column(db.DateTime, default=datetime.utcnow)
+    duracao_ms = db.Column(db.Float)
+
+
+@contextmanager
+def trava_migracoes():
+    """Lock de arquivo (bloqueante): só um processo migra por vez"""
+    arquivo = open(INSTANCE_DIR / 'migracoes.lock', 'a+')
+    try:
+        if os.name == 'nt':
+            import msvcrt
+            msvcrt.locking(arquivo.fileno(), msvcrt.LK_LOCK, 1)
+        else:
+            import fcntl
+            fcntl.flock(arquivo.fileno(), fcntl.LOCK_EX)
+        yield
+    finally:
+        arquivo.close()
+
+
+def versao_esquema():
+    """Versão atual do esquema (0 se nenhuma migração foi registrada)"""
+    return db.session.query(func.max(MigracaoEsquema.versao)).scalar() or 0
+
+
+def aplicar_migracoes():
+    """Cria tabelas novas e aplica, em ordem, as migrações ainda não registradas.
+
+    create_all só cria tabelas que não existem; mudanças em tabelas
+    existentes (colunas, índices, dados) precisam ser uma migração em
+    MIGRACOES. Cada migração deve poder rodar de novo sem efeito, já que
+    bancos antigos aplicavam esses passos sem registrar a versão.
+    """
+    with trava_migracoes():
+        db.create_all()
+        aplicadas = {versao for (versao,) in db.session.query(MigracaoEsquema.versao)}
+        for versao, nome, funcao in MIGRACOES:
+            if versao in aplicadas:
+                continue
+            inicio = time.perf_counter()
+            funcao()
+            duracao_ms = round((time.perf_counter() - inicio) * 1000, 1)
+            db.session.add(MigracaoEsquema(versao=versao, nome=nome, duracao_ms=duracao_ms))
+            db.session.commit()
+            print(f"Migração {versao:03d} aplicada: {nome} ({duracao_ms} ms)")
+        return versao_esquema()
+
+
+def migrar_colunas_minutos():
+    """Adiciona as colunas *_min em bancos existentes e faz o backfill"""
+    colunas = {c['name'] for c in db.inspect(db.engine).get_columns('dias_trabalhados')}
+    faltantes = [c for c in CAMPOS_MINUTOS_REGISTRO.values() if c not in colunas]
+    if not faltantes:
+        return 0
+
+    with db.engine.begin() as conn:
+        for coluna in faltantes:
+            conn.execute(db.text(f'ALTER TABLE dias_trabalhados ADD COLUMN {coluna} INTEGER'))
+
+    total = preencher_colunas_minutos()
+    print(f"Colunas em minutos criadas: {', '.join(faltantes)} ({total} registros preenchidos)")
+    return total
+
+
+def preencher_colunas_minutos(lote=1000):
+    """Recalcula as colunas *_min a partir dos campos HH:MM, em lotes por id"""
+    campos = list(CAMPOS_MINUTOS_REGISTRO)
+    sql_update = db.text(
+        'UPDATE dias_trabalhados SET '
+        + ', '.join(f'{c} = :{c}' for c in CAMPOS_MINUTOS_REGISTRO.values())
+        + ' WHERE id = :id'
+    )
+
+    ultimo_id = 0
+    total = 0
+    while True:
+        linhas = db.session.execute(
+            db.select(DiaTrabalhado.id, *[getattr(DiaTrabalhado, c) for c in campos])
+            .where(DiaTrabalhado.id > ultimo_id)
+            .order_by(DiaTrabalhado.id)
+            .limit(lote)
+        ).all()
+        if not linhas:
+            break
+
+        valores = []
+        for linha in linhas:
+            item = {'id': linha[0]}
+            for campo, valor in zip(campos, linha[1:]):
+                item[CAMPOS_MINUTOS_REGISTRO[campo]] = hora_para_minutos(valor)
+            valores.append(item)
+
+        # SQL direto para não disparar o onupdate de atualizado_em
+        db.session.execute(sql_update, valores)
+        db.session.commit()
+        ultimo_id = linhas[-1][0]
+        total += len(linhas)
+    return total
+
+
+def garantir_indices():
+    """Cria em bancos existentes os índices declarados nos modelos (create_all só cria em tabelas novas)"""
+    for tabela in (Servidor.__table__, DiaTrabalhado.__table__):
+        for indice in tabela.indexes:
+            indice.create(db.engine, checkfirst=True)
+
+
+def criar_indices_consultas():
+    """Índices para os filtros e ordenações usados pelas rotas.
+
+    - (nf, dia_trabalhado): listagem por servidor e filtro nf com ordenação por data
+    - (setor, dia_trabalhado): filtro por setor com a ordenação padrão
+    - (prazo_max, nome): varredura de alertas (prazo igual/intervalo, ordenada por nome)
+    - dia_trabalhado: listagem completa e paginação padrão (dia_trabalhado, id)
+    - nome / atualizado_em: ORDER BY nome e consultas por alteração recente
+    Os índices simples em nf e prazo_max viram redundantes (prefixos dos compostos).
+    """
+    comandos = [
+        'CREATE INDEX IF NOT EXISTS ix_dias_trabalhados_nf_dia ON dias_trabalhados (nf, dia_trabalhado)',
+        'CREATE INDEX IF NOT EXISTS ix_dias_trabalhados_setor_dia ON dias_trabalhados (setor, dia_trabalhado)',
+        'CREATE INDEX IF NOT EXISTS ix_dias_trabalhados_dia_trabalhado ON dias_trabalhados (dia_trabalhado)',
+        'CREATE INDEX IF NOT EXISTS ix_dias_trabalhados_prazo_nome ON dias_trabalhados (prazo_max, nome)',
+        'CREATE INDEX IF NOT EXISTS ix_dias_trabalhados_atualizado_em ON dias_trabalhados (atualizado_em)',
+        'CREATE INDEX IF NOT EXISTS ix_servidores_nome ON servidores (nome)',
+        'CREATE INDEX IF NOT EXISTS ix_servidores_atualizado_em ON servidores (atualizado_em)',
+        'DROP INDEX IF EXISTS ix_dias_trabalhados_nf',
+        'DROP INDEX IF EXISTS ix_dias_trabalhados_prazo_max',
+        # Estatísticas para o planejador escolher entre os índices
+        'ANALYZE',
+    ]
+    with db.engine.begin() as conn:
+        for comando in comandos:
+            conn.execute(db.text(comando))
+
+
+def migrar_email_resumo():
+    """Adiciona usuarios_sistema.email_resumo (preferência de resumo diário por destinatário)
+
+    Bancos que usavam a antiga chave global ALERTA_EMAIL_RESUMO=True começam
+    com o resumo ligado para todos, como antes.
+    """
+    colunas = {c['name'] for c in db.inspect(db.engine).get_columns('usuarios_sistema')}
+    if 'email_resumo' in colunas:
+        return 0
+    padrao = 1 if os.environ.get('ALERTA_EMAIL_RESUMO', 'False') == 'True' else 0
+    with db.engine.begin() as conn:
+        conn.execute(db.text(
+            f'ALTER TABLE usuarios_sistema ADD COLUMN email_resumo BOOLEAN NOT NULL DEFAULT {padrao}'))
+    return 1
+
+
+def migrar_saldos_servidores():
+    """Preenche saldos_servidores em bancos que ainda não tinham a tabela"""
+    if SaldoServidor.query.first() is not None or DiaTrabalhado.query.first() is None:
+        return 0
+    with db.engine.begin() as conn:
+        total = recalcular_saldos_servidores(conn)
+    print(f"Saldos por servidor calculados: {total}")
+    return total
+
+
+# Versão, nome e função; novas migrações entram sempre no fim da lista
+MIGRACOES = [
+    (1, 'colunas_minutos', migrar_colunas_minutos),
+    (2, 'indices_modelos', garantir_indices),
+    (3, 'saldos_servidores', migrar_saldos_servidores),
+    (4, 'indices_consultas', criar_indices_consultas),
+    (5, 'email_resumo', migrar_email_resumo),
+]
+
+
+@app.cli.command('migrar')
+def migrar_comando():
+    """Aplica as migrações pendentes e mostra a versão do esquema"""
+    print(f"Versão do esquema: {aplicar_migracoes()}")
+
+
+@app.cli.command('recalcular-saldos')
+def recalcular_saldos_comando():
+    """Reconstrói a tabela saldos_servidores (reparo)"""
+    with db.engine.begin() as conn:
+        total = recalcular_saldos_servidores(conn)
+    print(f"Saldos recalculados para {total} servidores")
+
+
 # ==================== INICIALIZAÇÃO ====================
 
 def inicializar_app():
     """Inicializa o banco de dados e cria tabelas"""
     with app.app_context():
-        db.create_all()
+        aplicar_migracoes()
         semear_usuarios_iniciais()
         print("Banco de dados inicializado!")
         
@@ -1025,23 +3738,20 @@ def inicializar_app():
 def bootstrap_sistema():
     """Bootstrap para ambientes WSGI (ex.: PythonAnywhere)"""
     with app.app_context():
-        db.create_all()
+        aplicar_migracoes()
         semear_usuarios_iniciais()
 
 
 # Executar bootstrap também quando módulo é importado
 bootstrap_sistema()
 
+# Agendador de tarefas (backup, alertas): um único líder entre processos/workers
+if app.config['AGENDADOR_ATIVO']:
+    iniciar_agendador()
+
 if __name__ == '__main__':
     # Inicializar banco de dados
     inicializar_app()
-    
-    # Iniciar thread de backup automático
-    backup_thread = threading.Thread(target=backup_automatico, daemon=True)
-    backup_thread.start()
-
-    alerta_thread = threading.Thread(target=alerta_email_automatico, daemon=True)
-    alerta_thread.start()
 
     print("Sistema de backup automático ativado!")
     
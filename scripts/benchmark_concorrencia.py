@@ -0,0 +1,178 @@
+"""Benchmark de concorrência do SQLite: leitores e escritores simultâneos.
+
+Compara o banco sem perfil (journal padrão, sem busy_timeout), com o perfil
+de concorrência (WAL, synchronous=NORMAL, busy_timeout, mmap, cache) e com o
+perfil mais a fila de escrita. Cada cenário usa uma cópia nova do banco e
+vários processos, cada um com threads leitoras e escritoras usando o
+test client do Flask.
+
+Uso (na raiz do projeto):
+    python scripts/benchmark_concorrencia.py --processos 4 --leitores 2 --escritores 2 --duracao 10
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from pathlib import Path
+
+RAIZ = Path(__file__).resolve().parent.parent
+DB_PATH = RAIZ / 'instance' / 'banco_horas.db'
+
+CENARIOS = {
+    'sem_perfil': {'SQLITE_PERFIL': 'False', 'FILA_ESCRITA_ATIVA': 'False'},
+    'perfil': {'SQLITE_PERFIL': 'True', 'FILA_ESCRITA_ATIVA': 'False'},
+    'perfil_fila': {'SQLITE_PERFIL': 'True', 'FILA_ESCRITA_ATIVA': 'True'},
+}
+
+
+def copiar_banco(origem, destino, cenario):
+    """Copia o banco pela API de backup do SQLite (inclui páginas ainda no -wal).
+
+    O modo WAL fica gravado no arquivo: no cenário sem perfil a cópia volta
+    ao journal padrão (DELETE), senão ele mediria WAL do mesmo jeito.
+    """
+    with sqlite3.connect(origem) as fonte, sqlite3.connect(destino) as copia:
+        fonte.backup(copia)
+        if CENARIOS[cenario]['SQLITE_PERFIL'] == 'False':
+            modo = copia.execute('PRAGMA journal_mode=DELETE').fetchone()[0]
+            if modo != 'delete':
+                raise SystemExit(f'Não foi possível desativar o WAL da cópia (journal_mode={modo})')
+    fonte.close()
+    copia.close()
+
+
+def ambiente(cenario, db_path, pasta):
+    env = dict(os.environ)
+    env.update(CENARIOS[cenario])
+    env.update({
+        'DATABASE_URL': f'sqlite:///{db_path}',
+        'BACKUP_FOLDER': str(pasta / 'backups'),
+        'AGENDADOR_ATIVO': 'False',
+    })
+    return env
+
+
+def percentil(valores, p):
+    if not valores:
+        return None
+    valores = sorted(valores)
+    return valores[min(len(valores) - 1, int(len(valores) * p))]
+
+
+def trabalhador(env, leitores, escritores, duracao, fila_resultados):
+    """Processo: sobe o app e roda threads leitoras/escritoras até o fim da duração"""
+    os.environ.update(env)
+    sys.path.insert(0, str(RAIZ))
+    import logging
+    logging.disable(logging.CRITICAL)
+    import app as modulo
+
+    modulo.app.logger.disabled = True
+    resultado = {'leituras': 0, 'escritas': 0, 'erros_leitura': 0, 'erros_escrita': 0, 'lat_escrita': []}
+    lock = threading.Lock()
+    fim = time.monotonic() + duracao
+
+    def ler():
+        cliente = modulo.app.test_client()
+        while time.monotonic() < fim:
+            ok = cliente.get('/api/dias-trabalhados?limite=50').status_code == 200
+            ok = ok and cliente.get('/api/estatisticas').status_code == 200
+            with lock:
+                resultado['leituras' if ok else 'erros_leitura'] += 1
+
+    def escrever():
+        cliente = modulo.app.test_client()
+        while time.monotonic() < fim:
+            inicio = time.perf_counter()
+            resp = cliente.post('/api/dias-trabalhados', json={
+                'nf': '999999', 'nome': 'BENCHMARK', 'setor': 'BENCH',
+                'dia_trabalhado': '2025-01-01', 'entrada': '08:00', 'saida': '12:00'
+            })
+            ok = resp.status_code == 201
+            if ok:
+                ok = cliente.delete(f"/api/dias-trabalhados/{resp.get_json()['id']}").status_code == 200
+            with lock:
+                resultado['escritas' if ok else 'erros_escrita'] += 1
+                if ok:
+                    resultado['lat_escrita'].append((time.perf_counter() - inicio) * 1000)
+
+    threads = [threading.Thread(target=ler) for _ in range(leitores)]
+    threads += [threading.Thread(target=escrever) for _ in range(escritores)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    fila_resultados.put(resultado)
+
+
+def executar_cenario(cenario, args):
+    with tempfile.TemporaryDirectory() as tmp:
+        pasta = Path(tmp)
+        db_path = pasta / 'banco_horas.db'
+        copiar_banco(args.banco, db_path, cenario)
+        env = ambiente(cenario, db_path, pasta)
+
+        # Bootstrap (migrações, usuários) uma vez, antes dos processos concorrentes
+        subprocess.run([sys.executable, '-c', 'import app'], cwd=RAIZ, env=env, check=True,
+                       stdout=subprocess.DEVNULL)
+
+        contexto = multiprocessing.get_context('spawn')
+        fila_resultados = contexto.Queue()
+        processos = [
+            contexto.Process(target=trabalhador, args=(env, args.leitores, args.escritores, args.duracao, fila_resultados))
+            for _ in range(args.processos)
+        ]
+        for p in processos:
+            p.start()
+        parciais = [fila_resultados.get() for _ in processos]
+        for p in processos:
+            p.join()
+
+    latencias = [v for r in parciais for v in r['lat_escrita']]
+    total = {chave: sum(r[chave] for r in parciais) for chave in ('leituras', 'escritas', 'erros_leitura', 'erros_escrita')}
+    return {
+        'cenario': cenario,
+        'leituras_por_s': round(total['leituras'] / args.duracao, 1),
+        'escritas_por_s': round(total['escritas'] / args.duracao, 1),
+        'erros_leitura': total['erros_leitura'],
+        'erros_escrita': total['erros_escrita'],
+        'escrita_p50_ms': round(percentil(latencias, 0.5), 1) if latencias else None,
+        'escrita_p95_ms': round(percentil(latencias, 0.95), 1) if latencias else None,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark de concorrência do SQLite')
+    parser.add_argument('--banco', default=str(DB_PATH), help='banco de origem (é copiado, nunca alterado)')
+    parser.add_argument('--processos', type=int, default=4)
+    parser.add_argument('--leitores', type=int, default=2, help='threads leitoras por processo')
+    parser.add_argument('--escritores', type=int, default=2, help='threads escritoras por processo')
+    parser.add_argument('--duracao', type=float, default=10, help='segundos por cenário')
+    parser.add_argument('--cenarios', nargs='+', choices=list(CENARIOS), default=list(CENARIOS))
+    parser.add_argument('--saida', help='grava os resultados em JSON')
+    args = parser.parse_args()
+
+    resultados = []
+    for cenario in args.cenarios:
+        print(f'Executando cenário {cenario}...')
+        resultados.append(executar_cenario(cenario, args))
+
+    colunas = ['cenario', 'leituras_por_s', 'escritas_por_s', 'erros_leitura', 'erros_escrita', 'escrita_p50_ms', 'escrita_p95_ms']
+    print()
+    print('  '.join(f'{c:>15}' for c in colunas))
+    for r in resultados:
+        print('  '.join(f'{str(r[c]):>15}' for c in colunas))
+
+    if args.saida:
+        Path(args.saida).write_text(json.dumps(resultados, indent=2, ensure_ascii=False), encoding='utf-8')
+        print(f'\nResultados gravados em {args.saida}')
+
+
+if __name__ == '__main__':
+    main()
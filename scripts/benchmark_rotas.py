@@ -0,0 +1,326 @@
+"""Benchmark das rotas da API com o test client do Flask.
+
+Roda cada rota de app.py contra uma cópia do banco (gerado por
+gerar_dados_sinteticos.py) e mede latência p50/p95, consultas SQL por
+requisição, tamanho da resposta e pico de memória (tracemalloc). O
+resultado é gravado em JSON para servir de baseline; com --comparar, as
+rotas são confrontadas com um baseline anterior e regressões são
+apontadas (código de saída 1).
+
+Uso (na raiz do projeto):
+    python scripts/gerar_dados_sinteticos.py --servidores 1000 --registros 1000000
+    python scripts/benchmark_rotas.py --banco instance/banco_sintetico.db --saida benchmarks/atual.json
+    python scripts/benchmark_rotas.py --banco instance/banco_sintetico.db --comparar benchmarks/atual.json
+"""
+import argparse
+import io
+import itertools
+import json
+import os
+import platform
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime
+from pathlib import Path
+
+try:
+    import resource
+except ImportError:  # Windows: sem getrusage, o pico de RSS fica como null
+    resource = None
+
+RAIZ = Path(__file__).resolve().parent.parent
+
+# Rotas pesadas (exportação, backup, importação) rodam menos vezes
+REPETICOES_REDUZIDAS = 3
+
+
+class Formulario(dict):
+    """Payload enviado como multipart/form-data (upload de arquivo) em vez de JSON"""
+
+
+def percentil(valores, p):
+    valores = sorted(valores)
+    return valores[min(len(valores) - 1, int(len(valores) * p))]
+
+
+class Contexto:
+    """Dados de apoio dos casos: NF com registros, ids existentes e token de admin"""
+
+    def __init__(self, modulo, cliente):
+        self.modulo = modulo
+        self.cliente = cliente
+        self.sequencia = itertools.count(1)
+        with modulo.app.app_context():
+            db = modulo.db
+            self.nf = db.session.query(modulo.SaldoServidor.nf).order_by(
+                modulo.SaldoServidor.total_registros.desc()).limit(1).scalar()
+            self.servidor_id = db.session.query(modulo.Servidor.id).filter_by(nf=self.nf).scalar()
+            self.registro_id = db.session.query(modulo.DiaTrabalhado.id).filter_by(nf=self.nf).limit(1).scalar()
+            self.cursor = db.session.query(modulo.func.max(modulo.Alteracao.id)).scalar() or 0
+        self.token = cliente.post('/api/auth/login', json={'username': 'admin', 'password': '260220'}).get_json()['token']
+
+    def novo_nf(self):
+        return f'B{next(self.sequencia):07d}'
+
+    def novo_registro(self):
+        resp = self.cliente.post('/api/dias-trabalhados', json=self.payload_registro())
+        return resp.get_json()['id']
+
+    def novo_servidor(self):
+        resp = self.cliente.post('/api/servidores', json={'nf': self.novo_nf(), 'nome': 'BENCHMARK', 'setor': 'BENCH'})
+        return resp.get_json()['id']
+
+    def payload_registro(self):
+        return {'nf': self.nf, 'nome': 'BENCHMARK', 'setor': 'BENCH', 'dia_trabalhado': '2025-03-01',
+                'entrada': '08:00', 'saida': '12:30'}
+
+    def payload_importacao(self):
+        nfs = [self.novo_nf() for _ in range(10)]
+        return {
+            'servidores': [{'nf': nf, 'nome': 'BENCHMARK', 'setor': 'BENCH'} for nf in nfs],
+            'diasTrabalhados': [
+                {'nf': nf, 'nome': 'BENCHMARK', 'setor': 'BENCH', 'diaTrabalho': '2025-03-01',
+                 'hTrab': '04:00', 'hDireito': '08:00'}
+                for nf in nfs for _ in range(10)
+            ],
+        }
+
+    def planilha_importacao(self):
+        """Planilha .xlsx com 10 servidores novos e 10 registros cada (montada em memória)"""
+        from openpyxl import Workbook
+
+        planilha = Workbook()
+        aba = planilha.active
+        aba.title = 'Registros'
+        aba.append(['NF', 'NOME', 'SETOR', 'DIA TRABALHADO', 'H. TRAB.', 'HORAS DE DIREITO'])
+        for nf in [self.novo_nf() for _ in range(10)]:
+            for dia in range(1, 11):
+                aba.append([nf, 'BENCHMARK', 'BENCH', datetime(2025, 3, dia), '04:00', '08:00'])
+        arquivo = io.BytesIO()
+        planilha.save(arquivo)
+        return Formulario(arquivo=(io.BytesIO(arquivo.getvalue()), 'benchmark.xlsx'))
+
+    def ultimo_backup(self):
+        backups = self.cliente.get('/api/backup/listar').get_json()
+        if not backups:
+            self.cliente.post('/api/backup/criar')
+            backups = self.cliente.get('/api/backup/listar').get_json()
+        return backups[0]['arquivo']
+
+
+def casos(ctx):
+    """Um caso por endpoint: (endpoint, método, função que devolve (url, json), repetições)"""
+    admin = {'admin_token': ctx.token}
+    return [
+        ('index', 'GET', lambda: ('/', None), None),
+        ('auth_login', 'POST', lambda: ('/api/auth/login', {'username': 'admin', 'password': '260220'}), None),
+        ('auth_reset_password', 'POST', lambda: ('/api/auth/reset-password',
+                                                 {'username': 'Maria', 'token': 'invalido', 'new_password': 'x'}), None),
+        ('admin_list_users', 'POST', lambda: ('/api/admin/users', admin), None),
+        ('admin_generate_token', 'POST', lambda: ('/api/admin/token', {**admin, 'username': 'Maria'}), None),
+        ('admin_email_resumo', 'POST', lambda: ('/api/admin/email-resumo', {**admin, 'username': 'Maria'}), None),
+        ('get_servidores', 'GET', lambda: ('/api/servidores', None), None),
+        ('get_servidor', 'GET', lambda: (f'/api/servidores/{ctx.nf}', None), None),
+        ('criar_servidor', 'POST', lambda: ('/api/servidores', {'nf': ctx.novo_nf(), 'nome': 'BENCHMARK', 'setor': 'BENCH'}), None),
+        ('atualizar_servidor', 'PUT', lambda: (f'/api/servidores/{ctx.servidor_id}', {'setor': 'BENCH'}), None),
+        ('deletar_servidor', 'DELETE', lambda: (f'/api/servidores/{ctx.novo_servidor()}', None), None),
+        ('get_dias_trabalhados', 'GET', lambda: ('/api/dias-trabalhados', None), None),
+        ('get_dias_trabalhados_pagina', 'GET', lambda: ('/api/dias-trabalhados?limite=100', None), None),
+        ('get_dia_trabalhado', 'GET', lambda: (f'/api/dias-trabalhados/{ctx.registro_id}', None), None),
+        ('get_dias_trabalhados_por_servidor', 'GET', lambda: (f'/api/dias-trabalhados/servidor/{ctx.nf}', None), None),
+        ('criar_dia_trabalhado', 'POST', lambda: ('/api/dias-trabalhados', ctx.payload_registro()), None),
+        ('atualizar_dia_trabalhado', 'PUT', lambda: (f'/api/dias-trabalhados/{ctx.registro_id}', {'observacao': 'bench'}), None),
+        ('deletar_dia_trabalhado', 'DELETE', lambda: (f'/api/dias-trabalhados/{ctx.novo_registro()}', None), None),
+        ('listar_alteracoes', 'GET', lambda: (f'/api/changes?since={ctx.cursor}', None), None),
+        ('get_estatisticas', 'GET', lambda: ('/api/estatisticas', None), None),
+        ('consultar_servidor', 'GET', lambda: (f'/api/consulta/{ctx.nf}', None), None),
+        ('listar_alertas', 'GET', lambda: ('/api/alertas', None), None),
+        ('calendario_prazos', 'GET', lambda: ('/api/calendario?mes=2025-03', None), None),
+        ('relatorio_por_setor', 'GET', lambda: ('/api/relatorios/setor', None), None),
+        ('relatorio_agregados', 'GET', lambda: ('/api/relatorios/agregados', None), None),
+        ('criar_backup_manual', 'POST', lambda: ('/api/backup/criar', None), REPETICOES_REDUZIDAS),
+        ('listar_backups', 'GET', lambda: ('/api/backup/listar', None), None),
+        ('download_backup', 'GET', lambda: (f'/api/backup/download/{ctx.ultimo_backup()}', None), REPETICOES_REDUZIDAS),
+        ('status_fila_emails', 'GET', lambda: ('/api/emails/fila', None), None),
+        ('exportar_metricas', 'GET', lambda: ('/api/metrics', None), None),
+        ('status_agendador', 'GET', lambda: ('/api/agendador/status', None), None),
+        ('exportar_json', 'GET', lambda: ('/api/exportar/json', None), REPETICOES_REDUZIDAS),
+        ('exportar_ndjson', 'GET', lambda: ('/api/exportar/ndjson', None), REPETICOES_REDUZIDAS),
+        ('exportar_xlsx', 'GET', lambda: ('/api/exportar/xlsx', None), REPETICOES_REDUZIDAS),
+        ('importar_json', 'POST', lambda: ('/api/importar/json', ctx.payload_importacao()), REPETICOES_REDUZIDAS),
+        ('importar_xlsx', 'POST', lambda: ('/api/importar/xlsx', ctx.planilha_importacao()), REPETICOES_REDUZIDAS),
+    ]
+
+
+def requisitar(cliente, metodo, url, payload):
+    if isinstance(payload, Formulario):
+        resp = cliente.open(url, method=metodo, data=payload, content_type='multipart/form-data')
+    else:
+        resp = cliente.open(url, method=metodo, json=payload)
+    corpo = resp.get_data()  # consome respostas em streaming
+    resp.close()
+    return resp.status_code, len(corpo)
+
+
+def medir(modulo, cliente, ctx, repeticoes):
+    from sqlalchemy import event
+
+    contador = {'consultas': 0}
+
+    def contar(*_):
+        contador['consultas'] += 1
+
+    with modulo.app.app_context():
+        motor = modulo.db.engine
+    event.listen(motor, 'before_cursor_execute', contar)
+
+    resultados = {}
+    for endpoint, metodo, montar, reps in casos(ctx):
+        reps = min(reps or repeticoes, repeticoes)
+        latencias, consultas = [], []
+        status = tamanho = None
+        for _ in range(reps):
+            url, payload = montar()  # preparação (fora da medição)
+            contador['consultas'] = 0
+            inicio = time.perf_counter()
+            status, tamanho = requisitar(cliente, metodo, url, payload)
+            latencias.append((time.perf_counter() - inicio) * 1000)
+            consultas.append(contador['consultas'])
+
+        # Execução extra só para o pico de memória (tracemalloc deixa tudo mais lento)
+        url, payload = montar()
+        tracemalloc.start()
+        requisitar(cliente, metodo, url, payload)
+        _, pico = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+
+        resultados[endpoint] = {
+            'metodo': metodo,
+            'url': url,
+            'status': status,
+            'repeticoes': reps,
+            'p50_ms': round(percentil(latencias, 0.5), 2),
+            'p95_ms': round(percentil(latencias, 0.95), 2),
+            'consultas': max(consultas),
+            'bytes_resposta': tamanho,
+            'pico_memoria_kb': round(pico / 1024, 1),
+        }
+        print(f"{endpoint:36} {status}  p50 {resultados[endpoint]['p50_ms']:9.2f} ms  "
+              f"p95 {resultados[endpoint]['p95_ms']:9.2f} ms  {max(consultas):4} consultas  "
+              f"{resultados[endpoint]['pico_memoria_kb']:10.1f} KB")
+
+    event.remove(motor, 'before_cursor_execute', contar)
+    return resultados
+
+
+def rotas_sem_caso(modulo, ctx):
+    """Endpoints do app.url_map que não têm caso em casos()"""
+    endpoints = {r.endpoint for r in modulo.app.url_map.iter_rules()} - {'static'}
+    return sorted(endpoints - {endpoint for endpoint, *_ in casos(ctx)})
+
+
+def copiar_banco(origem, destino):
+    """Copia o banco pela API de backup do SQLite (inclui páginas ainda no -wal)"""
+    with sqlite3.connect(origem) as fonte, sqlite3.connect(destino) as copia:
+        fonte.backup(copia)
+    fonte.close()
+    copia.close()
+
+
+def versao_codigo():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=RAIZ, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except Exception:
+        return None
+
+
+def comparar(atual, baseline, tolerancia, margem_ms):
+    """Lista as rotas com p95 ou número de consultas acima do baseline"""
+    regressoes = []
+    for endpoint, medida in atual['rotas'].items():
+        base = baseline['rotas'].get(endpoint)
+        if not base:
+            continue
+        limite = base['p95_ms'] * (1 + tolerancia)
+        if medida['p95_ms'] > limite and medida['p95_ms'] - base['p95_ms'] > margem_ms:
+            regressoes.append(f"{endpoint}: p95 {base['p95_ms']} -> {medida['p95_ms']} ms")
+        if medida['consultas'] > base['consultas']:
+            regressoes.append(f"{endpoint}: consultas {base['consultas']} -> {medida['consultas']}")
+    return regressoes
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark das rotas da API')
+    parser.add_argument('--banco', default=str(RAIZ / 'instance' / 'banco_sintetico.db'),
+                        help='banco de origem (é copiado, nunca alterado)')
+    parser.add_argument('--repeticoes', type=int, default=20)
+    parser.add_argument('--saida', help='grava o resultado (baseline) em JSON')
+    parser.add_argument('--comparar', help='baseline JSON para comparação')
+    parser.add_argument('--tolerancia', type=float, default=0.2, help='aumento de p95 aceito (0.2 = 20%%)')
+    parser.add_argument('--margem-ms', type=float, default=5, help='diferença mínima de p95 para contar como regressão')
+    args = parser.parse_args()
+
+    if not Path(args.banco).exists():
+        raise SystemExit(f'Banco não encontrado: {args.banco} (gere com scripts/gerar_dados_sinteticos.py)')
+
+    with tempfile.TemporaryDirectory() as tmp:
+        pasta = Path(tmp)
+        banco = pasta / 'banco.db'
+        copiar_banco(args.banco, banco)
+        os.environ.update({
+            'DATABASE_URL': f'sqlite:///{banco}',
+            'BACKUP_FOLDER': str(pasta / 'backups'),
+            'METRICAS_DIR': str(pasta / 'metricas'),
+            'AGENDADOR_ATIVO': 'False',
+        })
+        sys.path.insert(0, str(RAIZ))
+        import app as modulo
+
+        cliente = modulo.app.test_client()
+        ctx = Contexto(modulo, cliente)
+        faltando = rotas_sem_caso(modulo, ctx)
+        if faltando:
+            raise SystemExit(f"Rotas sem caso de benchmark (adicione em casos()): {', '.join(faltando)}")
+        with modulo.app.app_context():
+            servidores = modulo.Servidor.query.count()
+            registros = modulo.DiaTrabalhado.query.count()
+
+        resultados = medir(modulo, cliente, ctx, args.repeticoes)
+
+    atual = {
+        'meta': {
+            'data': datetime.now().isoformat(timespec='seconds'),
+            'commit': versao_codigo(),
+            'python': platform.python_version(),
+            'banco': str(Path(args.banco).resolve()),
+            'servidores': servidores,
+            'registros': registros,
+            'repeticoes': args.repeticoes,
+            'pico_rss_kb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss if resource else None,
+        },
+        'rotas': resultados,
+    }
+
+    if args.saida:
+        Path(args.saida).parent.mkdir(parents=True, exist_ok=True)
+        Path(args.saida).write_text(json.dumps(atual, indent=2, ensure_ascii=False), encoding='utf-8')
+        print(f'\nBaseline gravado em {args.saida}')
+
+    if args.comparar:
+        baseline = json.loads(Path(args.comparar).read_text(encoding='utf-8'))
+        regressoes = comparar(atual, baseline, args.tolerancia, args.margem_ms)
+        print(f"\nComparação com {args.comparar} (commit {baseline['meta'].get('commit')}):")
+        if regressoes:
+            for r in regressoes:
+                print(f'  REGRESSÃO {r}')
+            sys.exit(1)
+        print('  Nenhuma regressão.')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,220 @@
+"""Gera um banco sintético de servidores e dias trabalhados para benchmarks.
+
+O formato segue a planilha "Controle do Banco de Horas 2025-2026": setores,
+nomes, horários de entrada e duração dos turnos são sorteados a partir dos
+registros reais do TXT (quando o arquivo existe). Com a mesma semente o
+banco gerado é sempre o mesmo.
+
+Uso (na raiz do projeto):
+    python scripts/gerar_dados_sinteticos.py --servidores 1000 --registros 1000000 \
+        --banco instance/banco_sintetico.db
+"""
+import argparse
+import os
+import random
+import sqlite3
+import sys
+import time
+from datetime import date, datetime, timedelta
+from pathlib import Path
+
+from dateutil.relativedelta import relativedelta
+
+RAIZ = Path(__file__).resolve().parent.parent
+TXT_PATH = RAIZ / 'data' / 'Controle do Banco de Horas 2025-2026.txt'
+LOTE = 10000
+
+# Usados quando o TXT de referência não está disponível
+SETORES_PADRAO = ['GPMS', 'SCT', 'SFR', 'GFB', 'SAR', 'PROTOCOLO', 'SCO', 'SAG', 'GJP', 'GFI']
+NOMES_PADRAO = ['Ana', 'Bruno', 'Carla', 'Diego', 'Elisa', 'Fabio', 'Gabriela', 'Henrique', 'Isabel', 'Joao']
+SOBRENOMES_PADRAO = ['Silva', 'Souza', 'Oliveira', 'Santos', 'Pereira', 'Lima', 'Costa', 'Rodrigues', 'Almeida', 'Nunes']
+
+
+def minutos_para_hhmm(minutos):
+    sinal = '-' if minutos < 0 else ''
+    minutos = abs(minutos)
+    return f'{sinal}{minutos // 60:02d}:{minutos % 60:02d}'
+
+
+def hhmm_para_minutos(hhmm):
+    h, m = hhmm.split(':')
+    return int(h) * 60 + int(m)
+
+
+def carregar_modelo(txt_path):
+    """Extrai do TXT real as distribuições usadas no sorteio"""
+    if not txt_path.exists():
+        return {
+            'setores': SETORES_PADRAO,
+            'nomes': NOMES_PADRAO,
+            'sobrenomes': SOBRENOMES_PADRAO,
+            'turnos': [(8 * 60 + 30, 4 * 60)],
+            'dias_semana': [5, 6],
+        }
+
+    sys.path.insert(0, str(Path(__file__).resolve().parent))
+    from importar_txt_planilha import parse_rows
+
+    rows = parse_rows(txt_path.read_text(encoding='utf-8', errors='ignore'))
+    partes = [r['nome'].split() for r in rows if r['nome']]
+    turnos = [
+        (hhmm_para_minutos(r['entrada']), hhmm_para_minutos(r['saida']) - hhmm_para_minutos(r['entrada']))
+        for r in rows
+        if r['entrada'] != '00:00' and r['saida'] > r['entrada']
+    ]
+    return {
+        # Listas com repetição: o sorteio respeita a frequência de cada valor
+        'setores': [r['setor'] for r in rows] or SETORES_PADRAO,
+        'nomes': [p[0] for p in partes] or NOMES_PADRAO,
+        'sobrenomes': [s for p in partes for s in p[1:]] or SOBRENOMES_PADRAO,
+        'turnos': turnos or [(8 * 60 + 30, 4 * 60)],
+        'dias_semana': [date.fromisoformat(r['dia_trabalhado']).weekday() for r in rows] or [5, 6],
+    }
+
+
+def gerar_servidores(rng, modelo, quantidade):
+    nfs = rng.sample(range(1000000, 9999999), quantidade)
+    servidores = []
+    for nf in nfs:
+        nome = ' '.join([rng.choice(modelo['nomes'])] + rng.sample(modelo['sobrenomes'], 2))
+        servidores.append((str(nf), nome, rng.choice(modelo['setores'])))
+    return servidores
+
+
+def gerar_registros(rng, modelo, servidores, quantidade, inicio, dias):
+    """Gera tuplas prontas para o INSERT, já com as colunas em minutos"""
+    agora = datetime.utcnow().isoformat(sep=' ')
+    for _ in range(quantidade):
+        nf, nome, setor = rng.choice(servidores)
+
+        # Sorteia uma data e a aproxima do próximo dia da semana observado no modelo
+        dia = inicio + timedelta(days=rng.randrange(dias))
+        dia += timedelta(days=(rng.choice(modelo['dias_semana']) - dia.weekday()) % 7)
+
+        entrada, duracao = rng.choice(modelo['turnos'])
+        entrada = max(0, min(entrada + rng.randint(-20, 20), 20 * 60))
+        duracao = max(30, duracao + rng.randint(-30, 30))
+        saida = min(entrada + duracao, 23 * 60 + 59)
+        h_trab = saida - entrada
+        h_direito = h_trab * 2
+
+        # Parte dos registros já tem horas gozadas (descontadas)
+        h_descontadas = None
+        dias_gozados = None
+        if rng.random() < 0.35:
+            h_descontadas = rng.randint(0, h_direito) // 30 * 30
+            dias_gozados = f'{dia + timedelta(days=rng.randint(7, 150)):%d/%m/%Y}'
+        saldo = h_direito - (h_descontadas or 0)
+
+        yield (
+            nf, nome, setor, None, dia.isoformat(),
+            minutos_para_hhmm(entrada), minutos_para_hhmm(saida),
+            minutos_para_hhmm(h_trab), minutos_para_hhmm(h_direito),
+            (dia + relativedelta(months=6)).isoformat(), None, '08:00', None, dias_gozados,
+            minutos_para_hhmm(h_descontadas) if h_descontadas is not None else None,
+            minutos_para_hhmm(saldo), None, agora, agora,
+            h_trab, h_direito, h_descontadas, saldo,
+        )
+
+
+def criar_esquema(banco):
+    """Cria as tabelas pelo próprio app (mesmas migrações e índices da aplicação)"""
+    os.environ['DATABASE_URL'] = f'sqlite:///{banco}'
+    os.environ.setdefault('AGENDADOR_ATIVO', 'False')
+    sys.path.insert(0, str(RAIZ))
+    import app  # noqa: F401  (o bootstrap roda na importação)
+
+
+def gravar(banco, servidores, registros):
+    conn = sqlite3.connect(banco)
+    cur = conn.cursor()
+    agora = datetime.utcnow().isoformat(sep=' ')
+
+    cur.executemany(
+        'INSERT INTO servidores (nf, nome, setor, criado_em, atualizado_em) VALUES (?, ?, ?, ?, ?)',
+        [(nf, nome, setor, agora, agora) for nf, nome, setor in servidores],
+    )
+
+    total = 0
+    lote = []
+    for registro in registros:
+        lote.append(registro)
+        if len(lote) >= LOTE:
+            total += inserir_registros(cur, lote)
+            lote = []
+            print(f'\r{total} registros gravados', end='', flush=True)
+    total += inserir_registros(cur, lote)
+    print(f'\r{total} registros gravados')
+
+    cur.execute('DELETE FROM saldos_servidores')
+    cur.execute(
+        '''INSERT INTO saldos_servidores
+        (nf, h_trab_min, h_direito_min, h_descontadas_min, total_registros, atualizado_em)
+        SELECT nf, COALESCE(SUM(h_trab_min), 0), COALESCE(SUM(h_direito_min), 0),
+               COALESCE(SUM(h_descontadas_min), 0), COUNT(*), ?
+        FROM dias_trabalhados GROUP BY nf''',
+        (agora,),
+    )
+    cur.execute(
+        "INSERT INTO alteracoes (tabela, registro_id, operacao, criado_em) VALUES ('*', NULL, 'reset', ?)",
+        (agora,),
+    )
+    cur.executemany(
+        '''INSERT INTO versoes_tabelas (tabela, versao) VALUES (?, 1)
+        ON CONFLICT(tabela) DO UPDATE SET versao = versao + 1''',
+        [('servidores',), ('dias_trabalhados',)],
+    )
+    conn.commit()
+    cur.execute('ANALYZE')
+    conn.close()
+    return total
+
+
+def inserir_registros(cur, lote):
+    cur.executemany(
+        '''INSERT INTO dias_trabalhados
+        (nf, nome, setor, vinculo, dia_trabalhado, entrada, saida, h_trab, h_direito, prazo_max,
+         h_totais, hora_dia, dias_gozar, dias_gozados, h_descontadas, saldo, observacao, criado_em, atualizado_em,
+         h_trab_min, h_direito_min, h_descontadas_min, saldo_min)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)''',
+        lote,
+    )
+    return len(lote)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Gera banco sintético para benchmarks')
+    parser.add_argument('--servidores', type=int, default=1000)
+    parser.add_argument('--registros', type=int, default=100000)
+    parser.add_argument('--banco', default=str(RAIZ / 'instance' / 'banco_sintetico.db'))
+    parser.add_argument('--semente', type=int, default=42)
+    parser.add_argument('--inicio', default='2024-01-01', help='primeira data de dia trabalhado')
+    parser.add_argument('--dias', type=int, default=900, help='janela de datas a partir de --inicio')
+    parser.add_argument('--sobrescrever', action='store_true')
+    args = parser.parse_args()
+
+    banco = Path(args.banco).resolve()
+    if banco == (RAIZ / 'instance' / 'banco_horas.db').resolve():
+        raise SystemExit('Recusado: o banco de produção não pode ser usado como destino.')
+    if banco.exists():
+        if not args.sobrescrever:
+            raise SystemExit(f'{banco} já existe (use --sobrescrever).')
+        for caminho in (banco, Path(f'{banco}-wal'), Path(f'{banco}-shm')):
+            if caminho.exists():
+                caminho.unlink()
+    banco.parent.mkdir(parents=True, exist_ok=True)
+
+    inicio = time.perf_counter()
+    rng = random.Random(args.semente)
+    modelo = carregar_modelo(TXT_PATH)
+    criar_esquema(banco)
+
+    servidores = gerar_servidores(rng, modelo, args.servidores)
+    registros = gerar_registros(rng, modelo, servidores, args.registros, date.fromisoformat(args.inicio), args.dias)
+    total = gravar(banco, servidores, registros)
+    print(f'Banco sintético: {banco} | Servidores: {len(servidores)} | Registros: {total} '
+          f'| {time.perf_counter() - inicio:.1f}s')
+
+
+if __name__ == '__main__':
+    main()
@@ -1,3 +1,5 @@
+import argparse
+import hashlib
 import re
 import sqlite3
 from datetime import datetime
@@ -5,11 +7,25 @@ from pathlib import Path
 
 DB_PATH = Path('instance/banco_horas.db')
 TXT_PATH = Path('data/Controle do Banco de Horas 2025-2026.txt')
+BATCH_SIZE = 5000
+# Chaves por consulta ao buscar os registros existentes de um lote
+LOOKUP_SIZE = 500
+
+# Campos que vêm do TXT; os demais (dias_gozados, h_descontadas, observacao...) são editados na interface
+MERGE_FIELDS = ('nome', 'setor', 'prazo_max', 'entrada', 'saida', 'h_trab', 'h_direito')
 
 DATE_RE = re.compile(r'\b(\d{1,2}/\d{1,2}/\d{4})\b')
 TIME_RE = re.compile(r'\b(\d{1,2}:\d{2}):\d{2}\b')
+TIMES_RE = re.compile(r'\b\d{1,2}:\d{2}:\d{2}\b')
+TAG_RE = re.compile(r'<[^>]+>')
+SPACES_RE = re.compile(r'\s+')
+NF_RE = re.compile(r'\d{5,8}')
+NAME_RE = re.compile(r"[A-Za-zÀ-ÿ\s\-']+")
 NF_LINE_RE = re.compile(r'^\s*(\d{5,8})\s+([A-Za-zÀ-ÿ\'\-]+)\s+([A-Z]{2,5})\s+(\d{1,2}/\d{1,2}/\d{4}).*?(\d{1,2}/\d{1,2}/\d{4})\s*$')
 
+HEADER_WORDS = {'horas', 'dias'}
+NAME_STOPWORDS = {'horas', 'dias', 'dia', 'entrada', 'saída', 'trabalhado'}
+
 
 def to_iso_date(mmddyyyy: str):
     m, d, y = mmddyyyy.split('/')
@@ -21,23 +37,55 @@ def to_hhmm(hhmmss: str):
     return f"{int(h):02d}:{int(m):02d}"
 
 
-def parse_rows(text: str):
-    lines = [re.sub(r'<[^>]+>', '', ln).strip() for ln in text.splitlines()]
-    rows = []
+def hhmm_to_minutes(hhmm: str):
+    h, m = hhmm.split(':')
+    return int(h) * 60 + int(m)
+
+
+def minutes_to_hhmm(minutes: int):
+    sign = '-' if minutes < 0 else ''
+    return f"{sign}{abs(minutes) // 60:02d}:{abs(minutes) % 60:02d}"
+
+
+def iter_lines(path: Path):
+    """Lê o TXT sob demanda, gerando (número da linha, linha sem tags)"""
+    with open(path, encoding='utf-8', errors='ignore') as f:
+        for number, ln in enumerate(f, start=1):
+            if '<' in ln:
+                ln = TAG_RE.sub('', ln)
+            yield number, ln.strip()
+
+
+def iter_rows(lines, errors=None):
+    """Percorre as linhas uma única vez, gerando um dict por registro.
+
+    Linhas com cara de dado que não casam com nenhum padrão vão para `errors`
+    como (número da linha, linha, motivo).
+    """
     name_parts = []
     last_times = None
+    last_times_line = None
 
-    for ln in lines:
+    def report(number, ln, reason):
+        if errors is not None:
+            errors.append((number, ln, reason))
+
+    for number, ln in lines:
         if not ln:
             continue
-        if ('HORAS TRABALHADAS' in ln or 'HORAS GOZADAS' in ln or ln.startswith('NF') or ln.lower() in {'horas','dias'}):
+        if 'HORAS TRABALHADAS' in ln or 'HORAS GOZADAS' in ln or ln.startswith('NF') or ln.lower() in HEADER_WORDS:
             continue
 
         # linha com horários (entrada/saida/trab/direito)
-        times = re.findall(r'\b\d{1,2}:\d{2}:\d{2}\b', ln)
-        if len(times) >= 4:
-            last_times = times[:4]
-            continue
+        has_times = ':' in ln
+        if has_times:
+            times = TIMES_RE.findall(ln)
+            if len(times) >= 4:
+                if last_times is not None:
+                    report(last_times_line, ' '.join(last_times), 'horários sem linha de NF correspondente')
+                last_times = times[:4]
+                last_times_line = number
+                continue
 
         m = NF_LINE_RE.match(ln)
         if m:
@@ -47,81 +95,410 @@ def parse_rows(text: str):
             if last_times:
                 entrada, saida, h_trab, h_direito = last_times
 
-            rows.append(
-                {
-                    'nf': nf,
-                    'nome': re.sub(r'\s+', ' ', nome).strip(),
-                    'setor': setor,
-                    'dia_trabalhado': to_iso_date(dia),
-                    'prazo_max': to_iso_date(prazo),
-                    'entrada': to_hhmm(entrada),
-                    'saida': to_hhmm(saida),
-                    'h_trab': to_hhmm(h_trab),
-                    'h_direito': to_hhmm(h_direito),
-                }
-            )
+            yield {
+                'line': number,
+                'nf': nf,
+                'nome': SPACES_RE.sub(' ', nome).strip(),
+                'setor': setor,
+                'dia_trabalhado': to_iso_date(dia),
+                'prazo_max': to_iso_date(prazo),
+                'entrada': to_hhmm(entrada),
+                'saida': to_hhmm(saida),
+                'h_trab': to_hhmm(h_trab),
+                'h_direito': to_hhmm(h_direito),
+            }
             name_parts = []
             last_times = None
             continue
 
         # possível fragmento de nome
-        if not DATE_RE.search(ln) and not re.search(r'\d{5,8}', ln) and not TIME_RE.search(ln):
-            if re.fullmatch(r"[A-Za-zÀ-ÿ\s\-']+", ln):
-                if ln.lower().strip() not in {'horas','dias','dia','entrada','saída','trabalhado'}:
+        if not (has_times and TIME_RE.search(ln)) and not DATE_RE.search(ln) and not NF_RE.search(ln):
+            if NAME_RE.fullmatch(ln):
+                if ln.lower() not in NAME_STOPWORDS:
                     name_parts.append(ln)
                 if len(name_parts) > 6:
                     name_parts = name_parts[-6:]
+            else:
+                report(number, ln, 'linha não reconhecida')
+            continue
+
+        if NF_RE.match(ln):
+            report(number, ln, 'linha de NF fora do formato esperado')
+        elif has_times:
+            report(number, ln, 'linha de horários incompleta')
+        else:
+            report(number, ln, 'linha não reconhecida')
+
+    if last_times is not None:
+        report(last_times_line, ' '.join(last_times), 'horários sem linha de NF correspondente')
+
+
+def parse_rows(text: str, errors=None):
+    """Compatibilidade: parse de um texto já carregado, devolvendo a lista de registros"""
+    lines = ((number, TAG_RE.sub('', ln).strip()) for number, ln in enumerate(text.splitlines(), start=1))
+    return list(iter_rows(lines, errors))
+
+
+def insert_batch(cur, batch, servidores, now):
+    """Insere um lote de registros (e os servidores ainda não vistos) via executemany"""
+    novos = []
+    for r in batch:
+        if r['nf'] not in servidores:
+            servidores.add(r['nf'])
+            novos.append((r['nf'], r['nome'], r['setor'], now, now))
+    if novos:
+        cur.executemany(
+            'INSERT INTO servidores (nf, nome, setor, criado_em, atualizado_em) VALUES (?, ?, ?, ?, ?)',
+            novos,
+        )
+
+    cur.executemany(
+        '''INSERT INTO dias_trabalhados
+        (nf, nome, setor, vinculo, dia_trabalhado, entrada, saida, h_trab, h_direito, prazo_max,
+         h_totais, hora_dia, dias_gozar, dias_gozados, h_descontadas, saldo, observacao, criado_em, atualizado_em,
+         h_trab_min, h_direito_min, saldo_min)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)''',
+        [
+            (
+                r['nf'], r['nome'], r['setor'], None, r['dia_trabalhado'], r['entrada'], r['saida'],
+                r['h_trab'], r['h_direito'], r['prazo_max'], None, '08:00', None, None, None, r['h_direito'], None,
+                now, now, hhmm_to_minutes(r['h_trab']), hhmm_to_minutes(r['h_direito']), hhmm_to_minutes(r['h_direito'])
+            )
+            for r in batch
+        ],
+    )
+    return len(batch)
 
-    return rows
 
+def import_rows(rows, db_path=DB_PATH, batch_size=BATCH_SIZE):
+    """Substitui servidores/registros pelo conteúdo de `rows` (qualquer iterável).
 
-def import_rows(rows):
-    conn = sqlite3.connect(DB_PATH)
+    Tudo roda em uma transação; sem nenhum registro parseado nada é apagado.
+    """
+    conn = sqlite3.connect(db_path)
     cur = conn.cursor()
 
     cur.execute('DELETE FROM dias_trabalhados')
     cur.execute('DELETE FROM servidores')
 
-    servidores = {}
+    servidores = set()
     now = datetime.utcnow().isoformat(sep=' ')
+    total = 0
 
+    batch = []
     for r in rows:
-        if r['nf'] not in servidores:
-            servidores[r['nf']] = (r['nf'], r['nome'], r['setor'], now, now)
+        batch.append(r)
+        if len(batch) >= batch_size:
+            total += insert_batch(cur, batch, servidores, now)
+            batch = []
+    total += insert_batch(cur, batch, servidores, now)
+
+    if not total:
+        # TXT vazio ou ilegível: desfaz os DELETEs em vez de gravar um banco vazio
+        conn.rollback()
+        conn.close()
+        return 0, 0
 
+    # Reconstruir saldos por servidor na mesma transação
+    cur.execute('DELETE FROM saldos_servidores')
+    cur.execute(
+        '''INSERT INTO saldos_servidores
+        (nf, h_trab_min, h_direito_min, h_descontadas_min, total_registros, atualizado_em)
+        SELECT nf, COALESCE(SUM(h_trab_min), 0), COALESCE(SUM(h_direito_min), 0),
+               COALESCE(SUM(h_descontadas_min), 0), COUNT(*), ?
+        FROM dias_trabalhados GROUP BY nf''',
+        (now,),
+    )
+
+    # Clientes em delta-sync precisam recarregar tudo após a reimportação
+    cur.execute(
+        "INSERT INTO alteracoes (tabela, registro_id, operacao, criado_em) VALUES ('*', NULL, 'reset', ?)",
+        (now,),
+    )
+
+    # Invalidar caches e versões das tabelas reescritas
     cur.executemany(
-        'INSERT INTO servidores (nf, nome, setor, criado_em, atualizado_em) VALUES (?, ?, ?, ?, ?)',
-        list(servidores.values()),
+        '''INSERT INTO versoes_tabelas (tabela, versao) VALUES (?, 1)
+        ON CONFLICT(tabela) DO UPDATE SET versao = versao + 1''',
+        [('servidores',), ('dias_trabalhados',)],
     )
 
-    reg_values = [
-        (
-            r['nf'], r['nome'], r['setor'], None, r['dia_trabalhado'], r['entrada'], r['saida'],
-            r['h_trab'], r['h_direito'], r['prazo_max'], None, '08:00', None, None, None, None, None, now, now
+    conn.commit()
+    conn.close()
+    return total, len(servidores)
+
+
+def row_hash(values):
+    return hashlib.sha1('\x1f'.join('' if v is None else str(v) for v in values).encode('utf-8')).hexdigest()
+
+
+def load_existing(cur, batch, max_id):
+    """Índice (nf, dia_trabalhado) -> [[id, nf, hash, casado, h_descontadas_min]] dos registros do lote.
+
+    Só as chaves de `batch` são consultadas; registros já casados em lotes
+    anteriores (tabela temporária casados) e os inseridos nesta importação
+    (id > max_id) ficam de fora. O hash cobre os campos do TXT e o saldo_min
+    gravado, para que um saldo desatualizado também conte como alteração.
+    """
+    keys = sorted({(r['nf'], r['dia_trabalhado']) for r in batch})
+    existing = {}
+    for start in range(0, len(keys), LOOKUP_SIZE):
+        chunk = keys[start:start + LOOKUP_SIZE]
+        nfs = sorted({nf for nf, _ in chunk})
+        dias = sorted({dia for _, dia in chunk})
+        # nf IN (...) AND dia IN (...) usa ix_dias_trabalhados_nf_dia (o row value
+        # (nf, dia) IN (VALUES ...) faria varredura); o excesso é descartado pela chave exata
+        cur.execute(
+            f"SELECT id, nf, dia_trabalhado, h_descontadas_min, saldo_min, {', '.join(MERGE_FIELDS)} "
+            f"FROM dias_trabalhados WHERE nf IN ({', '.join('?' * len(nfs))}) "
+            f"AND dia_trabalhado IN ({', '.join('?' * len(dias))}) "
+            # "+id" impede o planejador de trocar o índice por uma varredura do rowid
+            "AND +id <= ? AND id NOT IN (SELECT id FROM casados)",
+            (*nfs, *dias, max_id),
         )
-        for r in rows
-    ]
+        for reg_id, nf, dia, descontadas, saldo, *values in cur.fetchall():
+            existing.setdefault((nf, dia), []).append([reg_id, nf, row_hash(values + [saldo]), False, descontadas])
+    for candidates in existing.values():
+        candidates.sort()
+    wanted = set(keys)
+    return {key: candidates for key, candidates in existing.items() if key in wanted}
+
 
+def expected_hash(values, h_direito_min, candidate):
+    """Hash que o registro existente teria com os campos do TXT e o saldo recalculado"""
+    return row_hash(values + [h_direito_min - (candidate[4] or 0)])
+
+
+def journal(cur, tabela, ids, operacao, now):
     cur.executemany(
-        '''INSERT INTO dias_trabalhados
-        (nf, nome, setor, vinculo, dia_trabalhado, entrada, saida, h_trab, h_direito, prazo_max,
-         h_totais, hora_dia, dias_gozar, dias_gozados, h_descontadas, saldo, observacao, criado_em, atualizado_em)
-        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)''',
-        reg_values,
+        'INSERT INTO alteracoes (tabela, registro_id, operacao, criado_em) VALUES (?, ?, ?, ?)',
+        [(tabela, reg_id, operacao, now) for reg_id in ids],
     )
 
-    conn.commit()
+
+def flush_updates(cur, updates, now):
+    cur.executemany(
+        '''UPDATE dias_trabalhados
+        SET nome = ?, setor = ?, prazo_max = ?, entrada = ?, saida = ?, h_trab = ?, h_direito = ?,
+            h_trab_min = ?, h_direito_min = ?, saldo = ?, saldo_min = ?, atualizado_em = ?
+        WHERE id = ?''',
+        updates,
+    )
+    journal(cur, 'dias_trabalhados', [u[-1] for u in updates], 'upsert', now)
+    return len(updates)
+
+
+def merge_rows(rows, db_path=DB_PATH, batch_size=BATCH_SIZE, delete_missing=False, dry_run=False):
+    """Mescla `rows` no banco usando (nf, dia_trabalhado) como chave.
+
+    Registros com o mesmo hash dos campos do TXT não são tocados; os alterados
+    só têm esses campos reescritos, preservando o que foi editado na interface.
+    Os existentes são buscados por lote de `batch_size` linhas, só pelas chaves
+    do lote. Com `delete_missing`, registros ausentes do TXT são removidos. Tudo
+    roda em uma única transação (desfeita no final quando `dry_run`).
+    """
+    conn = sqlite3.connect(db_path)
+    cur = conn.cursor()
+    now = datetime.utcnow().isoformat(sep=' ')
+    summary = {
+        'inseridos': 0, 'alterados': 0, 'inalterados': 0, 'removidos': 0,
+        'servidores_inseridos': 0, 'servidores_alterados': 0, 'servidores_removidos': 0,
+        'exemplos': [],
+    }
+
+    def example(operacao, nf, dia):
+        if len(summary['exemplos']) < 20:
+            summary['exemplos'].append((operacao, nf, dia))
+
+    # Trava de escrita desde o início: os ids novos ficam acima de max_id
+    cur.execute('BEGIN IMMEDIATE')
+    max_id = cur.execute('SELECT COALESCE(MAX(id), 0) FROM dias_trabalhados').fetchone()[0]
+    # Ids existentes já casados com uma linha do TXT (não reaproveitados; o resto é "ausente")
+    cur.execute('CREATE TEMP TABLE casados (id INTEGER PRIMARY KEY)')
+    servidores = {nf: (sid, nome, setor) for sid, nf, nome, setor in cur.execute('SELECT id, nf, nome, setor FROM servidores')}
+    seen_nfs = set()
+    affected_nfs = set()
+
+    def merge_batch(batch):
+        existing = load_existing(cur, batch, max_id)
+        inserts, updates = [], []
+        for r in batch:
+            nf = r['nf']
+            if nf not in seen_nfs:
+                seen_nfs.add(nf)
+                atual = servidores.get(nf)
+                if atual is None:
+                    cur.execute(
+                        'INSERT INTO servidores (nf, nome, setor, criado_em, atualizado_em) VALUES (?, ?, ?, ?, ?)',
+                        (nf, r['nome'], r['setor'], now, now),
+                    )
+                    journal(cur, 'servidores', [cur.lastrowid], 'upsert', now)
+                    summary['servidores_inseridos'] += 1
+                elif atual[1:] != (r['nome'], r['setor']):
+                    cur.execute(
+                        'UPDATE servidores SET nome = ?, setor = ?, atualizado_em = ? WHERE id = ?',
+                        (r['nome'], r['setor'], now, atual[0]),
+                    )
+                    journal(cur, 'servidores', [atual[0]], 'upsert', now)
+                    summary['servidores_alterados'] += 1
+
+            values = [r[f] for f in MERGE_FIELDS]
+            h_direito_min = hhmm_to_minutes(r['h_direito'])
+            candidates = existing.get((nf, r['dia_trabalhado']), ())
+            # Primeiro um registro idêntico; senão o primeiro ainda não casado com a mesma chave
+            match = next((c for c in candidates if not c[3] and c[2] == expected_hash(values, h_direito_min, c)), None)
+            if match:
+                match[3] = True
+                summary['inalterados'] += 1
+                continue
+            match = next((c for c in candidates if not c[3]), None)
+            affected_nfs.add(nf)
+            if match:
+                match[3] = True
+                # Saldo = H. DIREITO - H. DESCONTADAS, como em atualizar_dia_trabalhado
+                saldo_min = h_direito_min - (match[4] or 0)
+                updates.append((
+                    *values, hhmm_to_minutes(r['h_trab']), h_direito_min, minutes_to_hhmm(saldo_min), saldo_min, now, match[0]
+                ))
+                example('alterado', nf, r['dia_trabalhado'])
+            else:
+                inserts.append(r)
+                example('inserido', nf, r['dia_trabalhado'])
+
+        cur.executemany(
+            'INSERT INTO casados (id) VALUES (?)',
+            [(c[0],) for candidates in existing.values() for c in candidates if c[3]],
+        )
+        summary['alterados'] += flush_updates(cur, updates, now)
+        summary['inseridos'] += insert_batch(cur, inserts, seen_nfs, now)
+
+    batch = []
+    for r in rows:
+        batch.append(r)
+        if len(batch) >= batch_size:
+            merge_batch(batch)
+            batch = []
+    merge_batch(batch)
+
+    if not seen_nfs:
+        # TXT vazio ou ilegível: nunca tratar como "tudo ausente"
+        conn.rollback()
+        conn.close()
+        return summary
+
+    cur.execute(
+        "INSERT INTO alteracoes (tabela, registro_id, operacao, criado_em) "
+        "SELECT 'dias_trabalhados', id, 'upsert', ? FROM dias_trabalhados WHERE id > ?",
+        (now, max_id),
+    )
+
+    if delete_missing:
+        missing = cur.execute(
+            'SELECT id, nf FROM dias_trabalhados WHERE id <= ? AND id NOT IN (SELECT id FROM casados) ORDER BY id',
+            (max_id,),
+        ).fetchall()
+        for start in range(0, len(missing), batch_size):
+            chunk = [(c[0],) for c in missing[start:start + batch_size]]
+            cur.executemany('DELETE FROM log_email_alerta WHERE registro_id = ?', chunk)
+            cur.executemany('DELETE FROM dias_trabalhados WHERE id = ?', chunk)
+            journal(cur, 'dias_trabalhados', [c[0] for c in chunk], 'delete', now)
+        for c in missing[:20 - len(summary['exemplos'])]:
+            example('removido', c[1], None)
+        summary['removidos'] = len(missing)
+        affected_nfs.update(c[1] for c in missing)
+
+        # Servidores fora do TXT que ficaram sem nenhum registro
+        orphans = [
+            (servidores[nf][0], nf) for nf in affected_nfs - seen_nfs
+            if nf in servidores and not cur.execute('SELECT 1 FROM dias_trabalhados WHERE nf = ? LIMIT 1', (nf,)).fetchone()
+        ]
+        cur.executemany('DELETE FROM servidores WHERE id = ?', [(sid,) for sid, _ in orphans])
+        journal(cur, 'servidores', [sid for sid, _ in orphans], 'delete', now)
+        summary['servidores_removidos'] = len(orphans)
+
+    # Saldos só dos servidores afetados
+    cur.executemany('DELETE FROM saldos_servidores WHERE nf = ?', [(nf,) for nf in affected_nfs])
+    cur.executemany(
+        '''INSERT INTO saldos_servidores
+        (nf, h_trab_min, h_direito_min, h_descontadas_min, total_registros, atualizado_em)
+        SELECT nf, COALESCE(SUM(h_trab_min), 0), COALESCE(SUM(h_direito_min), 0),
+               COALESCE(SUM(h_descontadas_min), 0), COUNT(*), ?
+        FROM dias_trabalhados WHERE nf = ? GROUP BY nf''',
+        [(now, nf) for nf in affected_nfs],
+    )
+
+    changed = [
+        tabela for tabela, keys in (
+            ('servidores', ('servidores_inseridos', 'servidores_alterados', 'servidores_removidos')),
+            ('dias_trabalhados', ('inseridos', 'alterados', 'removidos')),
+        )
+        if any(summary[k] for k in keys)
+    ]
+    cur.executemany(
+        '''INSERT INTO versoes_tabelas (tabela, versao) VALUES (?, 1)
+        ON CONFLICT(tabela) DO UPDATE SET versao = versao + 1''',
+        [(tabela,) for tabela in changed],
+    )
+
+    if dry_run:
+        conn.rollback()
+    else:
+        conn.commit()
     conn.close()
+    return summary
+
+
+def write_report(errors, path):
+    with open(path, 'w', encoding='utf-8') as f:
+        for number, ln, reason in errors:
+            f.write(f'{number}\t{reason}\t{ln}\n')
+
+
+def print_summary(summary):
+    print(
+        f"Registros: {summary['inseridos']} inseridos, {summary['alterados']} alterados, "
+        f"{summary['inalterados']} inalterados, {summary['removidos']} removidos"
+    )
+    print(
+        f"Servidores: {summary['servidores_inseridos']} inseridos, {summary['servidores_alterados']} alterados, "
+        f"{summary['servidores_removidos']} removidos"
+    )
+    for operacao, nf, dia in summary['exemplos']:
+        print(f'  {operacao}: NF {nf}' + (f' em {dia}' if dia else ''))
 
 
 if __name__ == '__main__':
-    if not TXT_PATH.exists():
-        raise SystemExit(f'Arquivo não encontrado: {TXT_PATH}')
+    parser = argparse.ArgumentParser(description='Importa o TXT da planilha de banco de horas')
+    parser.add_argument('--txt', type=Path, default=TXT_PATH)
+    parser.add_argument('--db', type=Path, default=DB_PATH)
+    parser.add_argument('--relatorio', type=Path, help='grava as linhas não reconhecidas (linha, motivo, conteúdo)')
+    parser.add_argument('--remover-ausentes', action='store_true', help='remove registros que não estão mais no TXT')
+    parser.add_argument('--simular', action='store_true', help='mostra o resumo sem gravar nada')
+    parser.add_argument('--substituir', action='store_true', help='apaga tudo e reimporta (modo antigo)')
+    args = parser.parse_args()
+
+    if not args.txt.exists():
+        raise SystemExit(f'Arquivo não encontrado: {args.txt}')
 
-    raw = TXT_PATH.read_text(encoding='utf-8', errors='ignore')
-    rows = parse_rows(raw)
-    if not rows:
-        raise SystemExit('Nenhum registro parseado do TXT.')
+    errors = []
+    rows = iter_rows(iter_lines(args.txt), errors)
+    if args.substituir:
+        total, servidores = import_rows(rows, args.db)
+        if not total:
+            raise SystemExit('Nenhum registro parseado do TXT.')
+        print(f'Registros importados: {total} | Servidores: {servidores}')
+    else:
+        summary = merge_rows(rows, args.db, delete_missing=args.remover_ausentes, dry_run=args.simular)
+        if not (summary['inseridos'] + summary['alterados'] + summary['inalterados']):
+            raise SystemExit('Nenhum registro parseado do TXT.')
+        print_summary(summary)
+        if args.simular:
+            print('Simulação: nenhuma alteração gravada.')
 
-    import_rows(rows)
-    print(f'Registros importados: {len(rows)} | Servidores: {len(set(r["nf"] for r in rows))}')
+    if errors:
+        print(f'Linhas não reconhecidas: {len(errors)}')
+        for number, ln, reason in errors[:20]:
+            print(f'  linha {number}: {reason}: {ln[:80]}')
+        if args.relatorio:
+            write_report(errors, args.relatorio)
+            print(f'Relatório gravado em {args.relatorio}')
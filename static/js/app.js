@@ -58,7 +58,7 @@ function initLogin() {
             sessionStorage.setItem('isLoggedIn', 'true');
             sessionStorage.setItem('userName', auth.username);
             sessionStorage.setItem('userRole', auth.role || 'user');
-            if ((auth.role || 'user') === 'admin') { sessionStorage.setItem('adminPassword', password); }
+            sessionStorage.setItem('authToken', auth.token);
 
             loginContainer.style.opacity = '0';
             loginContainer.style.transition = 'opacity 0.3s ease';
@@ -233,6 +233,11 @@ function timeToMinutes(timeStr) {
     return h * 60 + m;
 }
 
+function minutesToTime(minutes = 0) {
+    const abs = Math.abs(minutes);
+    return `${minutes < 0 ? '-' : ''}${String(Math.floor(abs / 60)).padStart(2, '0')}:${String(abs % 60).padStart(2, '0')}`;
+}
+
 function formatHoursWithH(timeStr) {
     if (!timeStr || timeStr === '-') return '-';
     return `${timeStr}H`;
@@ -319,33 +324,68 @@ function truncateText(text, maxLength) {
 // ===================================
 
 let servidores = [];
-let registros = [];
+let registrosPorId = new Map();  // registros já exibidos (página e consulta), para os modais
+let registrosCursores = [null];  // cursor keyset de cada página visitada da tabela de registros
+let agregadoGeral = null;        // /api/relatorios/agregados sem filtros (cards e servidores)
+let renderRegistrosSeq = 0;
+let dashboardSeq = 0;
 let setores = new Set();
 let currentPage = 1;
 const perPage = 20;
 let dashboardCharts = { horasMes: null, saldoSetor: null, topServidores: null };
 let dashboardLastData = null;
+let syncCursor = null;
 
 // ===================================
 // Data Loading
 // ===================================
 
+async function loadAllData() {
+    // Cursor obtido antes da carga completa: alterações concorrentes chegam no próximo delta.
+    // Registros não ficam no navegador: as telas buscam página e totais no servidor.
+    const sync = await API.get('/api/changes');
+    servidores = await API.get('/api/servidores');
+    syncCursor = sync.cursor;
+}
+
+function applyChanges(lista, delta) {
+    const removidos = new Set(delta.removidos);
+    const porId = new Map(lista.filter(item => !removidos.has(item.id)).map(item => [item.id, item]));
+    delta.alterados.forEach(item => porId.set(item.id, item));
+    return Array.from(porId.values());
+}
+
+async function syncData() {
+    if (syncCursor === null) {
+        await loadAllData();
+        return;
+    }
+
+    let temMais = true;
+    while (temMais) {
+        const delta = await API.get(`/api/changes?since=${syncCursor}`);
+        if (delta.reset) {
+            await loadAllData();
+            return;
+        }
+        servidores = applyChanges(servidores, delta.servidores);
+        syncCursor = delta.cursor;
+        temMais = delta.temMais;
+    }
+}
+
 async function loadData() {
     try {
-        // Carregar servidores
-        const srvData = await API.get('/api/servidores');
-        servidores = srvData;
-        
-        // Carregar registros
-        const regData = await API.get('/api/dias-trabalhados');
-        registros = regData;
+        // Servidores completos na primeira vez, depois só as alterações; registros só agregados
+        await syncData();
+        agregadoGeral = await API.get('/api/relatorios/agregados');
         
         // Extrair setores únicos
         setores = new Set(servidores.map(s => s.setor).filter(Boolean));
         
         // Atualizar badges
         document.getElementById('badge-servidores')?.replaceChildren(document.createTextNode(String(servidores.length)));
-        document.getElementById('badge-registros')?.replaceChildren(document.createTextNode(String(registros.length)));
+        document.getElementById('badge-registros')?.replaceChildren(document.createTextNode(String(agregadoGeral.total.registros)));
         
         // Preencher selects de setores
         populateSetorFilters();
@@ -358,7 +398,7 @@ async function loadData() {
         
         // Atualizar telas
         renderServidores();
-        renderRegistros();
+        renderRegistros(currentPage);
         loadDashboardCharts();
         
         // Calcular alertas de prazo
@@ -401,25 +441,14 @@ function populateServidorSelects() {
 
 function updateStats() {
     document.getElementById('stat-servidores').textContent = servidores.length;
-    document.getElementById('stat-registros').textContent = registros.length;
-    
-    // Calcular totais
-    const horasTrab = somarHoras(registros.map(r => r.h_trabalhada));
-    const horasDireito = somarHoras(registros.map(r => r.h_direito));
-    const horasGozadas = somarHoras(registros.map(r => r.horas_descontadas).filter(Boolean));
-    
-    // Calcular saldo
-    const [ht, mt] = horasDireito.split(':').map(Number);
-    const [hg, mg] = horasGozadas.split(':').map(Number);
-    const saldoMin = (ht * 60 + mt) - (hg * 60 + mg);
-    const saldoH = Math.floor(Math.abs(saldoMin) / 60);
-    const saldoM = Math.abs(saldoMin) % 60;
-    const saldo = `${saldoMin < 0 ? '-' : ''}${String(saldoH).padStart(2, '0')}:${String(saldoM).padStart(2, '0')}`;
     
-    document.getElementById('stat-horas-trabalhadas').textContent = formatHoursWithH(horasTrab);
-    document.getElementById('stat-horas-direito').textContent = formatHoursWithH(horasDireito);
-    document.getElementById('stat-horas-gozadas').textContent = formatHoursWithH(horasGozadas || '00:00');
-    document.getElementById('stat-saldo').textContent = formatHoursWithH(saldo);
+    // Totais calculados no servidor (/api/relatorios/agregados)
+    const total = agregadoGeral.total;
+    document.getElementById('stat-registros').textContent = total.registros;
+    document.getElementById('stat-horas-trabalhadas').textContent = formatHoursWithH(minutesToTime(total.trabalhadasMin));
+    document.getElementById('stat-horas-direito').textContent = formatHoursWithH(minutesToTime(total.direitoMin));
+    document.getElementById('stat-horas-gozadas').textContent = formatHoursWithH(minutesToTime(total.descontadasMin));
+    document.getElementById('stat-saldo').textContent = formatHoursWithH(minutesToTime(total.direitoMin - total.descontadasMin));
 }
 
 // ===================================
@@ -431,47 +460,47 @@ function renderRecentRecords() {
     loadDashboardCharts();
 }
 
-function getFilteredRegistros() {
-    let filtered = [...registros];
+function filtrosRegistros() {
+    // Mesmos nomes de parâmetro de /api/dias-trabalhados e /api/relatorios/agregados
+    const params = new URLSearchParams();
+    const campos = { setor: 'filter-setor', data_inicio: 'filter-data-inicio', data_fim: 'filter-data-fim', busca: 'filter-servidor' };
+    Object.entries(campos).forEach(([param, id]) => {
+        const valor = document.getElementById(id).value.trim();
+        if (valor) params.set(param, valor);
+    });
+    return params;
+}
 
-    const setorFilter = document.getElementById('filter-setor').value;
-    const dataInicio = document.getElementById('filter-data-inicio').value;
-    const dataFim = document.getElementById('filter-data-fim').value;
-    const servidorFilter = document.getElementById('filter-servidor').value.toLowerCase();
+async function renderRegistros(page = 1) {
+    const tbody = document.getElementById('tbody-registros');
+    if (page > 1 && !registrosCursores[page - 1]) page = 1;  // página ainda não alcançada
+    if (page === 1) registrosCursores = [null];
 
-    if (setorFilter) {
-        filtered = filtered.filter(r => r.setor === setorFilter);
-    }
-    if (dataInicio) {
-        filtered = filtered.filter(r => r.dia_trabalhado >= dataInicio);
-    }
-    if (dataFim) {
-        filtered = filtered.filter(r => r.dia_trabalhado <= dataFim);
-    }
-    if (servidorFilter) {
-        filtered = filtered.filter(r =>
-            String(r.nf).toLowerCase().includes(servidorFilter) ||
-            String(r.nome || '').toLowerCase().includes(servidorFilter)
-        );
-    }
+    // Página por keyset (ordem dia_trabalhado desc) e totais dos mesmos filtros
+    const seq = ++renderRegistrosSeq;
+    const filtros = filtrosRegistros();
+    const params = new URLSearchParams(filtros);
+    params.set('limite', perPage);
+    if (registrosCursores[page - 1]) params.set('cursor', registrosCursores[page - 1]);
 
-    return filtered;
-}
+    let pagina, resumo;
+    try {
+        [pagina, resumo] = await Promise.all([
+            API.get(`/api/dias-trabalhados?${params}`),
+            API.get(`/api/relatorios/agregados?${filtros}`)
+        ]);
+    } catch (error) {
+        console.error('Erro ao carregar registros:', error);
+        return;
+    }
+    if (seq !== renderRegistrosSeq) return;  // filtro já mudou: resposta antiga
 
-function renderRegistros(page = 1) {
-    const tbody = document.getElementById('tbody-registros');
-    
-    // Aplicar filtros
-    let filtered = getFilteredRegistros();
-    
-    // Ordenar por data decrescente
-    filtered.sort((a, b) => new Date(b.dia_trabalhado) - new Date(a.dia_trabalhado));
-    
-    // Paginação
-    const total = filtered.length;
+    currentPage = page;
+    registrosCursores[page] = pagina.proximoCursor;
+    const paginated = pagina.registros;
+    paginated.forEach(r => registrosPorId.set(r.id, r));
+    const total = resumo.total.registros;
     const totalPages = Math.ceil(total / perPage);
-    const start = (page - 1) * perPage;
-    const paginated = filtered.slice(start, start + perPage);
     
     if (paginated.length === 0) {
         tbody.innerHTML = `
@@ -512,57 +541,34 @@ function renderRegistros(page = 1) {
     document.getElementById('reg-showing').textContent = paginated.length;
     document.getElementById('reg-total').textContent = total;
 
-    renderRegistrosResumo(filtered);
+    renderRegistrosResumo(resumo.porServidor);
 
-    renderPagination('pagination-registros', page, totalPages, (p) => {
-        currentPage = p;
+    renderPaginacaoCursor('pagination-registros', page, totalPages, Boolean(pagina.proximoCursor), (p) => {
         renderRegistros(p);
     });
 }
 
 
-function renderRegistrosResumo(filteredRegs = []) {
+function renderRegistrosResumo(porServidor = []) {
     const tbody = document.getElementById('tbody-registros-resumo');
     if (!tbody) return;
 
-    const mapa = new Map();
-    filteredRegs.forEach(r => {
-        const key = r.nf;
-        if (!mapa.has(key)) {
-            mapa.set(key, {
-                nf: r.nf,
-                nome: r.nome || '-',
-                setor: r.setor || '-',
-                registros: 0,
-                direito: [],
-                gozadas: []
-            });
-        }
-        const item = mapa.get(key);
-        item.registros += 1;
-        item.direito.push(r.h_direito || '00:00');
-        item.gozadas.push(r.horas_descontadas || '00:00');
-    });
-
-    const rows = Array.from(mapa.values()).map(i => {
-        const totalDireito = somarHoras(i.direito);
-        const totalGozadas = somarHoras(i.gozadas);
-
-        const [hd, md] = totalDireito.split(':').map(Number);
-        const [hg, mg] = totalGozadas.split(':').map(Number);
-        const saldoMin = (hd * 60 + md) - (hg * 60 + mg);
-        const saldo = `${saldoMin < 0 ? '-' : ''}${String(Math.floor(Math.abs(saldoMin) / 60)).padStart(2, '0')}:${String(Math.abs(saldoMin) % 60).padStart(2, '0')}`;
+    const rows = porServidor.map(i => {
+        const totalDireito = minutesToTime(i.direitoMin);
+        const totalGozadas = minutesToTime(i.descontadasMin);
+        const saldoMin = i.direitoMin - i.descontadasMin;
+        const saldo = minutesToTime(saldoMin);
 
         return `
             <tr>
                 <td class="cell-nf">${i.nf}</td>
-                <td class="cell-name">${i.nome}</td>
-                <td><span class="cell-setor">${i.setor}</span></td>
+                <td class="cell-name">${i.nome || '-'}</td>
+                <td><span class="cell-setor">${i.setor || '-'}</span></td>
                 <td>${i.registros}</td>
                 <td><span class="cell-hours neutral">${formatHoursWithH(totalDireito)}</span></td>
-                <td>${(timeToMinutes(totalDireito) / 480).toFixed(2)} dias</td>
+                <td>${(i.direitoMin / 480).toFixed(2)} dias</td>
                 <td><span class="cell-hours negative">${formatHoursWithH(totalGozadas)}</span></td>
-                <td>${(timeToMinutes(totalGozadas) / 480).toFixed(2)} dias</td>
+                <td>${(i.descontadasMin / 480).toFixed(2)} dias</td>
                 <td><span class="cell-hours ${getSaldoClass(saldo)}">${formatHoursWithH(saldo)}</span></td>
                 <td>${(saldoMin / 480).toFixed(2)} dias</td>
             </tr>
@@ -595,63 +601,37 @@ function formatFilterDescription(ctx) {
     return filtros.length ? filtros.join(' | ') : 'Visão geral (todos os dados)';
 }
 
-function computeDashboardData() {
+async function computeDashboardData() {
     const ctx = getDashboardFilterContext();
-    const filtered = registros.filter(r => {
-        if (ctx.filterType === 'setor' && ctx.setor && r.setor !== ctx.setor) return false;
-        if (ctx.filterType === 'servidor' && ctx.servidor && r.nf !== ctx.servidor) return false;
-
-        const d = r.dia_trabalhado ? new Date(r.dia_trabalhado) : null;
-        if (ctx.startMonth && d) {
-            const start = new Date(`${ctx.startMonth}-01T00:00:00`);
-            if (d < start) return false;
-        }
-        if (ctx.endMonth && d) {
-            const end = new Date(`${ctx.endMonth}-01T00:00:00`);
-            end.setMonth(end.getMonth() + 1);
-            if (d >= end) return false;
-        }
-        return true;
-    });
-
-    const porMes = new Map();
-    const porSetor = new Map();
-    const porServidor = new Map();
-
-    filtered.forEach(r => {
-        const mes = r.dia_trabalhado ? r.dia_trabalhado.slice(0, 7) : 'Sem data';
-        if (!porMes.has(mes)) porMes.set(mes, { trab: 0, direito: 0, descontadas: 0 });
-        porMes.get(mes).trab += timeToMinutes(r.h_trabalhada || '00:00');
-        porMes.get(mes).direito += timeToMinutes(r.h_direito || '00:00');
-        porMes.get(mes).descontadas += timeToMinutes(r.horas_descontadas || '00:00');
-
-        const saldo = timeToMinutes(r.h_direito || '00:00') - timeToMinutes(r.horas_descontadas || '00:00');
-        porSetor.set(r.setor || 'Sem setor', (porSetor.get(r.setor || 'Sem setor') || 0) + saldo);
-        const servidorNome = `${r.nome || 'Sem nome'} (${r.nf})`;
-        porServidor.set(servidorNome, (porServidor.get(servidorNome) || 0) + saldo);
-    });
+    const params = new URLSearchParams();
+    if (ctx.filterType === 'setor' && ctx.setor) params.set('setor', ctx.setor);
+    if (ctx.filterType === 'servidor' && ctx.servidor) params.set('nf', ctx.servidor);
+    if (ctx.startMonth) params.set('data_inicio', `${ctx.startMonth}-01`);
+    if (ctx.endMonth) {
+        const [ano, mes] = ctx.endMonth.split('-').map(Number);
+        params.set('data_fim', formatISODate(new Date(ano, mes, 0)));  // último dia do mês
+    }
+    const dados = await API.get(`/api/relatorios/agregados?${params}`);
 
-    const labelsMes = Array.from(porMes.keys()).sort();
-    const dadosTrab = labelsMes.map(m => +(porMes.get(m).trab / 60).toFixed(2));
-    const dadosDireito = labelsMes.map(m => +(porMes.get(m).direito / 60).toFixed(2));
-    const dadosDescontadas = labelsMes.map(m => +(porMes.get(m).descontadas / 60).toFixed(2));
+    const labelsMes = dados.porMes.map(m => m.mes);
+    const dadosTrab = dados.porMes.map(m => +(m.trabalhadasMin / 60).toFixed(2));
+    const dadosDireito = dados.porMes.map(m => +(m.direitoMin / 60).toFixed(2));
+    const dadosDescontadas = dados.porMes.map(m => +(m.descontadasMin / 60).toFixed(2));
 
-    const setoresRank = Array.from(porSetor.entries()).sort((a, b) => b[1] - a[1]).slice(0, 10);
+    const setoresRank = dados.porSetor.map(s => [s.setor, s.direitoMin - s.descontadasMin])
+        .sort((a, b) => b[1] - a[1]).slice(0, 10);
     const labelsSetor = setoresRank.map(([k]) => k);
     const dadosSetor = setoresRank.map(([, v]) => +(v / 60).toFixed(2));
 
-    const tops = Array.from(porServidor.entries()).sort((a, b) => b[1] - a[1]).slice(0, 10);
+    const tops = dados.porServidor.map(s => [`${s.nome || 'Sem nome'} (${s.nf})`, s.direitoMin - s.descontadasMin])
+        .sort((a, b) => b[1] - a[1]).slice(0, 10);
     const labelsTop = tops.map(([k]) => k);
     const dadosTop = tops.map(([, v]) => +(v / 60).toFixed(2));
 
-    const totalTrabalhadas = filtered.reduce((acc, r) => acc + timeToMinutes(r.h_trabalhada || '00:00'), 0);
-    const totalDireito = filtered.reduce((acc, r) => acc + timeToMinutes(r.h_direito || '00:00'), 0);
-    const totalDescontadas = filtered.reduce((acc, r) => acc + timeToMinutes(r.horas_descontadas || '00:00'), 0);
-    const saldoMinutos = totalDireito - totalDescontadas;
-
+    const total = dados.total;
     return {
         ctx,
-        filtered,
+        totalRegistros: total.registros,
         labelsMes,
         dadosTrab,
         dadosDireito,
@@ -660,10 +640,10 @@ function computeDashboardData() {
         dadosSetor,
         labelsTop,
         dadosTop,
-        totalTrabalhadas,
-        totalDireito,
-        totalDescontadas,
-        saldoMinutos
+        totalTrabalhadas: total.trabalhadasMin,
+        totalDireito: total.direitoMin,
+        totalDescontadas: total.descontadasMin,
+        saldoMinutos: total.direitoMin - total.descontadasMin
     };
 }
 
@@ -708,9 +688,9 @@ function updateDashboardFilterFields() {
 }
 
 async function exportDashboardReportPDF() {
-    if (!dashboardLastData) loadDashboardCharts();
+    if (!dashboardLastData) await loadDashboardCharts();
     const data = dashboardLastData;
-    if (!data || !data.filtered.length) {
+    if (!data || !data.totalRegistros) {
         showToast('error', 'Sem dados', 'Não há dados para exportar com os filtros selecionados.');
         return;
     }
@@ -744,7 +724,7 @@ async function exportDashboardReportPDF() {
     </style></head><body><div class="report">
     <div class="header"><h1>Relatório Gerencial • Banco de Horas</h1><div class="meta">${formatFilterDescription(data.ctx)}<br>Emitido em: ${now.toLocaleString('pt-BR')}</div></div>
     <div class="kpis">
-      <div class="kpi"><h3>Registros</h3><p>${data.filtered.length}</p></div>
+      <div class="kpi"><h3>Registros</h3><p>${data.totalRegistros}</p></div>
       <div class="kpi"><h3>Horas trabalhadas</h3><p>${minutesToHourLabel(data.totalTrabalhadas)}</p></div>
       <div class="kpi"><h3>Horas de direito</h3><p>${minutesToHourLabel(data.totalDireito)}</p></div>
       <div class="kpi"><h3>Saldo</h3><p>${minutesToHourLabel(data.saldoMinutos)}</p></div>
@@ -775,7 +755,15 @@ async function loadDashboardCharts() {
     const canvasTop = document.getElementById('chart-top-servidores');
     if (!canvasHoras || !canvasSetor || !canvasTop) return;
 
-    const data = computeDashboardData();
+    const seq = ++dashboardSeq;
+    let data;
+    try {
+        data = await computeDashboardData();
+    } catch (error) {
+        console.error('Erro ao carregar dashboard:', error);
+        return;
+    }
+    if (seq !== dashboardSeq) return;  // filtro já mudou: resposta antiga
     dashboardLastData = data;
 
     const allLine = [...data.dadosTrab, ...data.dadosDireito, ...data.dadosDescontadas];
@@ -858,19 +846,13 @@ function renderServidores(page = 1) {
             </tr>
         `;
     } else {
+        const totaisPorNf = new Map((agregadoGeral?.porServidor || []).map(i => [i.nf, i]));
         tbody.innerHTML = paginated.map(s => {
-            // Calcular horas do servidor
-            const regsServidor = registros.filter(r => r.nf === s.nf);
-            const horasTrab = somarHoras(regsServidor.map(r => r.h_trabalhada));
-            const horasDireito = somarHoras(regsServidor.map(r => r.h_direito));
-            const horasGozadas = somarHoras(regsServidor.map(r => r.horas_descontadas).filter(Boolean));
-            
-            const [hd, md] = horasDireito.split(':').map(Number);
-            const [hg, mg] = horasGozadas.split(':').map(Number);
-            const saldoMin = (hd * 60 + md) - (hg * 60 + mg);
-            const saldoH = Math.floor(Math.abs(saldoMin) / 60);
-            const saldoM = Math.abs(saldoMin) % 60;
-            const saldo = `${saldoMin < 0 ? '-' : ''}${String(saldoH).padStart(2, '0')}:${String(saldoM).padStart(2, '0')}`;
+            // Horas do servidor (totais agregados no servidor)
+            const totais = totaisPorNf.get(s.nf);
+            const horasTrab = minutesToTime(totais ? totais.trabalhadasMin : 0);
+            const saldoMin = totais ? totais.direitoMin - totais.descontadasMin : 0;
+            const saldo = minutesToTime(saldoMin);
             const saldoClass = saldoMin >= 0 ? 'positive' : 'negative';
             
             return `
@@ -898,6 +880,23 @@ function renderServidores(page = 1) {
     });
 }
 
+function renderPaginacaoCursor(containerId, currentPage, totalPages, temProxima, onPageChange) {
+    // Paginação keyset: só anterior/próxima (páginas são alcançadas em sequência)
+    const container = document.getElementById(containerId);
+    if (!container) return;
+    if (currentPage === 1 && !temProxima) {
+        container.innerHTML = '';
+        return;
+    }
+
+    container.innerHTML = `
+        <button class="pagination-btn" ${currentPage === 1 ? 'disabled' : ''} onclick="(${onPageChange})(${currentPage - 1})">‹</button>
+        <button class="pagination-btn active">${currentPage}</button>
+        <span style="padding: 0 0.5rem;">de ${totalPages}</span>
+        <button class="pagination-btn" ${temProxima ? '' : 'disabled'} onclick="(${onPageChange})(${currentPage + 1})">›</button>
+    `;
+}
+
 function renderPagination(containerId, currentPage, totalPages, onPageChange) {
     const container = document.getElementById(containerId);
     if (!container || totalPages <= 1) {
@@ -945,8 +944,18 @@ async function consultarServidor(nf) {
     document.getElementById('servidor-nf').textContent = servidor.nf;
     document.getElementById('servidor-setor').textContent = servidor.setor || '-';
     
+    // Histórico do servidor (só os registros dele)
+    let regsServidor;
+    try {
+        regsServidor = await API.get(`/api/dias-trabalhados/servidor/${encodeURIComponent(nf)}`);
+    } catch (error) {
+        console.error(error);
+        showToast('error', 'Erro', 'Não foi possível carregar os registros do servidor');
+        return;
+    }
+    regsServidor.forEach(r => registrosPorId.set(r.id, r));
+
     // Calcular estatísticas
-    const regsServidor = registros.filter(r => r.nf === nf);
     const horasTrab = somarHoras(regsServidor.map(r => r.h_trabalhada));
     const horasDireito = somarHoras(regsServidor.map(r => r.h_direito));
     const horasGozadas = somarHoras(regsServidor.map(r => r.horas_descontadas).filter(Boolean));
@@ -1072,7 +1081,7 @@ async function salvarServidor() {
 }
 
 function editarRegistro(id) {
-    const registro = registros.find(r => r.id === id);
+    const registro = registrosPorId.get(id);
     if (!registro) return;
     
     document.getElementById('edit-reg-id').value = id;
@@ -1126,7 +1135,7 @@ async function atualizarRegistro() {
 
 
 function abrirModalGozo(id) {
-    const registro = registros.find(r => r.id === id);
+    const registro = registrosPorId.get(id);
     if (!registro) return;
 
     document.getElementById('gozo-reg-id').value = id;
@@ -1156,7 +1165,7 @@ function bindGozoAutoCalc() {
 
     function getContext() {
         const id = Number(document.getElementById('gozo-reg-id').value);
-        const registro = registros.find(r => r.id === id);
+        const registro = registrosPorId.get(id);
         const minDia = timeToMinutes((registro?.hora_dia || '08:00')) || 480;
         const direitoMin = timeToMinutes(registro?.h_direito || '00:00');
         return { minDia, direitoMin };
@@ -1348,6 +1357,7 @@ const ALERTA_DIAS_LIMITE = 30;
 let currentCalendarMonth = new Date().getMonth();
 let currentCalendarYear = new Date().getFullYear();
 let alertasData = [];
+let calendarioData = null;
 
 function initCalendario() {
     document.getElementById('btn-prev-month')?.addEventListener('click', () => {
@@ -1386,47 +1396,27 @@ function initCalendario() {
     });
 }
 
-function calcularAlertas() {
-    const hoje = new Date();
-    hoje.setHours(0, 0, 0, 0);
-    
-    alertasData = [];
-    
-    registros.forEach(r => {
-        if (!r.prazo_max) return;
-        
-        const prazoDate = parseDate(r.prazo_max);
-        if (!prazoDate) return;
-        
-        const diffTime = prazoDate.getTime() - hoje.getTime();
-        const diffDays = Math.ceil(diffTime / (1000 * 60 * 60 * 24));
-
-        // Alertar APENAS quando faltar exatamente 30 dias para o prazo máximo
-        if (diffDays === ALERTA_DIAS_LIMITE) {
-            const servidor = servidores.find(s => s.nf === r.nf);
-
-            // Só adicionar se tiver nome do servidor
-            if (!servidor?.nome) return;
-
-            const dataAviso = new Date(prazoDate);
-            dataAviso.setDate(dataAviso.getDate() - ALERTA_DIAS_LIMITE);
-
-            alertasData.push({
-                id: r.id,
-                nf: r.nf,
-                nome: servidor.nome,
-                setor: servidor.setor || '-',
-                prazo_max: r.prazo_max,
-                prazoDate: prazoDate,
-                data_aviso: dataAviso,
-                diasRestantes: diffDays,
-                tipo: 'warning'
-            });
-        }
-    });
-    
-    // Ordenar por dias restantes
-    alertasData.sort((a, b) => a.diasRestantes - b.diasRestantes);
+function formatISODate(data) {
+    const mes = String(data.getMonth() + 1).padStart(2, '0');
+    const dia = String(data.getDate()).padStart(2, '0');
+    return `${data.getFullYear()}-${mes}-${dia}`;
+}
+
+async function calcularAlertas() {
+    // O servidor devolve só os registros no marco de 30 dias (busca pelo índice de prazo_max)
+    try {
+        const resposta = await API.get(`/api/alertas?janela=${ALERTA_DIAS_LIMITE}&exato=1&hoje=${formatISODate(new Date())}`);
+        alertasData = resposta.alertas.map(a => ({
+            ...a,
+            setor: a.setor || '-',
+            prazoDate: parseDate(a.prazo_max),
+            data_aviso: parseDate(a.data_aviso),
+            tipo: 'warning'
+        }));
+    } catch (error) {
+        console.error('Erro ao carregar alertas:', error);
+        alertasData = [];
+    }
     
     // Atualizar badges
     const count = alertasData.length;
@@ -1487,12 +1477,25 @@ function renderNotifications() {
     `).join('');
 }
 
-function renderCalendario() {
+async function renderCalendario() {
     const container = document.getElementById('calendario-days');
     const titleEl = document.getElementById('calendario-title');
     
     if (!container) return;
     
+    // Lembretes e contagens do mês vêm do servidor (só o intervalo do mês)
+    const mes = `${currentCalendarYear}-${String(currentCalendarMonth + 1).padStart(2, '0')}`;
+    try {
+        const dados = await API.get(`/api/calendario?mes=${mes}`);
+        // Navegação rápida entre meses: descartar respostas de um mês que já não está na tela
+        const mesAtual = `${currentCalendarYear}-${String(currentCalendarMonth + 1).padStart(2, '0')}`;
+        if (dados.mes !== mesAtual) return;
+        calendarioData = dados;
+    } catch (error) {
+        console.error('Erro ao carregar calendário:', error);
+        calendarioData = null;
+    }
+    
     const meses = ['Janeiro', 'Fevereiro', 'Março', 'Abril', 'Maio', 'Junho', 
                    'Julho', 'Agosto', 'Setembro', 'Outubro', 'Novembro', 'Dezembro'];
     
@@ -1557,39 +1560,14 @@ function renderCalendario() {
 }
 
 function getEventosNoDia(data) {
-    const eventos = [];
-    const dataStr = data.toISOString().split('T')[0];
-    const hoje = new Date();
-    hoje.setHours(0, 0, 0, 0);
-    
-    registros.forEach(r => {
-        if (!r.prazo_max) return;
-        
-        const prazoDate = parseDate(r.prazo_max);
-        if (!prazoDate) return;
-        
-        const prazoStr = prazoDate.toISOString().split('T')[0];
-        const servidor = servidores.find(s => s.nf === r.nf);
-        
-        // Só mostrar se tiver nome do servidor
-        if (!servidor?.nome) return;
-        
-        // Registrar evento de lembrete exatamente 30 dias antes do prazo máximo
-        const dataAviso = new Date(prazoDate);
-        dataAviso.setDate(dataAviso.getDate() - ALERTA_DIAS_LIMITE);
-        const avisoStr = dataAviso.toISOString().split('T')[0];
-
-        if (avisoStr === dataStr) {
-            eventos.push({
-                nf: r.nf,
-                nome: servidor.nome,
-                tipo: 'warning',
-                label: 'Lembrete de 30 dias'
-            });
-        }
-    });
-    
-    return eventos;
+    // Lembrete exatamente 30 dias antes do prazo máximo (calculado no servidor)
+    const eventos = calendarioData?.eventos?.[formatISODate(data)] || [];
+    return eventos.map(e => ({
+        nf: e.nf,
+        nome: e.nome,
+        tipo: 'warning',
+        label: 'Lembrete de 30 dias'
+    }));
 }
 
 function parseDate(dateStr) {
@@ -1707,13 +1685,9 @@ function setupAutoCalculate() {
 async function loadAdminPortal() {
     if (sessionStorage.getItem('userRole') !== 'admin') return;
 
-    const username = sessionStorage.getItem('userName');
-    const adminPassword = sessionStorage.getItem('adminPassword') || '260220';
-
     try {
         const users = await API.post('/api/admin/users', {
-            admin_user: username,
-            admin_password: adminPassword
+            admin_token: sessionStorage.getItem('authToken')
         });
 
         const tbody = document.getElementById('tbody-admin-users');
@@ -1741,8 +1715,7 @@ async function gerarTokenAdmin() {
 
     try {
         const payload = {
-            admin_user: sessionStorage.getItem('userName'),
-            admin_password: sessionStorage.getItem('adminPassword') || '260220',
+            admin_token: sessionStorage.getItem('authToken'),
             username
         };
         const result = await API.post('/api/admin/token', payload);
@@ -1940,6 +1913,7 @@ function initApp() {
     document.getElementById('btn-logout')?.addEventListener('click', () => {
         sessionStorage.removeItem('isLoggedIn');
         sessionStorage.removeItem('userName');
+        sessionStorage.removeItem('authToken');
         window.location.reload();
     });
 